@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Memory and time of OntdekBaan traversals on a synthetic commit graph.
+
+Compares the deep copy of the graph which OntdekBaan used to make for every traversal with the read-only view it uses now.
+Every traversal is set up and all of its paths are materialised (backward from the newest commit), Volg runs two traversals per release,
+this is simulated by the number of traversals. Every measurement runs in a forked process, reported are the peak of the traced
+Python allocations, the growth of the peak RSS of that process and the time for setup and traversal.
+
+python -m benchmarks.ontdekbaan_memory --nodes 200000 --traversals 2
+"""
+
+import argparse
+import multiprocessing
+import random
+import timeit
+import resource
+import tracemalloc
+
+import networkx as nx
+
+from mynbou.graph import CommitGraph
+from mynbou.path import OntdekBaan
+
+
+def synthetic_dag(nodes, merge_probability=0.1, seed=42):
+    """Create a NetworkX commit graph where every commit has a parent among the last commits and sometimes a second one."""
+    rnd = random.Random(seed)
+    g = nx.DiGraph()
+    g.add_node('{:040x}'.format(0))
+    for n in range(1, nodes):
+        g.add_edge('{:040x}'.format(rnd.randrange(max(0, n - 10), n)), '{:040x}'.format(n))
+        if n > 2 and rnd.random() < merge_probability:
+            g.add_edge('{:040x}'.format(rnd.randrange(0, n - 1)), '{:040x}'.format(n))
+    return g
+
+
+class CopyingOntdekBaan(OntdekBaan):
+    """OntdekBaan as it was before the read-only view, with a deep copy of the graph per traversal."""
+
+    def __init__(self, g):
+        super().__init__(g)
+        self._graph = g.copy()
+
+
+def measure(graph, start, traversals, traversal_class, results):
+    """Put the traced peak memory in MiB, the growth of the peak RSS in MiB, the number of paths and the time in seconds for the traversals into results."""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    tracemalloc.start()
+    begin = timeit.default_timer()
+    paths = 0
+    for _ in range(traversals):
+        o = traversal_class(graph)
+        o.set_path(start, 'backward')
+        paths += len(list(o.all_paths()))
+    end = timeit.default_timer() - begin
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    # ru_maxrss is in KiB on Linux
+    rss_growth = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024
+    results.put((peak / 1024 / 1024, rss_growth, paths, end))
+
+
+def measure_forked(graph, start, traversals, traversal_class):
+    """Run :any:`measure` in a forked process which shares the graph, so that the peak RSS of every measurement is its own."""
+    context = multiprocessing.get_context('fork')
+    results = context.Queue()
+    process = context.Process(target=measure, args=(graph, start, traversals, traversal_class, results))
+    process.start()
+    result = results.get()
+    process.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--nodes', type=int, default=200000)
+    parser.add_argument('--traversals', type=int, default=2)
+    args = parser.parse_args()
+
+    nx_graph = synthetic_dag(args.nodes)
+    commit_graph = CommitGraph.from_networkx(nx_graph)
+
+    start = '{:040x}'.format(args.nodes - 1)
+
+    print('{:<12} {:<10} {:>12} {:>12} {:>10} {:>10}'.format('graph', 'mode', 'peak MiB', 'RSS +MiB', 'paths', 'seconds'))
+    for name, graph in [('networkx', nx_graph), ('CommitGraph', commit_graph)]:
+        for mode, traversal_class in [('view', OntdekBaan), ('copy', CopyingOntdekBaan)]:
+            peak, rss_growth, paths, seconds = measure_forked(graph, start, args.traversals, traversal_class)
+            print('{:<12} {:<10} {:>12.2f} {:>12.2f} {:>10} {:>10.4f}'.format(name, mode, peak, rss_growth, paths, seconds))
+
+
+if __name__ == '__main__':
+    main()
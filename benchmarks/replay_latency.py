@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Round-trip sensitivity of the mining phases, replayed from a recorded MongoDB trace.
+
+The trace is recorded with smartshark_plugin.py --record-trace, then the release is mined once per latency from the
+:any:`ReplayServer`. Phases whose time grows with the latency by roughly queries * latency are bound by round trips.
+
+python -m benchmarks.replay_latency --trace trace.bson.gz --db-database smartshark --project-name commons-math --release-commit <hash> --latency-ms 0 1 5
+"""
+
+import argparse
+import timeit
+
+from mongoengine import connect
+from mongoengine.connection import disconnect
+from pymongo import monitoring
+from pycoshark.mongomodels import Project, VCSSystem
+
+from mynbou.core import Mynbou
+from mynbou.resolver import FileResolver
+from mynbou.querystats import QUERY_STATS
+from mynbou.mongotrace import ReplayServer
+
+
+def replay(args, latency_ms):
+    """Mine the release from the trace with the given latency, return the wall time and the query statistics."""
+    server = ReplayServer(args.trace, latency=latency_ms / 1000, fallback=args.fallback)
+    server.start()
+    try:
+        connect(args.db_database, host='mongodb://{}:{}'.format(*server.server_address))
+
+        # every run starts cold so that it issues the recorded queries
+        FileResolver.reset()
+        QUERY_STATS.reset()
+
+        start = timeit.default_timer()
+        project_id = Project.objects.get(name=args.project_name).id
+        vcs = VCSSystem.objects.get(project_id=project_id)
+        Mynbou(vcs, args.project_name, args.release_commit, traversal=args.traversal).release(args.type)
+        end = timeit.default_timer() - start
+    finally:
+        disconnect()
+        server.stop()
+    return end, QUERY_STATS.summary()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--trace', required=True)
+    parser.add_argument('--db-database', default='smartshark')
+    parser.add_argument('--project-name', required=True)
+    parser.add_argument('--release-commit', required=True)
+    parser.add_argument('--type', default='False')
+    parser.add_argument('--traversal', choices=['paths', 'commits'], default='paths')
+    parser.add_argument('--latency-ms', type=float, nargs='+', default=[0, 1, 5])
+    parser.add_argument('--fallback', action='store_true', help='answer commands without exact match with a recorded command of the same name and collection')
+    args = parser.parse_args()
+
+    monitoring.register(QUERY_STATS)
+
+    print('{:>10} {:<16} {:>10} {:>12}'.format('latency ms', 'phase', 'queries', 'seconds'))
+    for latency_ms in args.latency_ms:
+        seconds, summary = replay(args, latency_ms)
+        for phase, stats in sorted(summary['phases'].items()):
+            print('{:>10} {:<16} {:>10} {:>12.4f}'.format(latency_ms, phase, stats['total']['queries'], stats['total']['seconds']))
+        print('{:>10} {:<16} {:>10} {:>12.4f}'.format(latency_ms, 'total', summary['total']['queries'], seconds))
+
+
+if __name__ == '__main__':
+    main()
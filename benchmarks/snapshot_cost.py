@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Cost of mining a release from a snapshot compared to the live MongoDB it was exported from.
+
+The snapshot is served by mongomock from the memory-mapped columns, queries on ids use the index of the id column and
+every other query scans the collection. The release is mined once from the MongoDB and once from the snapshot, the time
+to connect, to load the graph and rename index and to mine the release are reported together with the peak RSS of the
+process after each run.
+
+python -m benchmarks.snapshot_cost --snapshot snapshot/ --db-database smartshark --project-name commons-math --release-commit <hash>
+"""
+
+import argparse
+import resource
+import timeit
+
+from mongoengine import connect
+from mongoengine.connection import disconnect
+from pycoshark.mongomodels import Project, VCSSystem
+from pycoshark.utils import create_mongodb_uri_string
+
+from mynbou.core import Mynbou
+from mynbou.snapshot import Snapshot
+
+
+def mine(args, connect_database):
+    """Connect with connect_database, then mine the release, return the seconds of every step and the peak RSS in MiB."""
+    seconds = {}
+    start = timeit.default_timer()
+    connect_database()
+    seconds['connect'] = timeit.default_timer() - start
+    try:
+        start = timeit.default_timer()
+        project_id = Project.objects.get(name=args.project_name).id
+        vcs = VCSSystem.objects.get(project_id=project_id)
+        m = Mynbou(vcs, args.project_name, args.release_commit, traversal=args.traversal)
+        seconds['graph and lineage'] = timeit.default_timer() - start
+
+        start = timeit.default_timer()
+        m.release(args.type)
+        seconds['release'] = timeit.default_timer() - start
+    finally:
+        disconnect()
+    return seconds, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--snapshot', required=True)
+    parser.add_argument('--db-user', default=None)
+    parser.add_argument('--db-password', default=None)
+    parser.add_argument('--db-hostname', default='localhost')
+    parser.add_argument('--db-port', type=int, default=27017)
+    parser.add_argument('--db-authentication', default=None)
+    parser.add_argument('--db-database', default='smartshark')
+    parser.add_argument('--project-name', required=True)
+    parser.add_argument('--release-commit', required=True)
+    parser.add_argument('--type', default='False')
+    parser.add_argument('--traversal', choices=['paths', 'commits'], default='paths')
+    args = parser.parse_args()
+
+    uri = create_mongodb_uri_string(args.db_user, args.db_password, args.db_hostname, args.db_port, args.db_authentication, False)
+    runs = [('mongodb', lambda: connect(args.db_database, host=uri)),
+            ('snapshot', lambda: Snapshot(args.snapshot).connect(release_hash=args.release_commit))]
+
+    print('{:<10} {:<18} {:>12}'.format('source', 'step', 'seconds'))
+    for name, connect_database in runs:
+        seconds, peak_rss = mine(args, connect_database)
+        for step, value in seconds.items():
+            print('{:<10} {:<18} {:>12.4f}'.format(name, step, value))
+        print('{:<10} {:<18} {:>12.4f}'.format(name, 'total', sum(seconds.values())))
+        print('{:<10} {:<18} {:>12.1f}'.format(name, 'peak rss MiB', peak_rss))
+
+
+if __name__ == '__main__':
+    main()
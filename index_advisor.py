@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""This module checks the indexes of a SmartSHARK database for the query shapes mynbou relies on.
+
+Every shape is listed with the index that serves it and the stages of its winning plan, collection scans are marked.
+With --create-index the createIndex statements for the shapes which are collection scans are printed.
+"""
+import logging
+
+from pycoshark.utils import create_mongodb_uri_string
+from pycoshark.utils import get_base_argparser
+
+from mongoengine import connect
+
+from mynbou.indexes import advise, collection_name, create_index_statement
+
+log = logging.getLogger()
+log.setLevel(logging.INFO)
+
+
+def main(args):
+    if args.log_level and hasattr(logging, args.log_level):
+        log.setLevel(getattr(logging, args.log_level))
+
+    uri = create_mongodb_uri_string(args.db_user, args.db_password, args.db_hostname, args.db_port, args.db_authentication, args.ssl)
+    connect(args.db_database, host=uri)
+
+    advice = advise()
+
+    print('{:<18} {:<50} {:<30} {:<30} {}'.format('collection', 'shape', 'index', 'winning plan', 'call site'))
+    for a in advice:
+        fields = ', '.join(name for name, _ in a.shape.fields)
+        stages = ' < '.join(a.stages) if a.stages is not None else 'explain failed'
+        marker = ' COLLSCAN' if a.collscan else ''
+        print('{:<18} {:<50} {:<30} {:<30} {}{}'.format(collection_name(a.shape), fields, a.index or '-', stages, a.shape.call_site, marker))
+
+    collscans = [a for a in advice if a.collscan]
+    print('{} of {} query shapes are collection scans'.format(len(collscans), len(advice)))
+
+    if args.create_index:
+        for a in collscans:
+            print(create_index_statement(a.shape))
+
+
+if __name__ == '__main__':
+    parser = get_base_argparser('Check the indexes of the database for the queries of mynbou.', '1.0.0')
+    parser.add_argument('-ll', '--log-level', help='Log level for stdout (DEBUG, INFO), default INFO', default='INFO')
+    parser.add_argument('--create-index', help='Print the createIndex statements for the query shapes which are collection scans.', action='store_true')
+
+    main(parser.parse_args())
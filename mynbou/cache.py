@@ -0,0 +1,267 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the on-disk caches of mynbou.
+
+GraphCache keeps the commit graph of one VCS as compact arrays (revision hashes, parent adjacency and commit dates) which are memory-mapped on load.
+The cache is keyed by the vcs_system_id and the newest commit it has seen, new commits are appended incrementally.
+RenameCache keeps the :any:`RenameIndex` of one VCS as compressed JSON, it is extended incrementally for new commits in the same way.
+ClassMetricCache is a materialised view of the averaged class metrics per commit and file, filled lazily for every commit that is sampled.
+"""
+
+import os
+import gzip
+import json
+import logging
+
+import numpy as np
+from bson.objectid import ObjectId
+
+from pycoshark.mongomodels import Commit
+
+from mynbou.graph import fetch_commits, fetch_label_flags, empty_arrays, append_commits, object_id
+from mynbou.prefetch import class_metric_averages
+from mynbou.constants import DAMBROS_METRICS
+from mynbou.lineage import RenameIndex, scan_lineage
+
+
+class GraphCache(object):
+    """Persistent commit graph of one VCS.
+
+    The graph is stored as arrays in the order the commits were inserted into the database:
+    object_ids, revision_hashes and the columns of the :any:`CommitAttributes` per commit and the parents as compressed sparse rows (parent_indptr, parent_indices).
+    Parents which are not (yet) part of the VCS are kept in the metadata so that they can be resolved on a later refresh.
+    The label flags are not stored, labels are added to old commits after they were inserted, they are read fresh on every refresh.
+    """
+
+    VERSION = 3
+    ARRAYS = ['object_ids', 'revision_hashes', 'parent_indptr', 'parent_indices', 'committer_dates', 'author_dates', 'parent_counts', 'author_ids']
+
+    def __init__(self, cache_dir, vcs_system_id):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.vcs_system_id = vcs_system_id
+        self.path = os.path.join(cache_dir, str(vcs_system_id), 'graph')
+
+    def _meta_file(self):
+        return os.path.join(self.path, 'meta.json')
+
+    def _array_file(self, name):
+        return os.path.join(self.path, '{}.npy'.format(name))
+
+    def load(self):
+        """Load the cached graph, arrays are memory-mapped, the label flags are not part of the cache.
+
+        :rtype: tuple
+        :returns: (meta, arrays) or None if there is no usable cache
+        """
+        try:
+            with open(self._meta_file(), 'r') as f:
+                meta = json.load(f)
+            arrays = {name: np.load(self._array_file(name), mmap_mode='r') for name in self.ARRAYS}
+        except (IOError, OSError, ValueError):
+            return None
+
+        if meta.get('version') != self.VERSION or meta.get('vcs_system_id') != str(self.vcs_system_id):
+            return None
+
+        # the metadata is written last, if the arrays do not match it the cache was not completely written
+        if len(arrays['object_ids']) != meta['count'] or len(arrays['parent_indptr']) != meta['count'] + 1:
+            return None
+        return meta, arrays
+
+    def save(self, meta, arrays):
+        """Write arrays and metadata of the graph, the label flags are not written."""
+        os.makedirs(self.path, exist_ok=True)
+        for name in self.ARRAYS:
+            tmp = self._array_file(name) + '.tmp'
+            with open(tmp, 'wb') as f:
+                np.save(f, arrays[name])
+            os.replace(tmp, self._array_file(name))
+
+        tmp = self._meta_file() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._meta_file())
+
+    def refresh(self):
+        """Return the graph arrays for the VCS, loading only commits which are not already cached.
+
+        If there is no cache or the number of commits in the database does not match the cache it is rebuilt from scratch.
+        The label flags of the cached commits are read from the database with one projected cursor.
+
+        :rtype: tuple
+        :returns: (meta, arrays), see class documentation
+        """
+        cached = self.load()
+        if cached is not None:
+            meta, arrays = cached
+            newest = ObjectId(meta['newest_commit_id']) if meta['newest_commit_id'] else None
+            new_commits = list(fetch_commits(self.vcs_system_id, after=newest))
+
+            if meta['count'] + len(new_commits) != Commit.objects.filter(vcs_system_id=self.vcs_system_id).count():
+                self._log.info('commit graph cache is out of sync with the database, rebuilding')
+            else:
+                # labels are added to old commits later on, they are never taken from the cache
+                arrays = dict(arrays, label_flags=fetch_label_flags(self.vcs_system_id, arrays['object_ids'], until=newest))
+                if not new_commits:
+                    self._log.debug('commit graph cache is fresh ({} commits)'.format(meta['count']))
+                    return meta, arrays
+
+                self._log.info('appending {} new commits to the commit graph cache'.format(len(new_commits)))
+                meta, arrays = self._append(meta, arrays, new_commits)
+                self.save(meta, arrays)
+                return meta, arrays
+
+        self._log.info('building commit graph cache')
+        meta, arrays = self._append(self._empty_meta(), empty_arrays(), list(fetch_commits(self.vcs_system_id)))
+        self.save(meta, arrays)
+        return meta, arrays
+
+    def _empty_meta(self):
+        return {'version': self.VERSION, 'vcs_system_id': str(self.vcs_system_id), 'newest_commit_id': None, 'count': 0, 'missing_parents': []}
+
+    def _append(self, meta, arrays, commits):
+        """Append commits to the arrays, returns new metadata and arrays."""
+        new_arrays, missing = append_commits(arrays, commits, meta['missing_parents'])
+
+        new_meta = dict(meta)
+        new_meta['count'] = len(new_arrays['object_ids'])
+        new_meta['missing_parents'] = missing
+        if commits:
+            new_meta['newest_commit_id'] = str(commits[-1][0])
+        return new_meta, new_arrays
+
+
+class RenameCache(object):
+    """Persistent rename/lineage index of one VCS.
+
+    The index is stored together with the number of commits it covers and the id of the newest one.
+    Commits are expected in the order they were inserted into the database, e.g., the object ids of the :any:`CommitGraph`.
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_dir, vcs_system_id):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.vcs_system_id = vcs_system_id
+        self.path = os.path.join(cache_dir, str(vcs_system_id), 'lineage')
+
+    def _index_file(self):
+        return os.path.join(self.path, 'renames.json.gz')
+
+    def load(self):
+        """Load the cached index.
+
+        :rtype: dict
+        :returns: stored data (version, vcs_system_id, newest_commit_id, count, lineage) or None if there is no usable cache
+        """
+        try:
+            with gzip.open(self._index_file(), 'rt') as f:
+                data = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        if data.get('version') != self.VERSION or data.get('vcs_system_id') != str(self.vcs_system_id):
+            return None
+        return data
+
+    def save(self, data):
+        """Write the index."""
+        os.makedirs(self.path, exist_ok=True)
+        tmp = self._index_file() + '.tmp'
+        with gzip.open(tmp, 'wt') as f:
+            json.dump(data, f)
+        os.replace(tmp, self._index_file())
+
+    def refresh(self, commit_ids):
+        """Return the index for the commits, scanning only commits which are not already cached.
+
+        If there is no cache or the cached commits are not a prefix of the given commits the index is rebuilt from scratch.
+
+        :param list commit_ids: ObjectIds of all commits of the VCS ordered by id
+        :rtype: RenameIndex
+        """
+        data = self.load()
+        if data is not None:
+            count = data['count']
+            if count <= len(commit_ids) and (count == 0 or str(commit_ids[count - 1]) == data['newest_commit_id']):
+                if count == len(commit_ids):
+                    self._log.debug('rename index cache is fresh ({} commits)'.format(count))
+                    return RenameIndex(data['lineage'])
+
+                self._log.info('adding {} new commits to the rename index cache'.format(len(commit_ids) - count))
+                data['lineage'].update(scan_lineage(self.vcs_system_id, commit_ids[count:]))
+                return self._store(data, commit_ids)
+            self._log.info('rename index cache is out of sync with the commit graph, rebuilding')
+
+        self._log.info('building rename index cache')
+        data = {'version': self.VERSION, 'vcs_system_id': str(self.vcs_system_id), 'lineage': scan_lineage(self.vcs_system_id, commit_ids)}
+        return self._store(data, commit_ids)
+
+    def _store(self, data, commit_ids):
+        data['count'] = len(commit_ids)
+        data['newest_commit_id'] = str(commit_ids[-1]) if commit_ids else None
+        self.save(data)
+        return RenameIndex(data['lineage'])
+
+
+class ClassMetricCache(object):
+    """Averaged class metrics (commit id, file id) -> vector ordered like DAMBROS_METRICS of one VCS.
+
+    The averages of a commit are computed by one aggregation (:any:`class_metric_averages`) when the commit is requested the first time.
+    With a cache directory every commit is stored as compressed file (file ids and a matrix of the averages) and reused by later runs,
+    without one the averages are only kept in memory.
+    """
+
+    VERSION = 1
+
+    def __init__(self, cache_dir, vcs_system_id):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.vcs_system_id = vcs_system_id
+        self.path = None
+        if cache_dir is not None:
+            self.path = os.path.join(cache_dir, str(vcs_system_id), 'class_metrics', 'v{}'.format(self.VERSION))
+        self._averages = {}
+
+    def _commit_file(self, commit_id):
+        return os.path.join(self.path, '{}.npz'.format(commit_id))
+
+    def _load(self, commit_id):
+        try:
+            with np.load(self._commit_file(commit_id)) as data:
+                return {object_id(file_id): values for file_id, values in zip(data['file_ids'], data['values'])}
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+
+    def _save(self, commit_id, averages):
+        os.makedirs(self.path, exist_ok=True)
+        file_ids = np.frombuffer(b''.join(file_id.binary for file_id in averages.keys()), dtype='V12')
+        values = np.array(list(averages.values()), dtype=np.float64).reshape(len(averages), len(DAMBROS_METRICS))
+
+        tmp = self._commit_file(commit_id) + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, file_ids=file_ids, values=values)
+        os.replace(tmp, self._commit_file(commit_id))
+
+    def averages(self, commit_id):
+        """Return the averaged class metrics of the commit.
+
+        :param ObjectId commit_id: id of the commit, its code_entity_states are only fetched if the averages are not cached
+        :rtype: dict
+        :returns: file id -> float array ordered like DAMBROS_METRICS, NaN if the metric is missing
+        """
+        if commit_id in self._averages:
+            return self._averages[commit_id]
+
+        averages = None
+        if self.path is not None:
+            averages = self._load(commit_id)
+
+        if averages is None:
+            commit = Commit.objects.filter(id=commit_id).only('code_entity_states').as_pymongo().first()
+            averages = class_metric_averages(commit.get('code_entity_states', []))
+            if self.path is not None:
+                self._save(commit_id, averages)
+        self._averages[commit_id] = averages
+        return averages
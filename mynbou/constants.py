@@ -84,6 +84,15 @@ REFACTORING_TYPES = ['rename_method',
 
 IGNORE_PACKAGE_METRICS = ['Android Rules']
 
+# commit labels kept as flags in the commit attribute store
+COMMIT_LABELS = ['validated_bugfix', 'adjustedszz_bugfix', 'issueonly_bugfix']
+
+# averaged class metrics per file used for the D'Ambros metrics, the last four are differences of two averages
+DAMBROS_METRICS = ['wmc', 'dit', 'rfc', 'noc', 'cbo', 'lcom5', 'nii', 'noi', 'tna', 'tnpa', 'tna-tnpa', 'tna-tnla', 'tloc', 'tnm', 'tnlpm', 'tnm-tnpm', 'tnm-tnlm']
+
+# maximum number of ids in one $in query of the bulk loaders
+QUERY_CHUNK_SIZE = 5000
+
 HASSAN_KEYS = [
     'HASSAN_ldhcm',
     'HASSAN_lgdhcm',
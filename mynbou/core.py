@@ -4,12 +4,17 @@
 """This module provides Mynbou class which wraps Volg, change metrics and static source code metrics for the release."""
 import logging
 
-import networkx as nx
 from dateutil.relativedelta import relativedelta
 
 from mynbou.path import Volg
+from mynbou.cache import GraphCache, RenameCache, ClassMetricCache
+from mynbou.lineage import RenameIndex
+from mynbou.inducing import InducingIndex
+from mynbou.resolver import FileResolver
+from mynbou.querystats import QUERY_STATS
+from mynbou.graph import CommitGraph, fetch_commits, empty_arrays, append_commits, object_id
 from mynbou.metrics.change import moser, hassan, dambros
-from pycoshark.mongomodels import Commit, CodeEntityState, File, CodeGroupState
+from pycoshark.mongomodels import Commit, CodeEntityState, CodeGroupState
 
 from mynbou.constants import *
 
@@ -20,43 +25,62 @@ class Mynbou(object):
     This class wraps graph construction, Volg, the change metrics implementations and metrics collection.
     """
 
-    def __init__(self, vcs, project_name, release_hash):
+    def __init__(self, vcs, project_name, release_hash, cache_dir=None, traversal='paths'):
         self._log = logging.getLogger(self.__class__.__name__)
 
         self.project_name = project_name
         self.vcs = vcs
         self.release_hash = release_hash
+        self.cache_dir = cache_dir
+        self.traversal = traversal
 
         self.files = []
         self.graph = None
+        self.lineage = None
+        self.inducing = None
+        self.class_metrics = ClassMetricCache(cache_dir, vcs.id)
 
-        self.load_graph()
+        # paths may have changed since an earlier run in this process, the resolver lives as long as this run
+        FileResolver.reset(vcs.id)
+
+        with QUERY_STATS.phase('graph'):
+            self.load_graph()
+        with QUERY_STATS.phase('lineage'):
+            self.load_lineage()
 
     def release(self, limit_type):
         """Provide a full release for the project and release hash Mynbou was initialized with.
 
         This provides every change metric, release metrics and bug fixes.
         """
+        # the SZZ loader does not use the inducing index
+        if limit_type in ['False', 'JL+R'] and self.inducing is None:
+            with QUERY_STATS.phase('inducing'):
+                self.load_inducing()
+
         self._log.info('starting change metrics')
-        v = Volg(self.graph, self.vcs, self.release_hash)
-        change_metrics = v.change_metrics()
+        with QUERY_STATS.phase('volg'):
+            v = Volg(self.graph, self.vcs, self.release_hash, traversal=self.traversal, lineage=self.lineage, class_metrics=self.class_metrics, inducing=self.inducing)
+        with QUERY_STATS.phase('change_metrics'):
+            change_metrics = v.change_metrics()
         self._log.info('finished change metrics')
 
 
-        if limit_type == 'False':
-            self._log.info('loading issues')
-            issues = v.issues()
-            self._log.info('finished issue loading')
-        elif limit_type == 'JL+R':
-            self._log.info('loading issues for 6 months after relase')
-            issues = v.issues_six_months_szzr()
-            self._log.info('finished issue loading')
-        elif limit_type == 'SZZ':
-            self._log.info('loading issues for 6 months after relase')
-            issues = v.issues_six_months_szz()
-            self._log.info('finished issue loading')
-        else:
-            raise Exception('Unknown type {}'.format(limit_type))
+        with QUERY_STATS.phase('issues'):
+            if limit_type == 'False':
+                self._log.info('loading issues')
+                issues = v.issues()
+                self._log.info('finished issue loading')
+            elif limit_type == 'JL+R':
+                self._log.info('loading issues for 6 months after relase')
+                issues = v.issues_six_months_szzr()
+                self._log.info('finished issue loading')
+            elif limit_type == 'SZZ':
+                self._log.info('loading issues for 6 months after relase')
+                issues = v.issues_six_months_szz()
+                self._log.info('finished issue loading')
+            else:
+                raise Exception('Unknown type {}'.format(limit_type))
 
         dambros_deltas = v.dambros_deltas()
 
@@ -78,59 +102,94 @@ class Mynbou(object):
         moser_metrics = moser(release)
         dambros_metrics = dambros(release, dambros_deltas)
 
+        # fetch additional release centric metrics
+        with QUERY_STATS.phase('release_metrics'):
+            release_metrics = self._release_metrics(self.release_hash, list(change_metrics.keys()))
+
         for file in change_metrics.keys():
             release[file].update(**hassan_metrics[file])
             release[file].update(**moser_metrics[file])
             release[file].update(**dambros_metrics[file])
-
-            # fetch additional release centric metrics
-            release[file].update(**self._file_metrics(file, self.release_hash))
+            release[file].update(**release_metrics[file])
 
         # meta information about the mined release and its path, including which commits are included
-        change_path_commits = set()
-        for path in v._change_paths:
-            for commit in path:
-                change_path_commits.add(commit)
-
-        release_information = {'change_path_commits': change_path_commits,
+        release_information = {'change_path_commits': v.change_window_commits(),
                                'change_path_cutoff_date': str(v._release_date - relativedelta(months=6)),
                                'release_revision': self.release_hash,
                                'release_date': str(v._release_date),
+                               'path_statistics': v.path_statistics,
+                               'query_statistics': QUERY_STATS.summary(),
                                }
 
         return release, release_information
 
     def load_graph(self):
-        """Load NetworkX digraph structure from commits of this VCS."""
-        g = nx.DiGraph()
-        # first we add all nodes to the graph
-        for c in Commit.objects.only('id', 'revision_hash').timeout(False).filter(vcs_system_id=self.vcs.id):
-            g.add_node(c.revision_hash)
-
-        # after that we draw all edges
-        for c in Commit.objects.only('id', 'parents', 'revision_hash').timeout(False).filter(vcs_system_id=self.vcs.id):
-            for p in c.parents:
-                try:
-                    p1 = Commit.objects.only('id', 'revision_hash').timeout(False).get(vcs_system_id=self.vcs.id, revision_hash=p)
-                    g.add_edge(p1.revision_hash, c.revision_hash)
-                except Commit.DoesNotExist:
-                    print("parent of a commit is missing (commit id: {} - revision_hash: {})".format(c.id, p))
+        """Load the compact commit graph (:any:`CommitGraph`) from commits of this VCS.
+
+        The commits are fetched with one projected cursor, parents are resolved against the set of known revision hashes
+        instead of querying the database for every parent.
+        If a cache directory is configured the graph is read from the :any:`GraphCache` which only fetches new commits.
+        """
+        if self.cache_dir is not None:
+            meta, arrays = GraphCache(self.cache_dir, self.vcs.id).refresh()
+            missing_parents = meta['missing_parents']
+        else:
+            arrays, missing_parents = append_commits(empty_arrays(), list(fetch_commits(self.vcs.id)))
+
+        # parents not contained in the VCS are collected and reported once
+        if missing_parents:
+            missing = ['(commit id: {} - revision_hash: {})'.format(object_id(arrays['object_ids'][child]), p) for child, p in missing_parents]
+            self._log.warning('{} parents of commits are missing: {}'.format(len(missing), ', '.join(missing)))
+        self.graph = CommitGraph.from_arrays(arrays)
+
+    def load_lineage(self):
+        """Load the :any:`RenameIndex` for all commits of the graph.
+
+        If a cache directory is configured the index is read from the :any:`RenameCache` which only scans new commits.
+        """
+        if self.cache_dir is not None:
+            self.lineage = RenameCache(self.cache_dir, self.vcs.id).refresh(self.graph.commit_ids())
+        else:
+            self.lineage = RenameIndex.from_commits(self.vcs.id, self.graph.commit_ids())
+
+    def load_inducing(self):
+        """Load the :any:`InducingIndex` for all commits of the graph, it is shared by every release of this instance.
+
+        The index is not stored in the cache directory, labels are added to FileActions of old commits whenever a new bug fix is found.
+        """
+        self.inducing = InducingIndex.from_commits(self.graph.commit_ids())
+
+    def _package_table(self, commit):
+        """Return the metrics of every package of the commit (CodeGroupState of type package), already filtered and named.
+
+        :rtype: dict
+        :returns: package name -> metrics
+        """
+        table = {}
+        for cgs in CodeGroupState.objects.filter(commit_id=commit.id, cg_type='package').only('long_name', 'metrics').timeout(False).as_pymongo():
+            metrics = {}
+            for k, v in cgs.get('metrics', {}).items():
+                if k in IGNORE_PACKAGE_METRICS:
+                    continue
+                if k.endswith(' Rules'):
                     pass
-        self.graph = g
+                    # metrics['PMD_package_{}'.format(k.lower())] = v
+                else:
+                    metrics['SM_package_{}'.format(k.lower())] = v
+            table[cgs['long_name']] = metrics
+        return table
 
-    def _package_metrics(self, commit, ces_file):
-        """Return package metrics from given CodeEntityState of type file.
+    def _package_metrics(self, package_table, file_long_name, package_names):
+        """Return package metrics for a CodeEntityState of type file.
 
-        Matches classes possibly contained in the current file by using the filename and the file path (agains the package of the class).
-        Then loads the metrics from the corresponding package (CodeGroupState).
+        Uses the packages of the classes contained in the file (the long name of the class without the class name) and matches them
+        against the file path. Then takes the metrics of the corresponding package from the package table (see :any:`_package_table`).
         """
         metrics = {}
-        class_name = ces_file.long_name.split('/')[-1].split('.')[0]
-        for ces_class in CodeEntityState.objects.filter(id__in=commit.code_entity_states, long_name__contains=class_name, ce_type__in=['class', 'interface', 'enum']):
-            package_name = '.'.join(ces_class.long_name.split('.')[0:-1])
+        for package_name in package_names:
 
             # check if package from class is the end of our file_path, if not skip to the next class contained in our file
-            path = '.'.join(ces_file.long_name.split('/')[0:-1])
+            path = '.'.join(file_long_name.split('/')[0:-1])
             if not path.endswith(package_name):
                 continue
 
@@ -138,71 +197,90 @@ class Mynbou(object):
             if not package_name:
                 continue
 
-            # fetch package for our package_name, throw error if not exactly one is found
-            cgs = CodeGroupState.objects.get(commit_id=commit.id, cg_type='package', long_name=package_name)
-            for k, v in cgs.metrics.items():
-                if k in IGNORE_PACKAGE_METRICS:
-                    continue
-                if k.endswith(' Rules'):
-                    pass
-                    # metrics['PMD_package_{}'.format(k.lower())] = v
-                else:
-                    metrics['SM_package_{}'.format(k.lower())] = v
+            # package for our package_name, throw error if it is not found
+            if package_name not in package_table:
+                raise CodeGroupState.DoesNotExist('No package {} for {}'.format(package_name, file_long_name))
+            metrics.update(**package_table[package_name])
         return metrics
 
-    def _file_metrics(self, filename, commit):
-        """Return static source code metrics for the given file and commit (usually the release)."""
-        c = Commit.objects.get(revision_hash=commit, vcs_system_id=self.vcs.id)
-        f = File.objects.get(vcs_system_id=c.vcs_system_id, path=filename)
+    def _release_metrics(self, commit, filenames):
+        """Return static source code metrics for the given files at the given commit (usually the release).
 
-        ret = {}
-        file = False
-        for m in CodeEntityState.objects.filter(id__in=c.code_entity_states, file_id=f.id):
+        The CodeEntityStates of the commit are streamed once and grouped by their file, the package metrics are loaded with one more query.
 
-            if m.ce_type == 'file':
+        :param str commit: revision hash of the commit
+        :param list filenames: paths of the files
+        :rtype: dict
+        :returns: file name -> metrics
+        """
+        c = Commit.objects.get(revision_hash=commit, vcs_system_id=self.vcs.id)
+        files = FileResolver.for_vcs(c.vcs_system_id)
+        names = {files.id(filename): filename for filename in filenames}
+
+        ret = {filename: {} for filename in filenames}
+        file = set()
+        file_long_names = {}
+        packages = {}
+        for m in CodeEntityState.objects.filter(id__in=c.code_entity_states).only('file_id', 'ce_type', 'long_name', 'metrics', 'imports', 'linter').timeout(False).as_pymongo():
+            filename = names.get(m.get('file_id'))
+            if filename is None:
+                continue
+
+            metrics = ret[filename]
+            if m['ce_type'] == 'file':
 
                 # just a quick sanity check
-                if file:
-                    raise Exception('2 files in CodeEntityStates for {}'.format(f.path))
-                file = True
+                if filename in file:
+                    raise Exception('2 files in CodeEntityStates for {}'.format(filename))
+                file.add(filename)
 
-                for k, v in m.metrics.items():
+                for k, v in m.get('metrics', {}).items():
 
                     if k in JAVA_NODE_TYPES or k == 'node_count':
                         k = 'AST_{}'.format(k.lower())
                     else:
-                        k = 'SM_{}_{}'.format(m.ce_type, k.lower())
-                    ret[k] = v
+                        k = 'SM_{}_{}'.format(m['ce_type'], k.lower())
+                    metrics[k] = v
 
                 # ret.update(**m.metrics)
-                ret['imports'] = m.imports  # raw imports
+                metrics['imports'] = m.get('imports', [])  # raw imports
 
-                # package metrics
-                ret.update(**self._package_metrics(c, m))
+                # package metrics are added after all classes are known
+                file_long_names[filename] = m['long_name']
 
                 # linter warnings
-                for line in m.linter:
+                for line in m.get('linter', []):
                     for k, v in line.items():
                         if k != 'l_ty':
                             continue
 
-                        if v not in ret.keys():
-                            ret[v] = 0
-                        ret[v] += 1
+                        if v not in metrics.keys():
+                            metrics[v] = 0
+                        metrics[v] += 1
 
             else:
+                # remember the packages of the classes contained in the file
+                if m['ce_type'] in ['class', 'interface', 'enum']:
+                    packages.setdefault(filename, []).append('.'.join(m['long_name'].split('.')[0:-1]))
+
                 # add scope and make a list, we may have more than one classe/interface/method per file
-                for k, metric in m.metrics.items():
+                for k, metric in m.get('metrics', {}).items():
 
                     if k in JAVA_NODE_TYPES:
                         k = 'AST_{}'.format(k.lower())
                     else:
-                        k = 'SM_{}_{}'.format(m.ce_type, k.lower())
+                        k = 'SM_{}_{}'.format(m['ce_type'], k.lower())
 
                     # we are dropping all the rules from Sourcemeter
                     if k.endswith('rules'):
                         continue
-                    if k not in ret.keys():
-                        ret[k] = []
-                    ret[k].append(metric)
+                    if k not in metrics.keys():
+                        metrics[k] = []
+                    metrics[k].append(metric)
+
+        # package metrics
+        if file_long_names:
+            package_table = self._package_table(c)
+            for filename, long_name in file_long_names.items():
+                ret[filename].update(**self._package_metrics(package_table, long_name, packages.get(filename, [])))
         return ret
@@ -0,0 +1,525 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the compact commit graph of mynbou.
+
+CommitGraph maps every revision hash to an integer id and keeps predecessors and successors as compressed sparse rows (CSR) together with the committer dates as NumPy arrays.
+It provides the graph operations used by the path module, NetworkX is only used as an optional adapter.
+CommitAttributes is a columnar store of further commit attributes (author date, parent count, author, label flags) attached to the graph.
+The graph arrays are built from one projected cursor over the commits of a VCS and can be persisted by the :any:`GraphCache`, except for the label flags which change after the commits were inserted.
+"""
+
+import copy
+import heapq
+from collections import deque, namedtuple
+
+import numpy as np
+from bson.objectid import ObjectId
+
+from pycoshark.mongomodels import Commit
+
+from mynbou.constants import COMMIT_LABELS
+from mynbou.prefetch import chunks
+
+CommitRow = namedtuple('CommitRow', ['id', 'revision_hash', 'parents', 'committer_date', 'author_date', 'author_id', 'labels'])
+
+# fields of the commit projected into a CommitRow
+COMMIT_ROW_FIELDS = ['revision_hash', 'parents', 'committer_date', 'author_date', 'author_id', 'labels']
+
+
+def fetch_commits(vcs_system_id, after=None):
+    """Yield the commits of a VCS via one projected cursor.
+
+    :param ObjectId vcs_system_id: id of the VCS
+    :param ObjectId after: if given only commits with a greater id (inserted later) are fetched
+    :rtype: generator
+    :returns: CommitRow tuples ordered by id
+    """
+    query = {'vcs_system_id': vcs_system_id}
+    if after is not None:
+        query['id__gt'] = after
+
+    for c in Commit.objects.filter(**query).only(*COMMIT_ROW_FIELDS).order_by('id').timeout(False).as_pymongo():
+        yield _commit_row(c)
+
+
+def fetch_commits_by_hash(vcs_system_id, revision_hashes):
+    """Yield the commits of a VCS with the given revision hashes, queried in chunks.
+
+    :param ObjectId vcs_system_id: id of the VCS
+    :param list revision_hashes: revision hashes of the commits
+    :rtype: generator
+    :returns: CommitRow tuples
+    """
+    for chunk in chunks(list(revision_hashes)):
+        for c in Commit.objects.filter(vcs_system_id=vcs_system_id, revision_hash__in=chunk).only(*COMMIT_ROW_FIELDS).timeout(False).as_pymongo():
+            yield _commit_row(c)
+
+
+def _commit_row(c):
+    return CommitRow(c['_id'], c['revision_hash'], c.get('parents', []), c.get('committer_date'), c.get('author_date'), c.get('author_id'), c.get('labels') or {})
+
+
+def _bytes_array(values):
+    """Return a fixed width bytes array for the given strings, wide enough for the longest one."""
+    width = max([len(v) for v in values] + [1])
+    return np.array([v.encode('ascii') for v in values], dtype='S{}'.format(width))
+
+
+def _object_id_array(object_ids):
+    """Return the binary representation of the ObjectIds as array, void dtype does not strip trailing zero bytes.
+
+    Missing ids (None) are stored as 12 zero bytes.
+    """
+    return np.frombuffer(b''.join(b'\x00' * 12 if oid is None else oid.binary for oid in object_ids), dtype='V12')
+
+
+def object_id(value):
+    """Return the ObjectId of one element of an object_ids array, None for a missing id."""
+    value = bytes(value)
+    if value == b'\x00' * 12:
+        return None
+    return ObjectId(value)
+
+
+def label_flags(labels):
+    """Return the bit flags of the labels of a commit, bit i is set if the label COMMIT_LABELS[i] is True."""
+    flags = 0
+    for i, label in enumerate(COMMIT_LABELS):
+        if labels.get(label):
+            flags |= 1 << i
+    return flags
+
+
+def fetch_label_flags(vcs_system_id, object_ids, until=None):
+    """Return the label flags (see :any:`label_flags`) of the given commits, read with one projected cursor over the labels of the VCS.
+
+    Labels are set on commits long after they were inserted, e.g., by labelSHARK, so they are read fresh instead of being cached.
+
+    :param ObjectId vcs_system_id: id of the VCS
+    :param object_ids: ObjectIds of the commits as array of 12 byte values, e.g., the object_ids of the graph arrays
+    :param ObjectId until: only read commits with an id up to this one, e.g., the newest cached commit
+    :rtype: numpy.ndarray
+    """
+    position = {bytes(o): i for i, o in enumerate(object_ids)}
+    flags = np.zeros(len(position), dtype=np.uint16)
+
+    query = {'vcs_system_id': vcs_system_id, 'labels__exists': True}
+    if until is not None:
+        query['id__lte'] = until
+    for c in Commit.objects.filter(**query).only('labels').timeout(False).as_pymongo():
+        i = position.get(c['_id'].binary)
+        if i is not None:
+            flags[i] = label_flags(c.get('labels') or {})
+    return flags
+
+
+def empty_arrays():
+    """Return the arrays of a graph without commits."""
+    return {'object_ids': np.empty(0, dtype='V12'),
+            'revision_hashes': np.empty(0, dtype='S40'),
+            'parent_indptr': np.zeros(1, dtype=np.int64),
+            'parent_indices': np.empty(0, dtype=np.int32),
+            'committer_dates': np.empty(0, dtype='datetime64[us]'),
+            'author_dates': np.empty(0, dtype='datetime64[us]'),
+            'parent_counts': np.empty(0, dtype=np.uint16),
+            'author_ids': np.empty(0, dtype='V12'),
+            'label_flags': np.empty(0, dtype=np.uint16)}
+
+
+def append_commits(arrays, commits, missing_parents=None):
+    """Append commits to graph arrays.
+
+    Parents are resolved against the revision hashes of the arrays and the new commits.
+    Parents that are still not part of the graph are returned so that they can be resolved when more commits are appended.
+
+    :param dict arrays: graph arrays, see :any:`empty_arrays`
+    :param list commits: CommitRow tuples, e.g., from :any:`fetch_commits`
+    :param list missing_parents: list of [child index, parent revision hash] of a previous call
+    :rtype: tuple
+    :returns: (arrays, missing_parents)
+    """
+    offset = len(arrays['object_ids'])
+    index = {h.decode('ascii'): i for i, h in enumerate(arrays['revision_hashes'])}
+    for i, c in enumerate(commits):
+        index[c.revision_hash] = offset + i
+
+    # parents which were missing before may be part of the new commits
+    missing = []
+    resolved = {}
+    for child, p in missing_parents or []:
+        if p in index:
+            resolved.setdefault(child, []).append(index[p])
+        else:
+            missing.append([child, p])
+
+    indptr = [int(arrays['parent_indptr'][-1])]
+    indices = []
+    for i, c in enumerate(commits):
+        for p in c.parents:
+            if p in index:
+                indices.append(index[p])
+            else:
+                missing.append([offset + i, p])
+        indptr.append(indptr[0] + len(indices))
+
+    parent_indptr = np.concatenate([np.asarray(arrays['parent_indptr']), np.array(indptr[1:], dtype=np.int64)])
+    parent_indices = np.concatenate([np.asarray(arrays['parent_indices']), np.array(indices, dtype=np.int32)])
+
+    # rare case, rebuild the rows of children which got their missing parents resolved
+    if resolved:
+        rows = [list(parent_indices[parent_indptr[i]:parent_indptr[i + 1]]) + resolved.get(i, []) for i in range(len(parent_indptr) - 1)]
+        parent_indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        parent_indptr[1:] = np.cumsum([len(r) for r in rows])
+        parent_indices = np.array([p for r in rows for p in r], dtype=np.int32)
+
+    new_columns = {'object_ids': _object_id_array([c.id for c in commits]),
+                   'revision_hashes': _bytes_array([c.revision_hash for c in commits]),
+                   'committer_dates': np.array([c.committer_date for c in commits], dtype='datetime64[us]'),
+                   'author_dates': np.array([c.author_date for c in commits], dtype='datetime64[us]'),
+                   'parent_counts': np.array([len(c.parents) for c in commits], dtype=np.uint16),
+                   'author_ids': _object_id_array([c.author_id for c in commits]),
+                   'label_flags': np.array([label_flags(c.labels) for c in commits], dtype=np.uint16)}
+
+    new_arrays = {'parent_indptr': parent_indptr, 'parent_indices': parent_indices}
+    for name, column in new_columns.items():
+        new_arrays[name] = np.concatenate([np.asarray(arrays[name]), column])
+    return new_arrays, missing
+
+
+class CommitAttributes(object):
+    """Columnar store of commit attributes, row i belongs to the commit with id i of the :any:`CommitGraph`.
+
+    Holds committer_dates, author_dates, parent_counts (number of parents in the commit, including parents missing in the graph),
+    author_ids and label_flags (see :any:`label_flags`).
+    """
+
+    COLUMNS = ['committer_dates', 'author_dates', 'parent_counts', 'author_ids', 'label_flags']
+
+    def __init__(self, committer_dates, author_dates, parent_counts, author_ids, label_flags):
+        self.committer_dates = np.asarray(committer_dates, dtype='datetime64[us]')
+        self.author_dates = np.asarray(author_dates, dtype='datetime64[us]')
+        self.parent_counts = np.asarray(parent_counts, dtype=np.uint16)
+        self.author_ids = np.asarray(author_ids, dtype='V12')
+        self.label_flags = np.asarray(label_flags, dtype=np.uint16)
+
+        for column in self.COLUMNS:
+            getattr(self, column).flags.writeable = False
+
+    @classmethod
+    def empty(cls, parent_counts):
+        """Return attributes without dates, authors and labels for commits with the given parent counts."""
+        n = len(parent_counts)
+        return cls(np.full(n, np.datetime64('NaT'), dtype='datetime64[us]'), np.full(n, np.datetime64('NaT'), dtype='datetime64[us]'), parent_counts, np.zeros(n, dtype='V12'), np.zeros(n, dtype=np.uint16))
+
+    def copy(self):
+        """Return a deep copy of the columns."""
+        return CommitAttributes(*[np.array(getattr(self, column)) for column in self.COLUMNS])
+
+    def has_label(self, i, label):
+        """Return True if the commit i has the given label from COMMIT_LABELS."""
+        return bool(self.label_flags[i] & (1 << COMMIT_LABELS.index(label)))
+
+    def label_mask(self, label):
+        """Return a boolean mask over all commit ids which is True for every commit with the given label."""
+        return (self.label_flags & (1 << COMMIT_LABELS.index(label))) != 0
+
+
+class CommitGraph(object):
+    """Compact, integer indexed commit graph.
+
+    Every commit has an int32 id, edges point from parent to child like in the NetworkX graph of the commits.
+    The public methods accept and return revision hashes, the methods with the suffix _ids work on the integer ids.
+    The arrays are never modified after construction so a graph can be shared by all traversals.
+    """
+
+    def __init__(self, revision_hashes, parent_indptr, parent_indices, attributes=None, object_ids=None):
+        self._hashes = list(revision_hashes)
+        self._index = {h: i for i, h in enumerate(self._hashes)}
+
+        n = len(self._hashes)
+        self.pred_indptr = np.asarray(parent_indptr, dtype=np.int64)
+        self.pred_indices = np.asarray(parent_indices, dtype=np.int32)
+
+        # successors are the transposed predecessors, the stable sort keeps the children in id order
+        children = np.repeat(np.arange(n, dtype=np.int32), np.diff(self.pred_indptr))
+        self.succ_indices = children[np.argsort(self.pred_indices, kind='stable')]
+        self.succ_indptr = np.zeros(n + 1, dtype=np.int64)
+        self.succ_indptr[1:] = np.cumsum(np.bincount(self.pred_indices, minlength=n))
+
+        if attributes is None:
+            attributes = CommitAttributes.empty(np.diff(self.pred_indptr))
+        self.attributes = attributes
+        self.committer_dates = attributes.committer_dates
+        self.object_ids = object_ids
+
+        # the graph is immutable so that it can be shared by every traversal
+        for a in [self.pred_indptr, self.pred_indices, self.succ_indptr, self.succ_indices]:
+            a.flags.writeable = False
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Create the graph from graph arrays, e.g., from :any:`append_commits` or the :any:`GraphCache`."""
+        attributes = CommitAttributes(*[arrays[column] for column in CommitAttributes.COLUMNS])
+        return cls([h.decode('ascii') for h in arrays['revision_hashes']], arrays['parent_indptr'], arrays['parent_indices'], attributes, arrays['object_ids'])
+
+    @classmethod
+    def from_networkx(cls, g):
+        """Create the graph from a NetworkX digraph with revision hashes as nodes, committer_date node attributes are kept."""
+        hashes = list(g.nodes())
+        index = {h: i for i, h in enumerate(hashes)}
+        indptr = [0]
+        indices = []
+        for h in hashes:
+            indices.extend(index[p] for p in g.predecessors(h))
+            indptr.append(len(indices))
+        empty = CommitAttributes.empty(np.diff(indptr))
+        committer_dates = np.array([g.nodes[h].get('committer_date') for h in hashes], dtype='datetime64[us]')
+        attributes = CommitAttributes(committer_dates, empty.author_dates, empty.parent_counts, empty.author_ids, empty.label_flags)
+        return cls(hashes, indptr, indices, attributes)
+
+    @classmethod
+    def from_networkx_commits(cls, g, vcs_system_id):
+        """Create the graph from a NetworkX digraph with revision hashes as nodes, the commit attributes and ids are loaded for its nodes.
+
+        The nodes and edges of g are kept as they are, e.g., for a subgraph of the VCS, only the commits of its nodes are queried.
+        Nodes which are not a commit of the VCS keep empty attributes and no id.
+
+        :param networkx.DiGraph g: commit graph
+        :param ObjectId vcs_system_id: id of the VCS
+        :rtype: CommitGraph
+        """
+        graph = cls.from_networkx(g)
+        rows = {c.revision_hash: c for c in fetch_commits_by_hash(vcs_system_id, graph._hashes)}
+        commits = [rows.get(h) for h in graph._hashes]
+
+        present = [c for c in commits if c is not None]
+        arrays, _ = append_commits(empty_arrays(), present)
+        positions = np.array([i for i, c in enumerate(commits) if c is not None], dtype=np.int64)
+
+        empty = CommitAttributes.empty(np.diff(graph.pred_indptr))
+        columns = {column: np.array(getattr(empty, column)) for column in CommitAttributes.COLUMNS}
+        for column in CommitAttributes.COLUMNS:
+            columns[column][positions] = arrays[column]
+        object_ids = np.zeros(len(commits), dtype='V12')
+        object_ids[positions] = arrays['object_ids']
+
+        return cls(graph._hashes, graph.pred_indptr, graph.pred_indices, CommitAttributes(*[columns[column] for column in CommitAttributes.COLUMNS]), object_ids)
+
+    def to_networkx(self):
+        """Return the graph as NetworkX digraph with committer_date node attributes."""
+        import networkx as nx
+
+        g = nx.DiGraph()
+        for revision_hash, committer_date in zip(self._hashes, self.committer_dates.astype(object)):
+            g.add_node(revision_hash, committer_date=committer_date)
+        g.add_edges_from(self.edges())
+        return g
+
+    def copy(self, as_view=False):
+        """Return a copy of the graph.
+
+        Like in NetworkX as_view returns a read-only view which shares all data with this graph instead of a deep copy.
+        """
+        if as_view:
+            return copy.copy(self)
+        return CommitGraph(self._hashes, self.pred_indptr.copy(), self.pred_indices.copy(), self.attributes.copy(), None if self.object_ids is None else np.array(self.object_ids))
+
+    def __len__(self):
+        return len(self._hashes)
+
+    def __contains__(self, revision_hash):
+        return revision_hash in self._index
+
+    def __iter__(self):
+        return iter(self._hashes)
+
+    def nodes(self):
+        """Return all revision hashes."""
+        return list(self._hashes)
+
+    def edges(self):
+        """Yield all edges as (parent, child) tuples."""
+        for i, revision_hash in enumerate(self._hashes):
+            for p in self.predecessor_ids(i):
+                yield self._hashes[p], revision_hash
+
+    def id_of(self, revision_hash):
+        """Return the integer id of a revision hash."""
+        return self._index[revision_hash]
+
+    def hash_of(self, i):
+        """Return the revision hash of an integer id."""
+        return self._hashes[i]
+
+    def predecessor_ids(self, i):
+        """Return the ids of the parents of commit i."""
+        return self.pred_indices[self.pred_indptr[i]:self.pred_indptr[i + 1]].tolist()
+
+    def successor_ids(self, i):
+        """Return the ids of the children of commit i."""
+        return self.succ_indices[self.succ_indptr[i]:self.succ_indptr[i + 1]].tolist()
+
+    def predecessors(self, revision_hash):
+        """Return an iterator over the parents of a commit."""
+        return map(self._hashes.__getitem__, self.predecessor_ids(self._index[revision_hash]))
+
+    def successors(self, revision_hash):
+        """Return an iterator over the children of a commit."""
+        return map(self._hashes.__getitem__, self.successor_ids(self._index[revision_hash]))
+
+    def has_edge(self, u, v):
+        """Return True if u is a parent of v."""
+        if u not in self._index or v not in self._index:
+            return False
+        return self._index[u] in self.predecessor_ids(self._index[v])
+
+    def committer_date(self, revision_hash):
+        """Return the committer date of a commit as datetime."""
+        return self.committer_dates[self._index[revision_hash]].astype(object)
+
+    def parent_count(self, revision_hash):
+        """Return the number of parents of a commit."""
+        return int(self.attributes.parent_counts[self._index[revision_hash]])
+
+    def object_id_of(self, i):
+        """Return the ObjectId of the commit with id i."""
+        return object_id(self.object_ids[i])
+
+    def commit_ids(self):
+        """Return the ObjectIds of all commits ordered by their id in the graph."""
+        return [object_id(v) for v in self.object_ids]
+
+    def ancestor_ids(self, i):
+        """Return a boolean mask over all ids which is True for every ancestor of commit i (not including i)."""
+        mask = np.zeros(len(self._hashes), dtype=bool)
+        queue = deque([i])
+        while queue:
+            for p in self.predecessor_ids(queue.popleft()):
+                if not mask[p]:
+                    mask[p] = True
+                    queue.append(p)
+        return mask
+
+    def ancestors(self, revision_hash):
+        """Return the set of all ancestors of a commit."""
+        return {self._hashes[i] for i in np.flatnonzero(self.ancestor_ids(self._index[revision_hash]))}
+
+    def history_window(self, revision_hash, since):
+        """Return the commit and its ancestors committed at or after since, each commit once.
+
+        The ancestors are collected via a reverse breadth first search which does not continue past commits older than since.
+        The commits are ordered topologically from the given commit backwards (every commit comes before its parents),
+        among the commits whose children are already ordered the newest one (committer date) comes first.
+
+        :param str revision_hash: start commit, e.g., the release
+        :param datetime since: commits older than this date and their ancestors are not part of the window
+        :rtype: list
+        :returns: list of revision hashes
+        """
+        cutoff = np.datetime64(since)
+        start = self._index[revision_hash]
+
+        window = {start}
+        queue = deque([start])
+        while queue:
+            for p in self.predecessor_ids(queue.popleft()):
+                if p not in window and not self.committer_dates[p] < cutoff:
+                    window.add(p)
+                    queue.append(p)
+
+        # number of children in the window which are not yet ordered
+        pending = {i: 0 for i in window}
+        for i in window:
+            for p in self.predecessor_ids(i):
+                if p in window:
+                    pending[p] += 1
+
+        dates = self.committer_dates.view(np.int64)
+        heap = [(-dates[start], start)]
+        order = []
+        while heap:
+            _, i = heapq.heappop(heap)
+            order.append(self._hashes[i])
+            for p in self.predecessor_ids(i):
+                if p in window:
+                    pending[p] -= 1
+                    if pending[p] == 0:
+                        heapq.heappush(heap, (-dates[p], p))
+        return order
+
+    def has_path(self, source, target):
+        """Return True if target is reachable from source following the edges from parent to child."""
+        s = self._index[source]
+        t = self._index[target]
+        if s == t:
+            return True
+
+        seen = {s}
+        queue = deque([s])
+        while queue:
+            for c in self.successor_ids(queue.popleft()):
+                if c == t:
+                    return True
+                if c not in seen:
+                    seen.add(c)
+                    queue.append(c)
+        return False
+
+    def _neighbor_ids(self, i):
+        return self.successor_ids(i) + self.predecessor_ids(i)
+
+    def all_shortest_paths(self, source, target):
+        """Yield all shortest paths between source and target ignoring the direction of the edges.
+
+        This follows the algorithm of networkx.all_shortest_paths on the undirected graph.
+        The breadth first search stops after the level which contains the target.
+        If there is no path nothing is yielded.
+        """
+        s = self._index[source]
+        t = self._index[target]
+
+        # breadth first search which records all predecessors on shortest paths
+        level = 0
+        seen = {s: 0}
+        pred = {s: []}
+        nextlevel = [s]
+        while nextlevel and t not in seen:
+            level += 1
+            thislevel = nextlevel
+            nextlevel = []
+            for v in thislevel:
+                for w in self._neighbor_ids(v):
+                    if w not in seen:
+                        pred[w] = [v]
+                        seen[w] = level
+                        nextlevel.append(w)
+                    elif seen[w] == level:
+                        pred[w].append(v)
+
+        if t not in seen:
+            return
+
+        # walk back from target to source via the recorded predecessors
+        stack = [[t, 0]]
+        on_stack = {t}
+        top = 0
+        while top >= 0:
+            node, i = stack[top]
+            if node == s:
+                yield [self._hashes[n] for n, _ in reversed(stack[:top + 1])]
+            if len(pred[node]) > i:
+                stack[top][1] = i + 1
+                nxt = pred[node][i]
+                if nxt in on_stack:
+                    continue
+                on_stack.add(nxt)
+                top += 1
+                if top == len(stack):
+                    stack.append([nxt, 0])
+                else:
+                    stack[top][:] = [nxt, 0]
+            else:
+                on_stack.discard(node)
+                top -= 1
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the index advisor of mynbou.
+
+QUERY_SHAPES lists the filters mynbou sends to the MongoDB, ordered like the compound index that serves them (equality fields first, range fields last).
+:any:`advise` checks every shape against the indexes of the database and the winning plan of its explain() output
+and :any:`create_index_statement` returns the mongo shell statement which creates the missing index.
+The collections are accessed without mongoengine so that checking a database never creates indexes.
+"""
+
+import json
+import datetime
+from collections import namedtuple
+
+from bson.objectid import ObjectId
+from mongoengine.connection import get_db
+
+from pycoshark.mongomodels import Commit, File, FileAction, Hunk, CodeEntityState, CodeGroupState, Refactoring, CommitChanges, Issue, Event
+
+# filter of one query mynbou issues, fields are (name, example value) in index order
+QueryShape = namedtuple('QueryShape', ['model', 'fields', 'call_site'])
+
+# result of checking one shape, stages is None if the explain failed
+IndexAdvice = namedtuple('IndexAdvice', ['shape', 'index', 'stages', 'collscan'])
+
+QUERY_SHAPES = [
+    QueryShape(Commit, [('vcs_system_id', ObjectId()), ('revision_hash', '0' * 40)], 'core.Mynbou._release_metrics, path.Volg, graph.fetch_commits_by_hash'),
+    QueryShape(Commit, [('vcs_system_id', ObjectId()), ('_id', {'$gt': ObjectId()})], 'graph.fetch_commits'),
+    QueryShape(Commit, [('vcs_system_id', ObjectId()), ('fixed_issue_ids', ObjectId()), ('committer_date', {'$gt': datetime.datetime(1970, 1, 1)})], 'path.Volg.issues'),
+    QueryShape(Commit, [('_id', {'$in': [ObjectId()]})], 'path.Volg six month loaders'),
+    QueryShape(File, [('vcs_system_id', ObjectId()), ('_id', {'$gt': ObjectId()})], 'resolver.FileResolver'),
+    QueryShape(FileAction, [('commit_id', ObjectId()), ('mode', 'M')], 'path.Volg issue loaders'),
+    QueryShape(FileAction, [('commit_id', {'$in': [ObjectId()]}), ('mode', {'$in': ['R', 'A', 'C']})], 'lineage.scan_lineage'),
+    QueryShape(FileAction, [('commit_id', ObjectId())], 'prefetch.prefetch_file_actions, inducing.scan_inducing'),
+    QueryShape(Hunk, [('file_action_id', ObjectId())], 'prefetch.hunk_counts'),
+    QueryShape(Refactoring, [('commit_id', ObjectId())], 'prefetch.prefetch_refactorings'),
+    QueryShape(CommitChanges, [('new_commit_id', ObjectId())], 'prefetch.prefetch_commit_changes'),
+    QueryShape(CodeEntityState, [('_id', ObjectId()), ('ce_type', 'class')], 'prefetch.class_metric_averages, core.Mynbou._release_metrics'),
+    QueryShape(CodeGroupState, [('commit_id', ObjectId()), ('cg_type', 'package')], 'core.Mynbou._package_table'),
+    QueryShape(Issue, [('_id', ObjectId())], 'prefetch.IssueCache'),
+    QueryShape(Event, [('issue_id', ObjectId())], 'pycoshark.utils.jira_is_resolved_and_fixed via path.Volg issue loaders'),
+]
+
+
+def collection_name(shape):
+    """Return the name of the collection the shape is queried on."""
+    return shape.model._get_collection_name()
+
+
+def covering_index(indexes, shape):
+    """Return the name of an index which serves the shape or None.
+
+    An index serves the shape if its key starts with the fields of the shape in any order, or if the shape queries the _id.
+
+    :param dict indexes: index information of the collection, see pymongo Collection.index_information
+    :rtype: str
+    """
+    fields = set(name for name, _ in shape.fields)
+    for name, index in sorted(indexes.items()):
+        key = [field for field, _ in index['key']]
+        if set(key[:len(fields)]) == fields or key == ['_id'] and '_id' in fields:
+            return name
+    return None
+
+
+def plan_stages(plan):
+    """Return the stages of a query plan, e.g., the winningPlan of an explain(), from the outermost stage inwards.
+
+    :rtype: list
+    """
+    stages = [plan['stage']] if 'stage' in plan else []
+    if 'inputStage' in plan:
+        stages.extend(plan_stages(plan['inputStage']))
+    for stage in plan.get('inputStages', []):
+        stages.extend(plan_stages(stage))
+    return stages
+
+
+def advise(db=None):
+    """Check every shape of QUERY_SHAPES against the indexes and the query planner of the database.
+
+    If the explain is not available a shape counts as collection scan if no index serves it.
+
+    :param db: pymongo database, defaults to the database of the default mongoengine connection
+    :rtype: list
+    :returns: IndexAdvice for every shape
+    """
+    if db is None:
+        db = get_db()
+
+    advice = []
+    for shape in QUERY_SHAPES:
+        collection = db[collection_name(shape)]
+        index = covering_index(collection.index_information(), shape)
+
+        try:
+            plan = collection.find(dict(shape.fields)).explain()
+            stages = plan_stages(plan.get('queryPlanner', plan)['winningPlan'])
+        except Exception:
+            stages = None
+
+        collscan = 'COLLSCAN' in stages if stages is not None else index is None
+        advice.append(IndexAdvice(shape, index, stages, collscan))
+    return advice
+
+
+def create_index_statement(shape):
+    """Return the mongo shell statement which creates the compound index for the shape.
+
+    :rtype: str
+    """
+    return 'db.{}.createIndex({})'.format(collection_name(shape), json.dumps(dict((name, 1) for name, _ in shape.fields)))
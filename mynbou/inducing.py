@@ -0,0 +1,65 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the reverse inducing index of mynbou.
+
+FileActions of bug inducing changes reference the FileAction of the bug fix in their induces list.
+InducingIndex reverses this relation: for the FileAction of a fix it returns every inducing FileAction together with its commit, file, label and SZZ type.
+The index is built with one $unwind/$group aggregation over the FileActions of a VCS.
+"""
+
+from collections import namedtuple
+
+from pycoshark.mongomodels import FileAction
+
+from mynbou.prefetch import chunks
+
+InducingRow = namedtuple('InducingRow', ['file_action_id', 'commit_id', 'file_id', 'label', 'szz_type'])
+
+
+def scan_inducing(commit_ids):
+    """Collect the inducing FileActions of the given commits grouped by the FileAction they induce.
+
+    :param list commit_ids: ObjectIds of the commits, e.g., every commit of a VCS
+    :rtype: dict
+    :returns: change_file_action_id -> list of InducingRow ordered by inducing FileAction and position in its induces list
+    """
+    inducing = {}
+    for chunk in chunks(list(commit_ids)):
+        for row in FileAction.objects().aggregate(*[
+            {'$match': {'commit_id': {'$in': chunk}, 'induces.0': {'$exists': True}}},
+            {'$unwind': '$induces'},
+            {'$group': {'_id': '$induces.change_file_action_id',
+                        'inducing': {'$push': {'file_action_id': '$_id', 'commit_id': '$commit_id', 'file_id': '$file_id', 'label': '$induces.label', 'szz_type': '$induces.szz_type'}}}}
+        ]):
+            rows = inducing.setdefault(row['_id'], [])
+            for ind in row['inducing']:
+                rows.append(InducingRow(ind['file_action_id'], ind['commit_id'], ind['file_id'], ind.get('label'), ind.get('szz_type')))
+
+    # $group does not keep the order of the documents, the FileActions are sorted like the FileAction collection (stable for the induces list)
+    for rows in inducing.values():
+        rows.sort(key=lambda r: r.file_action_id)
+    return inducing
+
+
+class InducingIndex(object):
+    """Inducing FileActions per induced (bug fixing) FileAction."""
+
+    def __init__(self, inducing=None):
+        self._inducing = inducing if inducing is not None else {}
+
+    @classmethod
+    def from_commits(cls, commit_ids):
+        """Build the index for the given commit ids via :any:`scan_inducing`."""
+        return cls(scan_inducing(commit_ids))
+
+    def __len__(self):
+        return len(self._inducing)
+
+    def inducing(self, change_file_action_id, label=None):
+        """Return the InducingRows of the induced FileAction, optionally only those with the given label."""
+        rows = self._inducing.get(change_file_action_id, [])
+        if label is None:
+            return list(rows)
+        return [r for r in rows if r.label == label]
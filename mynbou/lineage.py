@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the rename/lineage index of mynbou.
+
+RenameIndex maps the id of every commit of a VCS to the renames and additions of its FileActions.
+Renames are split by the same heuristic as pycoshark.utils.heuristic_renames into true renames and false renames (additions via duplicate renames).
+The index is built from one bulk scan over the FileActions of the VCS and can be persisted by the :any:`RenameCache`.
+ReleaseNames uses the index to translate file names of descendants of a release to their names at the release.
+"""
+
+from collections import deque
+
+from Levenshtein import distance
+
+from pycoshark.mongomodels import FileAction
+
+from mynbou.prefetch import chunks
+from mynbou.resolver import FileResolver
+
+
+def split_renames(renames):
+    """Return most probable rename from all renames of one commit, rest count as DEL/NEW.
+
+    There may be multiple renames of the same file in the same commit, e.g., A->B, A->C.
+    This is due to pygit2 and the Git heuristic for rename detection.
+    This function uses another heuristic to detect renames by employing a string distance metric on the file name.
+    This captures things like commons-math renames org.apache.math -> org.apache.math3.
+
+    :param list renames: (old path, new path) tuples in the order of the FileActions
+    :rtype: tuple
+    :returns: (true_renames, false_renames), list of (old path, new path) tuples and list of new paths
+    """
+    grouped = {}
+    for old_file, new_file in renames:
+        if old_file not in grouped.keys():
+            grouped[old_file] = []
+        grouped[old_file].append(new_file)
+
+    true_renames = []
+    false_renames = []
+    for old_file, new_files in grouped.items():
+
+        # only one file, easy
+        if len(new_files) == 1:
+            true_renames.append((old_file, new_files[0]))
+            continue
+
+        # multiple files, find the best matching
+        min_dist = float('inf')
+        probable_file = None
+        for new_file in new_files:
+            d = distance(old_file, new_file)
+            if d < min_dist:
+                min_dist = d
+                probable_file = new_file
+        true_renames.append((old_file, probable_file))
+
+        for new_file in new_files:
+            if new_file == probable_file:
+                continue
+            false_renames.append(new_file)
+    return true_renames, false_renames
+
+
+def scan_lineage(vcs_system_id, commit_ids):
+    """Collect renames and additions of the given commits.
+
+    The FileActions are fetched with one projected scan (chunked $in over the commit ids), the paths are resolved by the :any:`FileResolver` of the VCS.
+
+    :param ObjectId vcs_system_id: id of the VCS of the commits
+    :param list commit_ids: ObjectIds of the commits
+    :rtype: dict
+    :returns: str(commit id) -> [true_renames, false_renames, additions], commits without renames and additions are omitted
+    """
+    files = FileResolver.for_vcs(vcs_system_id)
+
+    renames = {}
+    additions = {}
+    for chunk in chunks(list(commit_ids)):
+        for fa in FileAction.objects.filter(commit_id__in=chunk, mode__in=['R', 'A', 'C']).only('commit_id', 'file_id', 'old_file_id', 'mode').timeout(False).as_pymongo():
+            commit_id = str(fa['commit_id'])
+            if fa['mode'] == 'R':
+                renames.setdefault(commit_id, []).append((files.path(fa['old_file_id']), files.path(fa['file_id'])))
+            else:
+                additions.setdefault(commit_id, []).append(files.path(fa['file_id']))
+
+    lineage = {}
+    for commit_id in set(renames.keys()) | set(additions.keys()):
+        true_renames, false_renames = split_renames(renames.get(commit_id, []))
+        lineage[commit_id] = [true_renames, false_renames, additions.get(commit_id, [])]
+    return lineage
+
+
+class RenameIndex(object):
+    """Renames and additions per commit of one VCS.
+
+    For every commit the index holds the true renames (old path, new path), the false renames (paths which are added by a duplicate rename,
+    going backwards in history they count as deletions) and the paths added or copied by the commit.
+    """
+
+    def __init__(self, lineage=None):
+        self._lineage = lineage if lineage is not None else {}
+
+    @classmethod
+    def from_commits(cls, vcs_system_id, commit_ids):
+        """Build the index for the given commit ids of the VCS via :any:`scan_lineage`."""
+        return cls(scan_lineage(vcs_system_id, commit_ids))
+
+    def __len__(self):
+        return len(self._lineage)
+
+    def renames(self, commit_id):
+        """Return the renames of the commit.
+
+        :param ObjectId commit_id: id of the commit
+        :rtype: tuple
+        :returns: (true_renames, false_renames), see :any:`split_renames`
+        """
+        entry = self._lineage.get(str(commit_id))
+        if entry is None:
+            return [], []
+        return [tuple(rename) for rename in entry[0]], list(entry[1])
+
+    def additions(self, commit_id):
+        """Return the paths added or copied by the commit in the order of its FileActions."""
+        entry = self._lineage.get(str(commit_id))
+        if entry is None:
+            return []
+        return list(entry[2])
+
+    def update(self, lineage):
+        """Add the entries of another lineage dict, e.g., of new commits."""
+        self._lineage.update(lineage)
+
+    def to_dict(self):
+        """Return the lineage dict of the index, see :any:`scan_lineage`."""
+        return self._lineage
+
+
+class ReleaseNames(object):
+    """Names at the release for the files of every descendant of the release.
+
+    The descendants are visited in one breadth first sweep forward from the release, every commit is reached via the parent that discovered it first,
+    i.e., via a shortest forward path from the release.
+    For every commit a mapping name at the commit -> name at the release (None if the file does not exist at the release) is kept.
+    Only names changed by renames are stored, commits without renames share the mapping of their parent.
+    The renames of a commit are reverted the same way as in :any:`Volg.calc_current_files`: true renames are reverted first, then the false renames count as deletions.
+    """
+
+    def __init__(self, graph, lineage, release_hash):
+        self._graph = graph
+        release = graph.id_of(release_hash)
+
+        # the release itself maps every name to itself
+        self._mappings = {release: {}}
+        queue = deque([release])
+        while queue:
+            parent = queue.popleft()
+            for child in graph.successor_ids(parent):
+                if child in self._mappings:
+                    continue
+                self._mappings[child] = self._revert(self._mappings[parent], lineage.renames(graph.object_id_of(child)))
+                queue.append(child)
+
+    def _revert(self, parent_mapping, renames):
+        """Return the mapping of a commit from the mapping of its parent and the renames of the commit."""
+        true_renames, false_renames = renames
+        if not true_renames and not false_renames:
+            return parent_mapping
+
+        affected = set(new_file for _, new_file in true_renames) | set(false_renames)
+        mapping = dict(parent_mapping)
+        for name in affected:
+            previous = name
+            for old_file, new_file in true_renames:
+                if previous == new_file:
+                    previous = old_file
+            if previous in false_renames:
+                mapping[name] = None
+            else:
+                mapping[name] = parent_mapping.get(previous, previous)
+        return mapping
+
+    def __contains__(self, revision_hash):
+        return revision_hash in self._graph and self._graph.id_of(revision_hash) in self._mappings
+
+    def __len__(self):
+        return len(self._mappings)
+
+    def at_release(self, revision_hash, files):
+        """Return the names at the release of the files of a descendant of the release.
+
+        :param str revision_hash: descendant of the release (or the release itself)
+        :param iterable files: file names at the commit
+        :rtype: set
+        :returns: names at the release, files that do not exist at the release are omitted
+        """
+        mapping = self._mappings[self._graph.id_of(revision_hash)]
+        names = set()
+        for name in files:
+            name = mapping.get(name, name)
+            if name is not None:
+                names.add(name)
+        return names
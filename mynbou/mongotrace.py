@@ -0,0 +1,284 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the record/replay harness for the MongoDB traffic of mynbou.
+
+TraceRecorder is a pymongo command listener which writes every command and its reply into a gzip compressed BSON trace.
+ReplayServer is a minimal MongoDB stand-in speaking the wire protocol (OP_QUERY handshake and OP_MSG commands) which serves
+the recorded replies, optionally after an injected latency per command to simulate network round trips.
+Mynbou runs unchanged against the stand-in, e.g.::
+
+    server = ReplayServer('trace.bson.gz', latency=0.002)
+    server.start()
+    connect('smartshark', host='mongodb://{}:{}'.format(*server.server_address))
+"""
+
+import gzip
+import time
+import struct
+import socket
+import logging
+import threading
+import socketserver
+import datetime
+from collections import deque
+
+import bson
+from pymongo import monitoring
+
+# keys added by the driver which differ between runs and are ignored when commands are matched
+DRIVER_KEYS = ['lsid', 'txnNumber', '$db', '$clusterTime', '$readPreference']
+
+# commands of the driver itself which are answered without the trace
+HANDSHAKE_COMMANDS = ['ismaster', 'isMaster', 'hello']
+OK_COMMANDS = ['ping', 'endSessions', 'killCursors']
+
+OP_REPLY = 1
+OP_QUERY = 2004
+OP_MSG = 2013
+
+# OP_MSG flag bits
+CHECKSUM_PRESENT = 1
+MORE_TO_COME = 2
+
+HEADER = struct.Struct('<iiii')
+
+
+def normalize_command(command):
+    """Return the command without the keys the driver adds, this is what recorded and replayed commands are matched by.
+
+    :rtype: bson.SON
+    """
+    return bson.SON((k, v) for k, v in command.items() if k not in DRIVER_KEYS)
+
+
+def command_key(database_name, command):
+    """Return the key of a command for matching, the BSON of the database name and the normalized command.
+
+    :rtype: bytes
+    """
+    return bson.BSON.encode(bson.SON([('db', database_name), ('command', normalize_command(command))]))
+
+
+def read_trace(path):
+    """Yield the entries (database, command_name, command, reply, duration_micros) of a trace in recorded order."""
+    with gzip.open(path, 'rb') as f:
+        for entry in bson.decode_file_iter(f, codec_options=bson.CodecOptions(document_class=bson.SON)):
+            yield entry
+
+
+class TraceRecorder(monitoring.CommandListener):
+    """Records every command and its reply to a gzip compressed BSON trace.
+
+    The listener has to be registered before the connection is created and closed after the run.
+
+    :param str path: file of the trace
+    """
+
+    def __init__(self, path):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.path = path
+        self.count = 0
+
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._file = gzip.open(path, 'wb')
+
+    def started(self, event):
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (event.database_name, bson.SON(event.command.items()))
+
+    def succeeded(self, event):
+        self._write(event, event.reply)
+
+    def failed(self, event):
+        self._write(event, event.failure)
+
+    def _write(self, event, reply):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+            if pending is None or self._file is None:
+                return
+            database_name, command = pending
+            entry = bson.SON([('database', database_name), ('command_name', event.command_name), ('command', normalize_command(command)),
+                              ('reply', reply or {}), ('duration_micros', event.duration_micros)])
+            self._file.write(bson.BSON.encode(entry))
+            self.count += 1
+
+    def close(self):
+        """Finish the trace."""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        self._log.info('recorded {} commands to {}'.format(self.count, self.path))
+
+
+class ReplayServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """MongoDB stand-in serving the replies of a trace recorded by :any:`TraceRecorder`.
+
+    A command is answered with the reply of the next unused recorded command with the same database and normalized command,
+    commands without recorded reply fail. With fallback enabled a command without exact match, e.g., because it contains a new
+    ObjectId or the current time, is answered with the next unused command with the same name and collection instead.
+    Such replies are counted in fallbacks and logged, they do not need to belong to the command and break the determinism of the replay.
+
+    :param str path: file of the trace
+    :param float latency: seconds to wait before every reply
+    :param bool fallback: answer commands without exact match with a recorded command of the same name and collection
+    :param str host: interface to listen on
+    :param int port: port to listen on, 0 selects a free port
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, path, latency=0.0, fallback=False, host='127.0.0.1', port=0):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.latency = latency
+        self.fallback = fallback
+        self.replayed = 0
+        self.fallbacks = 0
+        self.missing = 0
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._replies = {}
+        self._fallback = {}
+        self._load(path)
+        super().__init__((host, port), ReplayHandler)
+
+    def _load(self, path):
+        count = 0
+        for entry in read_trace(path):
+            # the same item is queued under its command and its fallback key, it is marked as used when it is replayed
+            item = [entry['reply'], False]
+            self._replies.setdefault(command_key(entry['database'], entry['command']), deque()).append(item)
+            self._fallback.setdefault(self._fallback_key(entry['database'], entry['command_name'], entry['command']), deque()).append(item)
+            count += 1
+        self._log.info('loaded {} commands from {}'.format(count, path))
+
+    def _fallback_key(self, database_name, command_name, command):
+        collection = command.get('collection') if command_name == 'getMore' else command.get(command_name)
+        return database_name, command_name, collection if isinstance(collection, str) else None
+
+    def _take(self, queue):
+        """Return the reply of the first unused item of the queue, used items are dropped."""
+        while queue:
+            item = queue.popleft()
+            if not item[1]:
+                item[1] = True
+                return item[0]
+        return None
+
+    def reply(self, database_name, command):
+        """Return the recorded reply for the command.
+
+        :rtype: dict
+        """
+        command_name = next(iter(command.keys()))
+        if command_name in HANDSHAKE_COMMANDS:
+            return {'ismaster': True, 'helloOk': True, 'maxWireVersion': 8, 'minWireVersion': 0, 'maxBsonObjectSize': 16 * 1024 * 1024,
+                    'maxMessageSizeBytes': 48000000, 'maxWriteBatchSize': 100000, 'localTime': datetime.datetime.utcnow(), 'ok': 1.0}
+
+        fallback = False
+        with self._lock:
+            reply = self._take(self._replies.get(command_key(database_name, command), deque()))
+            if reply is None and self.fallback and command_name not in OK_COMMANDS:
+                reply = self._take(self._fallback.get(self._fallback_key(database_name, command_name, command), deque()))
+                fallback = reply is not None
+            if fallback:
+                self.fallbacks += 1
+            elif reply is not None:
+                self.replayed += 1
+
+        if fallback:
+            self._log.warning('replying to {} on {} with the reply of another recorded {}'.format(command_name, database_name, command_name))
+
+        if reply is None and command_name in OK_COMMANDS:
+            return {'ok': 1.0}
+        if reply is None:
+            with self._lock:
+                self.missing += 1
+            self._log.warning('no recorded reply for {} on {}'.format(command_name, database_name))
+            return {'ok': 0.0, 'errmsg': 'no recorded reply for {}'.format(command_name), 'code': 2}
+
+        if self.latency:
+            time.sleep(self.latency)
+        return reply
+
+    def start(self):
+        """Serve in a background thread."""
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop serving and close the socket."""
+        self.shutdown()
+        self.server_close()
+        self._log.info('replayed {} commands, {} fallback replies, {} commands without recorded reply'.format(self.replayed, self.fallbacks, self.missing))
+
+
+class ReplayHandler(socketserver.BaseRequestHandler):
+    """Wire protocol of one client connection of the :any:`ReplayServer`."""
+
+    def _read(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.request.recv(size - len(data))
+            if not chunk:
+                raise EOFError()
+            data += chunk
+        return data
+
+    def _send(self, request_id, op_code, body):
+        self.request.sendall(HEADER.pack(HEADER.size + len(body), 0, request_id, op_code) + body)
+
+    def handle(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        while True:
+            try:
+                length, request_id, _, op_code = HEADER.unpack(self._read(HEADER.size))
+                body = self._read(length - HEADER.size)
+            except (EOFError, ConnectionError):
+                return
+
+            if op_code == OP_QUERY:
+                # legacy handshake: flags, full collection name, skip, limit, query
+                end = body.index(b'\x00', 4)
+                database_name = body[4:end].decode('utf-8').split('.')[0]
+                command = next(bson.decode_iter(body[end + 9:], codec_options=bson.CodecOptions(document_class=bson.SON)))
+                reply = self.server.reply(database_name, command)
+                self._send(request_id, OP_REPLY, struct.pack('<iqii', 0, 0, 0, 1) + bson.BSON.encode(reply))
+            elif op_code == OP_MSG:
+                flags, command = self._parse_msg(body)
+                reply = self.server.reply(command.get('$db', 'admin'), command)
+                if not flags & MORE_TO_COME:
+                    self._send(request_id, OP_MSG, struct.pack('<IB', 0, 0) + bson.BSON.encode(reply))
+            else:
+                self.server._log.warning('unsupported op code {}'.format(op_code))
+                return
+
+    def _parse_msg(self, body):
+        """Return the flags and the command of an OP_MSG, document sequences are added to the command."""
+        flags = struct.unpack('<I', body[:4])[0]
+        end = len(body) - 4 if flags & CHECKSUM_PRESENT else len(body)
+        options = bson.CodecOptions(document_class=bson.SON)
+
+        command = None
+        sequences = []
+        position = 4
+        while position < end:
+            kind = body[position]
+            position += 1
+            size = struct.unpack('<i', body[position:position + 4])[0]
+            if kind == 0:
+                command = bson.BSON(body[position:position + size]).decode(options)
+            else:
+                name_end = body.index(b'\x00', position + 4)
+                sequences.append((body[position + 4:name_end].decode('utf-8'), list(bson.decode_iter(body[name_end + 1:position + size], codec_options=options))))
+            position += size
+
+        for name, documents in sequences:
+            command[name] = documents
+        return flags, command
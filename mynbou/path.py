@@ -10,30 +10,51 @@ Volg which traverses backwards from the selected release to collect change metri
 
 import logging
 import copy
+import heapq
+import timeit
 
 from collections import deque
 
+import numpy as np
 import networkx as nx
-from Levenshtein import distance
 from dateutil.relativedelta import relativedelta
 
-from pycoshark.mongomodels import Commit, CodeEntityState, FileAction, File, Issue, Hunk, Refactoring, CommitChanges
-from pycoshark.utils import java_filename_filter, jira_is_resolved_and_fixed, get_commit_graph, heuristic_renames
+from pycoshark.mongomodels import Commit, CodeEntityState, FileAction
+from pycoshark.utils import java_filename_filter, jira_is_resolved_and_fixed
 
-from bson.objectid import ObjectId
 from mynbou.constants import *
+from mynbou.graph import CommitGraph
+from mynbou.lineage import RenameIndex, ReleaseNames
+from mynbou.resolver import FileResolver
+from mynbou.cache import ClassMetricCache
+from mynbou.inducing import InducingIndex
+from mynbou.prefetch import prefetch_commits, prefetch_file_actions, hunk_counts, prefetch_refactorings, prefetch_commit_changes, IssueCache
 
 
 class OntdekBaan(object):
-    """Simple variant of OntdekBaan which yields the paths via bfs until a break condition is hit or no unvisited nodes remain."""
+    """Simple variant of OntdekBaan which yields the paths via bfs until a break condition is hit or no unvisited nodes remain.
+
+    The traversal never modifies the graph, it works on a read-only view instead of a copy of the graph.
+    """
 
     def __init__(self, g):
-        self._graph = g.copy()
+        self._graph = g.copy(as_view=True)
         self._nodes = set()
         self._log = logging.getLogger(self.__class__.__name__)
 
     def _bfs_paths(self, source, predecessors, break_condition):
-        paths = {0: [source]}
+        """Yield every path found by the bfs.
+
+        The paths are stored as a shared-prefix tree: every entry holds a node and the index of its previous entry,
+        a path is identified by the entries of its first and last node.
+        A path branching off another path reuses the entry of its first node so that no node lists are duplicated.
+        The tails map holds for every node the numbers of the paths which currently end in that node.
+        """
+        entry_nodes = [source]
+        entry_prev = [-1]
+        entry_of = {source: 0}
+        paths = [[0, 0]]
+        tails = {source: [0]}
         visited = set()
 
         if source not in self._graph:
@@ -54,14 +75,23 @@ class OntdekBaan(object):
                     if break_condition is not None and break_condition(child):
                         break_child = True
 
-                    # find path which last node is parent, append first child
+                    # find first path which last node is parent, append child, otherwise start a new path [parent, child]
                     if not break_child:
-                        for path_num, nodes in paths.items():
-                            if parent == nodes[-1]:
-                                paths[path_num].append(child)
-                                break
+                        if parent in tails:
+                            path_num = heapq.heappop(tails[parent])
+                            if not tails[parent]:
+                                del tails[parent]
+                            prev = paths[path_num][1]
                         else:
-                            paths[len(paths)] = [parent, child]
+                            path_num = len(paths)
+                            prev = entry_of[parent]
+                            paths.append([prev, None])
+
+                        entry_nodes.append(child)
+                        entry_prev.append(prev)
+                        entry_of.setdefault(child, len(entry_nodes) - 1)
+                        paths[path_num][1] = len(entry_nodes) - 1
+                        heapq.heappush(tails.setdefault(child, []), path_num)
 
                     visited.add((parent, child))
 
@@ -71,7 +101,16 @@ class OntdekBaan(object):
             # every child iterated
             except StopIteration:
                 queue.popleft()
-        return paths
+
+        for first, last in paths:
+            path = []
+            entry = last
+            while entry != first:
+                path.append(entry_nodes[entry])
+                entry = entry_prev[entry]
+            path.append(entry_nodes[first])
+            path.reverse()
+            yield path
 
     def set_path(self, start, direction='backward', break_condition=None):
         """Set start node and travel direction for the BFS."""
@@ -82,15 +121,11 @@ class OntdekBaan(object):
     def all_paths(self):
         """Generator that yields all possible paths fomr the given start node and the direction."""
         if self._direction == 'backward':
-            paths = self._bfs_paths(self._start, self._graph.predecessors, self._break_condition)
-
-            for path_num, path in paths.items():
+            for path in self._bfs_paths(self._start, self._graph.predecessors, self._break_condition):
                 yield path
 
         elif self._direction == 'forward':
-            paths = self._bfs_paths(self._start, self._graph.successors, self._break_condition)
-
-            for path_num, path in paths.items():
+            for path in self._bfs_paths(self._start, self._graph.successors, self._break_condition):
                 yield path
 
         else:
@@ -103,11 +138,49 @@ class Volg(object):
     It takes a target release and tracks the files contained in the target release backwards.
     If we encounter a rename we add the old name of the file to the aliases of the filename we know, this allows us to keep track of these files.
     If we encounter a copy operation we do not add the old name of the file to the aliases because that file contiues to exist and we would then mix them up.
+
+    The change metrics are collected from the 6 months before the release, the traversal mode decides how this window is walked:
+    paths (default) processes every commit of every change path found by :any:`OntdekBaan`, a commit contained in more than one path is processed more than once.
+    commits processes every commit of the window exactly once in topological order without materialising paths.
     """
 
-    def __init__(self, graph, vcs, target_release_hash):
+    TRAVERSAL_MODES = ['paths', 'commits']
+
+    def __init__(self, graph, vcs, target_release_hash, traversal='paths', lineage=None, class_metrics=None, inducing=None):
         self._log = logging.getLogger(self.__class__.__name__)
 
+        if traversal not in self.TRAVERSAL_MODES:
+            raise Exception('no such traversal mode: {}, please use one of {}'.format(traversal, ', '.join(self.TRAVERSAL_MODES)))
+        self._traversal = traversal
+
+        # NetworkX graphs do not carry the commit attributes, they are loaded for the nodes of the graph
+        if isinstance(graph, nx.DiGraph):
+            graph = CommitGraph.from_networkx_commits(graph, vcs.id)
+        elif not isinstance(graph, CommitGraph):
+            raise TypeError('graph has to be a CommitGraph or a networkx.DiGraph, not {}'.format(type(graph).__name__))
+
+        # paths of the files of the vcs
+        self._files = FileResolver.for_vcs(vcs.id)
+
+        # renames and additions of every commit, shared by the first occurence calculation and the issue loaders
+        if lineage is None:
+            lineage = RenameIndex.from_commits(vcs.id, graph.commit_ids())
+        self._lineage = lineage
+
+        # averaged class metrics per commit and file for the dambros metrics
+        if class_metrics is None:
+            class_metrics = ClassMetricCache(None, vcs.id)
+        self._class_metrics = class_metrics
+
+        # names at the release for every descendant of the release, computed on first use by the issue loaders
+        self._release_names = None
+
+        # inducing FileActions per bug fixing FileAction, loaded on first use by the issue loaders if not given
+        self._inducing = inducing
+
+        # issues linked to commits of the change window and of bug fixes, shared by the change metrics and the issue loaders
+        self._issues = IssueCache()
+
         # the metrics that are collected for each file
         self._init_metrics = {'change_types': [], 'bug_fixes': [], 'authors': [], 'revisions': [], 'lines_added': [], 'lines_deleted': [], 'changesets': [], 'ages': [], 'aliases': [], 'linked_issues': [], 'commit_messages': [], 'days_from_release': [], 'refactorings': []}
 
@@ -125,11 +198,33 @@ class Volg(object):
 
         self._target_release_hash = target_release_hash
 
-        # all paths back to origin
-        self._origin_paths = self._origin_paths(graph, target_release_hash)
-
-        # all paths back to origin for 6 months
-        self._change_paths = self._change_paths(vcs, graph, target_release_hash)
+        # every commit which has a path to the release (including the release itself) as mask over the commit ids
+        if target_release_hash not in graph:
+            raise Exception('Commit {} is not contained in the commit graph'.format(target_release_hash))
+        release_id = graph.id_of(target_release_hash)
+        self._release_ancestors = graph.ancestor_ids(release_id)
+        self._release_ancestors[release_id] = True
+        self._release_history_ids = None
+
+        # number of paths (or commits) found by the traversals and the time they took, None if a traversal was not run
+        self.path_statistics = {'origin_paths': None, 'origin_paths_seconds': None,
+                                'change_paths': None, 'change_paths_seconds': None,
+                                'change_window_commits': None, 'change_window_seconds': None,
+                                'first_occured_seconds': None}
+
+        # all paths back to origin are only computed on first access, see origin_paths
+        self._origin_paths = None
+
+        # all paths back to origin for 6 months, or only the commits of the 6 months
+        start = timeit.default_timer()
+        if traversal == 'paths':
+            self._change_paths = self._find_change_paths(graph, target_release_hash)
+            self.path_statistics['change_paths'] = len(self._change_paths)
+            self.path_statistics['change_paths_seconds'] = timeit.default_timer() - start
+        else:
+            self._change_commits = graph.history_window(target_release_hash, graph.committer_date(target_release_hash) - relativedelta(months=6))
+            self.path_statistics['change_window_commits'] = len(self._change_commits)
+            self.path_statistics['change_window_seconds'] = timeit.default_timer() - start
 
         self._vcs = vcs
 
@@ -147,77 +242,117 @@ class Volg(object):
 
         # used to track static metric deltas to construct dambros delta matrix
         self._dambros_values = []
-        self._dambros_metrics_used = ['wmc', 'dit', 'rfc', 'noc', 'cbo', 'lcom5', 'nii', 'noi', 'tna', 'tnpa', 'tna-tnpa', 'tna-tnla', 'tloc', 'tnm', 'tnlpm', 'tnm-tnpm', 'tnm-tnlm']
+        self._dambros_metrics_used = DAMBROS_METRICS
         self._dambros_window_size_days = 14
         self._dambros_last_date = self._release_date + relativedelta(days=self._dambros_window_size_days + 1)
 
         # get first occurences of release files
-        self._first_occurences, self._aliases, self._file_name_changes = self.first_occured(vcs, self._origin_paths, self._release_files)
+        start = timeit.default_timer()
+        self._first_occurences, self._aliases, self._file_name_changes = self.first_occured(vcs, self._release_files)
+        self.path_statistics['first_occured_seconds'] = timeit.default_timer() - start
+
+    @property
+    def origin_paths(self):
+        """All paths from the release back to the origin of the repository.
 
-    def _origin_paths(self, graph, target_release_hash):
+        The paths are only discovered on first access as they are expensive for long histories and not needed by the metric collection.
+        """
+        if self._origin_paths is None:
+            start = timeit.default_timer()
+            self._origin_paths = self._find_origin_paths(self._graph, self._target_release_hash)
+            self.path_statistics['origin_paths'] = len(self._origin_paths)
+            self.path_statistics['origin_paths_seconds'] = timeit.default_timer() - start
+            self._log.debug('found {} origin paths in {:.5f}s'.format(len(self._origin_paths), self.path_statistics['origin_paths_seconds']))
+        return self._origin_paths
+
+    def _labelled_commits(self, label, after, before=None):
+        """Return the ids of all commits with the label from COMMIT_LABELS committed after (and before) the given dates."""
+        mask = self._graph.attributes.label_mask(label) & (self._graph.committer_dates > np.datetime64(after))
+        if before is not None:
+            mask &= self._graph.committer_dates < np.datetime64(before)
+        return [self._graph.object_id_of(i) for i in np.flatnonzero(mask)]
+
+    def _release_history(self):
+        """Return the ids of all commits with a path to the release, ordered by committer date and author date (newest first)."""
+        if self._release_history_ids is None:
+            ids = np.flatnonzero(self._release_ancestors)
+            order = np.lexsort((self._graph.attributes.author_dates[ids], self._graph.committer_dates[ids]))[::-1]
+            self._release_history_ids = ids[order].tolist()
+        return self._release_history_ids
+
+    def _has_path_to_release(self, revision_hash):
+        """Return True if there is a path from the commit to the target release."""
+        return revision_hash in self._graph and bool(self._release_ancestors[self._graph.id_of(revision_hash)])
+
+    def _find_origin_paths(self, graph, target_release_hash):
         o = OntdekBaan(graph)
         o.set_path(target_release_hash, 'backward')
         return list(o.all_paths())
 
-    def _change_paths(self, vcs, graph, target_release_hash):
-        target_release = Commit.objects.get(vcs_system_id=vcs.id, revision_hash=target_release_hash)
-        previous1 = target_release.committer_date - relativedelta(months=6)
+    def _find_change_paths(self, graph, target_release_hash):
+        previous1 = np.datetime64(graph.committer_date(target_release_hash) - relativedelta(months=6))
 
         def break_condition(commit):
-            tr = Commit.objects.get(revision_hash=commit, vcs_system_id=vcs.id)
-            return tr.committer_date < previous1
+            return graph.committer_dates[graph.id_of(commit)] < previous1
 
         o = OntdekBaan(graph)
         o.set_path(target_release_hash, 'backward', break_condition)
         return list(o.all_paths())
 
-    def calc_current_files(self, commit, release_commit, commit_graph, undirected_graph, rename_cache, current_files):
+    def calc_current_files(self, commit, release_commit, current_files):
         """determines the java files changed by a commit and returns them as a set"""
         path_valid = False
         current_files_start = current_files.copy()
-        try:
-            shortest_paths = list(nx.all_shortest_paths(undirected_graph, release_commit.revision_hash, commit.revision_hash))
-        except nx.NetworkXNoPath:
-            shortest_paths = []
-        for path in shortest_paths:
+        for path in self._graph.all_shortest_paths(release_commit.revision_hash, commit.revision_hash):
             # path = nx.shortest_path(undirected_graph, release_commit.revision_hash, commit.revision_hash)
             current_files = current_files_start.copy()
             path_valid = True
             had_backward_edge = False
             for i in range(len(path)-1, 0, -1): # going backwards
-                if path[i-1] in commit_graph.pred[path[i]]:
+                if self._graph.has_edge(path[i-1], path[i]):
                     if had_backward_edge:
                         # invalid change of direction
                         path_valid = False
                         break
-                    if path[i] in rename_cache:
-                        renames = rename_cache[path[i]]
-                    else:
-                        renames = heuristic_renames(self._vcs.id, path[i])
-                        rename_cache[path[i]] = renames
-                    if renames is not None:
-                        for rename in renames[0]:
-                            if rename[1] in current_files:
-                                current_files.remove(rename[1])
-                                current_files.add(rename[0])
-                        for deletion in renames[1]:
-                            current_files.discard(deletion)
-                elif path[i-1] in commit_graph.succ[path[i]]:
+                    true_renames, false_renames = self._renames(path[i])
+                    for rename in true_renames:
+                        if rename[1] in current_files:
+                            current_files.remove(rename[1])
+                            current_files.add(rename[0])
+                    for deletion in false_renames:
+                        current_files.discard(deletion)
+                elif self._graph.has_edge(path[i], path[i-1]):
                     had_backward_edge = True
-                    if path[i-1] in rename_cache:
-                        renames = rename_cache[path[i-1]]
-                    else:
-                        renames = heuristic_renames(self._vcs.id, path[i-1])
-                        rename_cache[path[i-1]] = renames
-                    if renames is not None:
-                        for rename in renames[0]:
-                            if rename[0] in current_files:
-                                current_files.remove(rename[0])
-                                current_files.add(rename[1])
+                    true_renames, false_renames = self._renames(path[i-1])
+                    for rename in true_renames:
+                        if rename[0] in current_files:
+                            current_files.remove(rename[0])
+                            current_files.add(rename[1])
             if path_valid:
                 break
         return current_files, path_valid
 
+    def _inducing_index(self):
+        """Return the :any:`InducingIndex` of the VCS, it is built once and shared by the issue loaders."""
+        if self._inducing is None:
+            self._inducing = InducingIndex.from_commits(self._graph.commit_ids())
+        return self._inducing
+
+    def files_at_release(self, commit, current_files):
+        """Translate the names of files changed by a commit to their names at the release.
+
+        Descendants of the release are looked up in the :any:`ReleaseNames` sweep, other commits fall back to :any:`calc_current_files`.
+
+        :rtype: tuple
+        :returns: (files, path_valid) like calc_current_files
+        """
+        if self._release_names is None:
+            self._release_names = ReleaseNames(self._graph, self._lineage, self._target_release_hash)
+
+        if commit.revision_hash in self._release_names:
+            return self._release_names.at_release(commit.revision_hash, current_files), True
+        return self.calc_current_files(commit, self._release_commit, current_files)
+
     def issues_six_months_szz(self):
         """basically looks six months into the future from the release and counts the defects that we can match
 
@@ -227,34 +362,40 @@ class Volg(object):
         
         files_release = self._release_files
 
-        commit_graph = get_commit_graph(self._vcs.id)
-        undirected_graph = commit_graph.to_undirected(as_view=True)
-        rename_cache = {}
         delete_cache = {}
 
         all_fixed_issues = set()
         six_months = self._release_date + relativedelta(months=6)
-        for commit in Commit.objects.filter(vcs_system_id=self._vcs.id, committer_date__gt=self._release_date, committer_date__lt=six_months, labels__adjustedszz_bugfix=True, szz_issue_ids__0__exists=True).only('id', 'committer_date', 'szz_issue_ids', 'revision_hash').timeout(False):
-            for issue in Issue.objects.filter(id__in=commit.szz_issue_ids):
+        bugfix_commits = self._labelled_commits('adjustedszz_bugfix', self._release_date, six_months)
+        commits = list(Commit.objects.filter(id__in=bugfix_commits, szz_issue_ids__0__exists=True).only('id', 'committer_date', 'szz_issue_ids', 'revision_hash').timeout(False))
+        self._issues.load([issue_id for commit in commits for issue_id in commit.szz_issue_ids])
+        for commit in commits:
+            for issue in self._issues.issues(commit.szz_issue_ids):
                 if str(issue.issue_type).lower() == "bug" and jira_is_resolved_and_fixed(issue):
                     all_fixed_issues.add(issue)
 
+        # the bug fixing commits of every issue, in the order of the commits
+        commits_of = {}
+        for commit in commits:
+            for issue_id in set(commit.szz_issue_ids):
+                commits_of.setdefault(issue_id, []).append(commit)
+
         ret = {rfile: [] for rfile in files_release}
 
         for issue in all_fixed_issues:
-            for bugfix_commit in Commit.objects.filter(vcs_system_id=self._vcs.id, labels__adjustedszz_bugfix=True, szz_issue_ids=issue.id, committer_date__gt=self._release_date, committer_date__lt=six_months).only('revision_hash', 'id', 'szz_issue_ids', 'committer_date').timeout(False):
+            for bugfix_commit in commits_of[issue.id]:
                 
                 # in comparison to issues_six_months_szzr() we skip the inducing step and just use every bugfix commit within 6 months window
                 changed_files = set()
                 for fa in FileAction.objects.filter(commit_id=bugfix_commit.id, mode='M'):
 
-                    f = File.objects.get(id=fa.file_id)
-                    if f.path not in changed_files and java_filename_filter(f.path):
-                        changed_files.add(f.path)
+                    path = self._files.path(fa.file_id)
+                    if path not in changed_files and java_filename_filter(path):
+                        changed_files.add(path)
 
                 current_files = None
                 if current_files is None:
-                    current_files, path_valid = self.calc_current_files(bugfix_commit, self._release_commit, commit_graph, undirected_graph, rename_cache, changed_files)
+                    current_files, path_valid = self.files_at_release(bugfix_commit, changed_files)
 
                     if path_valid and len(current_files.intersection(files_release))>0:
                         for f in current_files:
@@ -278,22 +419,28 @@ class Volg(object):
         
         files_release = self._release_files
 
-        commit_graph = get_commit_graph(self._vcs.id)
-        undirected_graph = commit_graph.to_undirected(as_view=True)
-        rename_cache = {}
         delete_cache = {}
 
         all_fixed_issues = set()
         six_months = self._release_date + relativedelta(months=6)
-        for commit in Commit.objects.filter(vcs_system_id=self._vcs.id, committer_date__gt=self._release_date, committer_date__lt=six_months, labels__issueonly_bugfix=True, linked_issue_ids__0__exists=True).only('id', 'committer_date', 'linked_issue_ids', 'revision_hash').timeout(False):
-            for issue in Issue.objects.filter(id__in=commit.linked_issue_ids):
+        bugfix_commits = self._labelled_commits('issueonly_bugfix', self._release_date, six_months)
+        commits = list(Commit.objects.filter(id__in=bugfix_commits, linked_issue_ids__0__exists=True).only('id', 'committer_date', 'linked_issue_ids', 'revision_hash').timeout(False))
+        self._issues.load([issue_id for commit in commits for issue_id in commit.linked_issue_ids])
+        for commit in commits:
+            for issue in self._issues.issues(commit.linked_issue_ids):
                 if str(issue.issue_type).lower() == "bug" and jira_is_resolved_and_fixed(issue):
                     all_fixed_issues.add(issue)
 
+        # the bug fixing commits of every issue, in the order of the commits
+        commits_of = {}
+        for commit in commits:
+            for issue_id in set(commit.linked_issue_ids):
+                commits_of.setdefault(issue_id, []).append(commit)
+
         ret = {rfile: [] for rfile in files_release}
 
         for issue in all_fixed_issues:
-            for bugfix_commit in Commit.objects.filter(vcs_system_id=self._vcs.id, linked_issue_ids=issue.id, committer_date__gt=self._release_date, labels__issueonly_bugfix=True, committer_date__lt=six_months).only('revision_hash', 'id', 'linked_issue_ids', 'committer_date').timeout(False):
+            for bugfix_commit in commits_of[issue.id]:
                 
                 # calculate if there are any inducings for this fa with the specific label
                 # if yes then we consider it?
@@ -302,15 +449,15 @@ class Volg(object):
                 for fa in FileAction.objects.filter(commit_id=bugfix_commit.id, mode='M'):
 
                     # check if we find at least one inducing to this fa
-                    if not FileAction.objects.filter(induces__match={'change_file_action_id': fa.id, 'label': 'JL+R'}).count() > 0:
+                    if not self._inducing_index().inducing(fa.id, 'JL+R'):
                         continue
 
-                    f = File.objects.get(id=fa.file_id)
-                    if f.path not in changed_files and java_filename_filter(f.path):
-                        changed_files.add(f.path)
+                    path = self._files.path(fa.file_id)
+                    if path not in changed_files and java_filename_filter(path):
+                        changed_files.add(path)
 
                 if len(changed_files)>0:
-                    current_files, path_valid = self.calc_current_files(bugfix_commit, self._release_commit, commit_graph, undirected_graph, rename_cache, changed_files)
+                    current_files, path_valid = self.files_at_release(bugfix_commit, changed_files)
 
                     if path_valid and len(current_files.intersection(files_release))>0:
                         for f in current_files:
@@ -342,8 +489,10 @@ class Volg(object):
         skipped_issues = set()
         all_fixed_issues = set()
 
-        for commit in Commit.objects.filter(vcs_system_id=self._vcs.id, committer_date__gt=self._release_date, labels__validated_bugfix=True, fixed_issue_ids__0__exists=True).only('id', 'committer_date', 'fixed_issue_ids', 'revision_hash').timeout(False):
-            for issue in Issue.objects.filter(id__in=commit.fixed_issue_ids):
+        commits = list(Commit.objects.filter(id__in=self._labelled_commits('validated_bugfix', self._release_date), fixed_issue_ids__0__exists=True).only('id', 'committer_date', 'fixed_issue_ids', 'revision_hash').timeout(False))
+        self._issues.load([issue_id for commit in commits for issue_id in commit.fixed_issue_ids])
+        for commit in commits:
+            for issue in self._issues.issues(commit.fixed_issue_ids):
                 if issue.issue_type_verified and issue.issue_type_verified.lower() == "bug" and jira_is_resolved_and_fixed(issue):
                     all_fixed_issues.add(issue)
 
@@ -356,40 +505,36 @@ class Volg(object):
                 for fa in FileAction.objects.filter(commit_id=bugfix_commit.id, mode='M'):
 
                     # load bug_inducing FileActions
-                    for ifa in FileAction.objects.filter(induces__match={'change_file_action_id': fa.id, 'label': 'JLMIV+R'}):
-
-                        # still need to fetch the correct one
-                        for ind in ifa.induces:
-                            if ind['change_file_action_id'] == fa.id and ind['label'] == 'JLMIV+R' and ind['szz_type'] != 'hard_suspect':
-
-                                bc = Commit.objects.get(id=ifa.commit_id)
-                                blame_commit = bc.revision_hash
-                                blame_file = File.objects.get(id=ifa.file_id).path
+                    for ind in self._inducing_index().inducing(fa.id, 'JLMIV+R'):
+                        if ind.szz_type != 'hard_suspect':
+                            bc = Commit.objects.get(id=ind.commit_id)
+                            blame_commit = bc.revision_hash
+                            blame_file = self._files.path(ind.file_id)
 
-                                blame_id = '{}_{}'.format(blame_commit, issue.external_id)
+                            blame_id = '{}_{}'.format(blame_commit, issue.external_id)
 
-                                blame_commits.append(blame_id)
+                            blame_commits.append(blame_id)
 
-                                # if this inducing commit has no path to our release we skip it altogether
-                                if not nx.has_path(self._graph, blame_commit, self._target_release_hash):
-                                    if bc.fixed_issue_ids is None or issue.id not in bc.fixed_issue_ids:
-                                        inducings_have_path = False
-                                        self._log.debug('[{}] has no path to release, skipping issue: {}'.format(blame_commit, issue.external_id))
-                                else:
-                                    # skip if we are not interested in the blame_file (because it does not point to a release file)
-                                    if blame_file not in self._aliases.keys():
-                                        if java_filename_filter(blame_file, production_only=True):
-                                            self._log.debug('[{}] {} not in release files or aliases {}, skipping issues: {}'.format(blame_commit, blame_file, self._aliases.keys(), issue.external_id))
-                                        skipped_issues.add(issue.external_id)
-                                        continue
+                            # if this inducing commit has no path to our release we skip it altogether
+                            if not self._has_path_to_release(blame_commit):
+                                if bc.fixed_issue_ids is None or issue.id not in bc.fixed_issue_ids:
+                                    inducings_have_path = False
+                                    self._log.debug('[{}] has no path to release, skipping issue: {}'.format(blame_commit, issue.external_id))
+                            else:
+                                # skip if we are not interested in the blame_file (because it does not point to a release file)
+                                if blame_file not in self._aliases.keys():
+                                    if java_filename_filter(blame_file, production_only=True):
+                                        self._log.debug('[{}] {} not in release files or aliases {}, skipping issues: {}'.format(blame_commit, blame_file, self._aliases.keys(), issue.external_id))
+                                    skipped_issues.add(issue.external_id)
+                                    continue
 
-                                    if blame_id not in buginducing_commits.keys():
-                                        buginducing_commits[blame_id] = {}
+                                if blame_id not in buginducing_commits.keys():
+                                    buginducing_commits[blame_id] = {}
 
-                                    if blame_file not in buginducing_commits[blame_id].keys():
-                                        buginducing_commits[blame_id][blame_file] = []
+                                if blame_file not in buginducing_commits[blame_id].keys():
+                                    buginducing_commits[blame_id][blame_file] = []
 
-                                    buginducing_commits[blame_id][blame_file].append((issue.external_id, str(bugfix_commit.committer_date), bugfix_commit.revision_hash, str(issue.priority).lower(), str(issue.issue_type_verified).lower(), str(issue.created_at)))
+                                buginducing_commits[blame_id][blame_file].append((issue.external_id, str(bugfix_commit.committer_date), bugfix_commit.revision_hash, str(issue.priority).lower(), str(issue.issue_type_verified).lower(), str(issue.created_at)))
 
             # not every blame commit has a path to the release
             # we need to remove all of them in this case
@@ -415,13 +560,14 @@ class Volg(object):
 
     def _add_linked_issues(self, file, commit):
         for issue_id in commit.linked_issue_ids:
-            i = Issue.objects.get(id=issue_id)
+            i = self._issues.get(issue_id)
             self._change_metrics[file]['linked_issues'].append({'external_id': i.external_id, 'priority': i.priority, 'issue_type': i.issue_type})
 
-    def _add_change_metrics(self, file, fa, commit):
+    def _add_change_metrics(self, file, fa, commit, hunks):
         """Add change metrics to our current batch.
 
         It prepends to a list because we are traversing backwards from the release date.
+        The hunks are the number of hunks of all FileActions of the commit.
         """
         author_identity = commit.author_id  # author_identity = Identity.objects.get(people=commit.author_id)  for now we ignore Identities
 
@@ -429,7 +575,7 @@ class Volg(object):
         self._change_metrics[file]['revisions'] = [commit.revision_hash] + self._change_metrics[file]['revisions']
         self._change_metrics[file]['lines_added'] = [fa.lines_added] + self._change_metrics[file]['lines_added']
         self._change_metrics[file]['lines_deleted'] = [fa.lines_deleted] + self._change_metrics[file]['lines_deleted']
-        self._change_metrics[file]['changesets'] = [len(Hunk.objects.filter(file_action_id__in=[ffa.id for ffa in FileAction.objects.filter(commit_id=commit.id)]))] + self._change_metrics[file]['changesets']
+        self._change_metrics[file]['changesets'] = [hunks] + self._change_metrics[file]['changesets']
         self._change_metrics[file]['commit_messages'] = [commit.message] + self._change_metrics[file]['commit_messages']
 
         # we also calculate a list of ages to calulate weighted age later
@@ -439,45 +585,31 @@ class Volg(object):
         self._change_metrics[file]['ages'] = [td.days] + self._change_metrics[file]['ages']
         self._change_metrics[file]['days_from_release'] = [td2.days] + self._change_metrics[file]['days_from_release']
 
-    def _add_refactorings(self, commit):
-        cache = set()
-        for ref in Refactoring.objects.filter(commit_id=commit.id):
-            if 'ce_after' in ref.ce_state.keys():
-                ces = CodeEntityState.objects.get(id=ref.ce_state['ce_after'])
-                if ces:
-                    file = File.objects.get(id=ces.file_id)
-
-                    if file.path not in self._aliases.keys():
-                        continue
+    def _add_refactorings(self, refactorings):
+        """Add the refactorings of one commit, every refactoring of a file, type and code entity counts once.
 
-                    cache.add((file.path, ref.type, ces.long_name))
-                    # self._log.debug('[{}] refactoring File: {}, CES: {}, Type: {}'.format(revision_hash, file.path, ces.long_name, ref.type))
+        :param list refactorings: (file path, refactoring type, long name) tuples, see :any:`prefetch_refactorings`
+        """
+        cache = set()
+        for (ref_file, ref, long_name) in refactorings:
+            if ref_file not in self._aliases.keys():
+                continue
+            cache.add((ref_file, ref, long_name))
         for (ref_file, ref, long_name) in cache:
             self._change_metrics[self._aliases[ref_file]]['refactorings'].append(ref)
 
-    def _add_change_types(self, old_commit, new_commit):
-        try:
-            cc = CommitChanges.objects.get(old_commit_id=old_commit.id, new_commit_id=new_commit.id)
-        except CommitChanges.DoesNotExist:
-            return
-
-        if not cc.classification:
-            return
+    def _add_change_types(self, classification):
+        """Add the change type vectors of one commit.
 
-        for file_id, changes in cc.classification.items():
-            file = File.objects.get(id=file_id)
+        :param dict classification: file id -> change type vector, see :any:`prefetch_commit_changes`
+        """
+        for file_id, change_types in classification.items():
+            path = self._files.path(file_id)
 
-            if file.path not in self._aliases.keys():
+            if path not in self._aliases.keys():
                 continue
 
-            # initialize the file with 0 if it does not exist
-            change_types = {d: 0 for d in CHANGE_TYPES}
-
-            # update with new values
-            for ctype, cvalue in changes.items():
-                change_types[ctype.lower()] += cvalue
-
-            self._change_metrics[self._aliases[file.path]]['change_types'] += [change_types]
+            self._change_metrics[self._aliases[path]]['change_types'].append(change_types)
 
     def _add_dambros_metrics(self, commit):
         """Use for dambros."""
@@ -487,46 +619,18 @@ class Volg(object):
 
         self._dambros_last_date = commit.committer_date
 
-        # we need to collect the classes per file
-        files = File.objects.filter(path__in=self._aliases.keys())
-
-        # 2. if not collect metrics from the commit and filter for files in our aliases
-        classes = CodeEntityState.objects().aggregate(*[
-            {'$match': {'_id': {'$in': [ObjectId(cesid) for cesid in commit.code_entity_states]}, 'ce_type': 'class', 'file_id': {'$in': [ObjectId(f.id) for f in files]}}},
-            {'$group': {'_id': '$file_id',
-                        'wmc': {'$avg': '$metrics.WMC'},
-                        'dit': {'$avg': '$metrics.DIT'},
-                        'rfc': {'$avg': '$metrics.RFC'},
-                        'noc': {'$avg': '$metrics.NOC'},
-                        'cbo': {'$avg': '$metrics.CBO'},
-                        'lcom5': {'$avg': '$metrics.LCOM5'},
-                        'nii': {'$avg': '$metrics.NII'},
-                        'noi': {'$avg': '$metrics.NOI'},
-                        'tna': {'$avg': '$metrics.TNA'},
-                        'tnpa': {'$avg': '$metrics.TNPA'},
-                        'tloc': {'$avg': '$metrics.TLOC'},
-                        'tnm': {'$avg': '$metrics.TNM'},
-                        'tnlpm': {'$avg': '$metrics.TNLPM'},
-                        'tnla': {'$avg': '$metrics.TNLA'},
-                        'tnpm': {'$avg': '$metrics.TNPM'},
-                        'tnlm': {'$avg': '$metrics.TNLM'}
-                        }},
-            {'$addFields': {'tna-tnpa': {'$subtract': ['$tna', '$tnpa']},
-                            'tna-tnla': {'$subtract': ['$tna', '$tnla']},
-                            'tnm-tnpm': {'$subtract': ['$tnm', '$tnpm']},
-                            'tnm-tnlm': {'$subtract': ['$tnm', '$tnlm']}}}
-        ])
-
-        # grouped by file id
+        # 2. if not collect the metrics of the commit (materialised per commit) and filter for files in our aliases
         tmp = {}
-        for cl in classes:
-            f = File.objects.get(id=cl['_id'])
-            target = self._aliases[f.path]
+        for file_id, values in self._class_metrics.averages(commit.id).items():
+            path = self._files.path(file_id)
+            if path not in self._aliases.keys():
+                continue
+            target = self._aliases[path]
 
             tmp[target] = {}
-            for m in self._dambros_metrics_used:
-                if m in cl.keys() and cl[m]:
-                    tmp[target][m] = cl[m]
+            for m, value in zip(self._dambros_metrics_used, values.tolist()):
+                if value and not np.isnan(value):
+                    tmp[target][m] = value
 
         self._dambros_values.append(tmp)
 
@@ -556,115 +660,111 @@ class Volg(object):
                             deltas[m][file].append(abs(entry1[file][m] - entry2[file][m]))
         return deltas
 
+    def _change_window(self):
+        """Yield the revision hashes of the change window in the order they are processed.
+
+        In paths mode these are the commits of every change path, in commits mode every commit of the window once.
+        """
+        if self._traversal == 'paths':
+            for path in self._change_paths:
+                for revision_hash in path:
+                    yield revision_hash
+        else:
+            for revision_hash in self._change_commits:
+                yield revision_hash
+
+    def change_window_commits(self):
+        """Return the set of revision hashes of all commits within the change window."""
+        return set(self._change_window())
+
     def change_metrics(self):
         """Change path metric calculation.
 
-        Uses the change paths which uses a cutoff time.
+        Uses the change paths (or the commits of the change window) which uses a cutoff time.
+        The commits, FileActions, hunk counts, refactorings, change types and linked issues of all commits in the window are prefetched before the traversal,
+        the traversal itself does not query the database (except for class metrics of sampled commits which are not cached).
         """
-        for path in self._change_paths:
-            for revision_hash in path:
-                c = Commit.objects.get(vcs_system_id=self._vcs.id, revision_hash=revision_hash)
+        # every call starts from fresh metrics and dambros samples so that calling it again returns the same result
+        self._change_metrics = {file: copy.deepcopy(self._init_metrics) for file in self._release_files}
+        self._dambros_values = []
+        self._dambros_last_date = self._release_date + relativedelta(days=self._dambros_window_size_days + 1)
 
-                # skip merge commits as we traverse all possible paths
-                if len(c.parents) > 1:
-                    continue
+        window = sorted(self._graph.id_of(h) for h in self.change_window_commits() if self._graph.parent_count(h) <= 1)
+        window_commit_ids = [self._graph.object_id_of(i) for i in window]
+        commits = prefetch_commits(window_commit_ids)
+        file_actions = prefetch_file_actions(window_commit_ids)
+        hunks = hunk_counts(file_actions)
+        refactorings = prefetch_refactorings(window_commit_ids)
+        commit_changes = prefetch_commit_changes(window_commit_ids)
+        self._issues.load(issue_id for c in commits.values() for issue_id in c.linked_issue_ids)
 
-                for fa in FileAction.objects.filter(commit_id=c.id):
-                    f = File.objects.get(id=fa.file_id)
+        for revision_hash in self._change_window():
 
-                    # skip file we are not interested in
-                    if f.path not in self._aliases.keys():
-                        continue
+            # skip merge commits as we traverse all possible paths
+            if self._graph.parent_count(revision_hash) > 1:
+                continue
+
+            c = commits[self._graph.object_id_of(self._graph.id_of(revision_hash))]
+            commit_file_actions = file_actions.get(c.id, [])
+
+            for fa in commit_file_actions:
+                path = self._files.path(fa.file_id)
+
+                # skip file we are not interested in
+                if path not in self._aliases.keys():
+                    continue
 
-                    self._add_linked_issues(self._aliases[f.path], c)
-                    self._add_change_metrics(self._aliases[f.path], fa, c)
-                    self._add_refactorings(c)
+                self._add_linked_issues(self._aliases[path], c)
+                self._add_change_metrics(self._aliases[path], fa, c, hunks[c.id])
 
-                if c.parents:
-                    prev = Commit.objects.get(vcs_system_id=self._vcs.id, revision_hash=c.parents[0])
-                    self._add_change_types(prev, c)
+            self._add_refactorings(refactorings.get(c.id, []))
 
-                self._add_dambros_metrics(c)
+            if c.parents and c.parents[0] in self._graph:
+                prev_id = self._graph.object_id_of(self._graph.id_of(c.parents[0]))
+                self._add_change_types(commit_changes.get((prev_id, c.id), {}))
 
-        for file in self._change_metrics.keys():
+            self._add_dambros_metrics(c)
+
+        ret = {}
+        for file, metrics in self._change_metrics.items():
             fo = self._first_occurences[file]
             td = self._release_date - fo
-            self._change_metrics[file]['age'] = td.days
-            self._change_metrics[file]['first_occurence'] = fo
+            metrics['age'] = td.days
+            metrics['first_occurence'] = fo
 
-        return self._change_metrics
+            # change type vectors are kept internally and returned as change type -> count
+            ret[file] = dict(metrics)
+            ret[file]['change_types'] = [dict(zip(CHANGE_TYPES, v.tolist())) for v in metrics['change_types']]
 
-    def _heuristic_renames(self, commit):
-        """Return most probable rename from all FileActions, rest count as DEL/NEW.
-
-        There may be multiple renames of the same file in the same commit, e.g., A->B, A->C.
-        This is due to pygit2 and the Git heuristic for rename detection.
-        This function uses another heuristic to detect renames by employing a string distance metric on the file name.
-        This captures things like commons-math renames org.apache.math -> org.apache.math3.
-        """
-        renames = {}
-        for fa in FileAction.objects.filter(commit_id=commit.id, mode='R'):
-            new_file = File.objects.get(id=fa.file_id)
-            old_file = File.objects.get(id=fa.old_file_id)
-
-            if old_file.path not in renames.keys():
-                renames[old_file.path] = []
-            renames[old_file.path].append(new_file.path)
-
-        true_renames = []
-        added_files = []
-        for old_file, new_files in renames.items():
-
-            # only one file, easy
-            if len(new_files) == 1:
-                true_renames.append((old_file, new_files[0]))
-                continue
+        return ret
 
-            # multiple files, find the best matching
-            min_dist = float('inf')
-            probable_file = None
-            for new_file in new_files:
-                d = distance(old_file, new_file)
-                if d < min_dist:
-                    min_dist = d
-                    probable_file = new_file
-            true_renames.append((old_file, probable_file))
-
-            for new_file in new_files:
-                if new_file == probable_file:
-                    continue
-                added_files.append(new_file)
-        return true_renames, added_files
+    def _renames(self, revision_hash):
+        """Return (true_renames, false_renames) of the commit from the rename index."""
+        return self._lineage.renames(self._graph.object_id_of(self._graph.id_of(revision_hash)))
 
     def _first_occured_fallback(self, vcs, file_name):
 
         needle = file_name
 
-        for c in Commit.objects.filter(vcs_system_id=vcs.id).order_by('-committer_date', '-author_date').only('id', 'revision_hash', 'parents', 'committer_date'):
+        # every commit with a path to the release, merge commits are allowd in fallback mode
+        for i in self._release_history():
+            commit_id = self._graph.object_id_of(i)
+            committer_date = self._graph.committer_dates[i].astype(object)
 
-            if not nx.has_path(self._graph, c.revision_hash, self._target_release_hash):
-                continue
-
-            # merge commits are allowd in fallback mode
-            # if len(c.parents) > 1:
-            #    continue
+            if needle in self._lineage.additions(commit_id):
+                return committer_date
 
-            for fa in FileAction.objects.filter(commit_id=c.id, mode__in=['A', 'C']):
-                f = File.objects.get(id=fa.file_id)
-                if f.path == needle:
-                    return c.committer_date
-
-            true_renames, false_renames = self._heuristic_renames(c)
+            true_renames, false_renames = self._lineage.renames(commit_id)
             for old_file, new_file in true_renames:
                 if needle == new_file:
                     needle = old_file
 
             for new_file in false_renames:
                 if new_file == needle:
-                    return c.committer_date
+                    return committer_date
 
-    def first_occured(self, vcs, paths, release_files):
-        """Traverse all FileActions of all paths to find when which file was added.
+    def first_occured(self, vcs, release_files):
+        """Traverse all FileActions of all commits with a path to the release to find when which file was added.
 
         Follows subsequent renames. We collect aliases for files because we need to know
         which names point to a file contained in the release.
@@ -678,16 +778,17 @@ class Volg(object):
         for release_file in release_files:
             aliases[release_file] = release_file
 
-        for c in Commit.objects.filter(vcs_system_id=vcs.id).order_by('-committer_date', '-author_date').only('id', 'revision_hash', 'parents', 'committer_date'):
+        # every commit with a path to the release, newest first
+        for i in self._release_history():
 
-            revision_hash = c.revision_hash
-            if not nx.has_path(self._graph, c.revision_hash, self._target_release_hash):
+            if self._graph.attributes.parent_counts[i] > 1:
                 continue
 
-            if len(c.parents) > 1:
-                continue
+            revision_hash = self._graph.hash_of(i)
+            commit_id = self._graph.object_id_of(i)
+            parents = [self._graph.hash_of(p) for p in self._graph.predecessor_ids(i)]
 
-            true_renames, false_renames = self._heuristic_renames(c)
+            true_renames, false_renames = self._lineage.renames(commit_id)
 
             for old_file, new_file in true_renames:
                 if old_file in aliases.keys() and new_file in aliases.keys() and aliases[old_file] != aliases[new_file]:
@@ -705,25 +806,23 @@ class Volg(object):
                     aliases[old_file] = aliases[new_file]
 
                 # also record file name changes, currently only used by external dambros
-                if len(c.parents) == 1 and new_file in aliases.keys():
-                    file_name_changes[aliases[new_file]] = {c.parents[0]: old_file}
+                if self._graph.attributes.parent_counts[i] == 1 and parents and new_file in aliases.keys():
+                    file_name_changes[aliases[new_file]] = {parents[0]: old_file}
 
             # we collect additions from three sources:
-            # 1. additions via doublicate renames (false_renames, see _heuristic_renames)
+            # 1. additions via doublicate renames (false_renames, see mynbou.lineage.split_renames)
             # 2. real file addtions from git
             # 3. targets of copy operations
             added_files = []
             for new_file in false_renames:
                 added_files.append(new_file)
 
-            for fa in FileAction.objects.filter(commit_id=c.id, mode__in=['A', 'C']):
-                f = File.objects.get(id=fa.file_id)
-                added_files.append(f.path)
+            added_files += self._lineage.additions(commit_id)
 
             for new_file in added_files:
                 if new_file not in additions.keys():
                     additions[new_file] = []
-                additions[new_file].append(c.committer_date)
+                additions[new_file].append(self._graph.committer_dates[i].astype(object))
 
         ret = {}
         for file_name, add_dates in additions.items():
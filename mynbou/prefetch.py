@@ -0,0 +1,210 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the bulk loaders of mynbou.
+
+Instead of querying the database for every commit the loaders fetch the documents of many commits with a few chunked $in queries,
+restricted to the fields mynbou needs, and group them in memory by commit.
+"""
+
+from collections import namedtuple
+
+import numpy as np
+from bson.objectid import ObjectId
+
+from pycoshark.mongomodels import Commit, FileAction, Hunk, Refactoring, CodeEntityState, File, CommitChanges, Issue
+
+from mynbou.constants import QUERY_CHUNK_SIZE, CHANGE_TYPES, DAMBROS_METRICS
+
+ChangeCommitRow = namedtuple('ChangeCommitRow', ['id', 'revision_hash', 'parents', 'committer_date', 'author_id', 'message', 'linked_issue_ids'])
+FileActionRow = namedtuple('FileActionRow', ['id', 'file_id', 'old_file_id', 'mode', 'lines_added', 'lines_deleted'])
+IssueRow = namedtuple('IssueRow', ['id', 'external_id', 'priority', 'issue_type', 'issue_type_verified', 'status', 'resolution', 'created_at'])
+
+
+def chunks(values, size=QUERY_CHUNK_SIZE):
+    """Yield consecutive chunks of the list with at most size elements."""
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def prefetch_commits(commit_ids):
+    """Load the given commits restricted to the fields used by the change metrics.
+
+    :param list commit_ids: ObjectIds of the commits
+    :rtype: dict
+    :returns: commit id -> ChangeCommitRow
+    """
+    commits = {}
+    for chunk in chunks(list(commit_ids)):
+        for c in Commit.objects.filter(id__in=chunk).only('revision_hash', 'parents', 'committer_date', 'author_id', 'message', 'linked_issue_ids').timeout(False).as_pymongo():
+            commits[c['_id']] = ChangeCommitRow(c['_id'], c['revision_hash'], c.get('parents', []), c.get('committer_date'), c.get('author_id'), c.get('message'), c.get('linked_issue_ids') or [])
+    return commits
+
+
+def prefetch_file_actions(commit_ids):
+    """Load the FileActions of the given commits.
+
+    :param list commit_ids: ObjectIds of the commits
+    :rtype: dict
+    :returns: commit id -> list of FileActionRow in the order of the database, commits without FileActions are omitted
+    """
+    file_actions = {}
+    for chunk in chunks(list(commit_ids)):
+        for fa in FileAction.objects.filter(commit_id__in=chunk).only('commit_id', 'file_id', 'old_file_id', 'mode', 'lines_added', 'lines_deleted').timeout(False).as_pymongo():
+            row = FileActionRow(fa['_id'], fa['file_id'], fa.get('old_file_id'), fa.get('mode'), fa.get('lines_added'), fa.get('lines_deleted'))
+            file_actions.setdefault(fa['commit_id'], []).append(row)
+    return file_actions
+
+
+def hunk_counts(file_actions):
+    """Count the hunks of every commit.
+
+    The hunks are counted per FileAction by one $group aggregation (chunked over the FileAction ids), the counts are summed per commit
+    via the commit of each FileAction.
+
+    :param dict file_actions: commit id -> list of FileActionRow, see :any:`prefetch_file_actions`
+    :rtype: dict
+    :returns: commit id -> number of hunks, every commit of file_actions is contained
+    """
+    commit_of = {}
+    for commit_id, rows in file_actions.items():
+        for fa in rows:
+            commit_of[fa.id] = commit_id
+
+    counts = {commit_id: 0 for commit_id in file_actions.keys()}
+    for chunk in chunks(list(commit_of.keys())):
+        for row in Hunk.objects().aggregate(*[
+            {'$match': {'file_action_id': {'$in': chunk}}},
+            {'$group': {'_id': '$file_action_id', 'count': {'$sum': 1}}}
+        ]):
+            counts[commit_of[row['_id']]] += row['count']
+    return counts
+
+
+def prefetch_refactorings(commit_ids):
+    """Load the refactorings of the given commits together with the file of the code entity after the refactoring.
+
+    One aggregation (chunked over the commit ids) joins ce_state.ce_after to the CodeEntityState and its File.
+    Refactorings without ce_after or whose code entity state does not exist are omitted.
+
+    :param list commit_ids: ObjectIds of the commits
+    :rtype: dict
+    :returns: commit id -> list of (file path, refactoring type, long name of the code entity)
+    """
+    refactorings = {}
+    for chunk in chunks(list(commit_ids)):
+        for row in Refactoring.objects().aggregate(*[
+            {'$match': {'commit_id': {'$in': chunk}, 'ce_state.ce_after': {'$exists': True}}},
+            {'$lookup': {'from': CodeEntityState._get_collection_name(), 'localField': 'ce_state.ce_after', 'foreignField': '_id', 'as': 'ces'}},
+            {'$unwind': '$ces'},
+            {'$lookup': {'from': File._get_collection_name(), 'localField': 'ces.file_id', 'foreignField': '_id', 'as': 'file'}},
+            {'$unwind': '$file'},
+            {'$project': {'commit_id': 1, 'type': 1, 'long_name': '$ces.long_name', 'path': '$file.path'}}
+        ]):
+            refactorings.setdefault(row['commit_id'], []).append((row['path'], row['type'], row['long_name']))
+    return refactorings
+
+
+def change_type_vector(changes):
+    """Return the change type counts of one file as integer array ordered like CHANGE_TYPES."""
+    vector = np.zeros(len(CHANGE_TYPES), dtype=np.int64)
+    for ctype, cvalue in changes.items():
+        vector[CHANGE_TYPES.index(ctype.lower())] += cvalue
+    return vector
+
+
+def prefetch_commit_changes(commit_ids):
+    """Load the change type classification of the given commits.
+
+    The CommitChanges are fetched with one $in query on new_commit_id (chunked over the commit ids).
+
+    :param list commit_ids: ObjectIds of the (new) commits
+    :rtype: dict
+    :returns: (old commit id, new commit id) -> {file id: change type vector}, see :any:`change_type_vector`
+    """
+    commit_changes = {}
+    for chunk in chunks(list(commit_ids)):
+        for cc in CommitChanges.objects.filter(new_commit_id__in=chunk).only('old_commit_id', 'new_commit_id', 'classification').timeout(False).as_pymongo():
+            if not cc.get('classification'):
+                continue
+            commit_changes[(cc['old_commit_id'], cc['new_commit_id'])] = {ObjectId(file_id): change_type_vector(changes) for file_id, changes in cc['classification'].items()}
+    return commit_changes
+
+
+def class_metric_averages(code_entity_state_ids):
+    """Average the class metrics per file over the given code entity states, e.g., of one commit.
+
+    :param list code_entity_state_ids: ids of the CodeEntityStates of the commit
+    :rtype: dict
+    :returns: file id -> float array ordered like DAMBROS_METRICS, NaN if the metric is missing
+    """
+    classes = CodeEntityState.objects().aggregate(*[
+        {'$match': {'_id': {'$in': [ObjectId(cesid) for cesid in code_entity_state_ids]}, 'ce_type': 'class'}},
+        {'$group': {'_id': '$file_id',
+                    'wmc': {'$avg': '$metrics.WMC'},
+                    'dit': {'$avg': '$metrics.DIT'},
+                    'rfc': {'$avg': '$metrics.RFC'},
+                    'noc': {'$avg': '$metrics.NOC'},
+                    'cbo': {'$avg': '$metrics.CBO'},
+                    'lcom5': {'$avg': '$metrics.LCOM5'},
+                    'nii': {'$avg': '$metrics.NII'},
+                    'noi': {'$avg': '$metrics.NOI'},
+                    'tna': {'$avg': '$metrics.TNA'},
+                    'tnpa': {'$avg': '$metrics.TNPA'},
+                    'tloc': {'$avg': '$metrics.TLOC'},
+                    'tnm': {'$avg': '$metrics.TNM'},
+                    'tnlpm': {'$avg': '$metrics.TNLPM'},
+                    'tnla': {'$avg': '$metrics.TNLA'},
+                    'tnpm': {'$avg': '$metrics.TNPM'},
+                    'tnlm': {'$avg': '$metrics.TNLM'}
+                    }},
+        {'$addFields': {'tna-tnpa': {'$subtract': ['$tna', '$tnpa']},
+                        'tna-tnla': {'$subtract': ['$tna', '$tnla']},
+                        'tnm-tnpm': {'$subtract': ['$tnm', '$tnpm']},
+                        'tnm-tnlm': {'$subtract': ['$tnm', '$tnlm']}}}
+    ])
+
+    averages = {}
+    for cl in classes:
+        averages[cl['_id']] = np.array([np.nan if cl.get(m) is None else cl[m] for m in DAMBROS_METRICS], dtype=np.float64)
+    return averages
+
+
+class IssueCache(object):
+    """Issues by id, restricted to the fields used for linked issues and bug fix labelling.
+
+    Issues are loaded with one $in query (chunked) per call of :any:`load`, issues which are already cached are not loaded again.
+    """
+
+    FIELDS = ['external_id', 'priority', 'issue_type', 'issue_type_verified', 'status', 'resolution', 'created_at']
+
+    def __init__(self):
+        self._issues = {}
+
+    def __len__(self):
+        return len(self._issues)
+
+    def load(self, issue_ids):
+        """Load the issues which are not already cached, in the order of their ids so that the queries do not depend on the hash seed."""
+        missing = sorted(issue_id for issue_id in set(issue_ids) if issue_id not in self._issues)
+        for chunk in chunks(missing):
+            for i in Issue.objects.filter(id__in=chunk).only(*self.FIELDS).timeout(False).as_pymongo():
+                self._issues[i['_id']] = IssueRow(i['_id'], *[i.get(f) for f in self.FIELDS])
+
+    def get(self, issue_id):
+        """Return the issue, loading it if it is not cached.
+
+        :raises Issue.DoesNotExist: if there is no such issue
+        """
+        if issue_id not in self._issues:
+            self.load([issue_id])
+        try:
+            return self._issues[issue_id]
+        except KeyError:
+            raise Issue.DoesNotExist('Issue {} does not exist'.format(issue_id))
+
+    def issues(self, issue_ids):
+        """Return the cached issues of the given ids, ids without issue are skipped."""
+        self.load(issue_ids)
+        return [self._issues[issue_id] for issue_id in issue_ids if issue_id in self._issues]
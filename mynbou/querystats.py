@@ -0,0 +1,227 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the query accounting of mynbou.
+
+QueryStats is a pymongo command listener which records every command sent to the MongoDB.
+For each mining phase it counts queries, returned documents, wall time and optionally reply bytes per collection and per call site
+(the first frame of mynbou which issued the command). Queries slower than a threshold are logged and kept,
+their explain() plans are requested on demand with :any:`QueryStats.explain_slow_queries` after the mining so that the
+command callbacks never issue queries themselves.
+
+The listener has to be registered before the connection is created, e.g.::
+
+    from pymongo import monitoring
+    monitoring.register(QUERY_STATS)
+"""
+
+import os
+import sys
+import logging
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+import bson
+from pymongo import monitoring
+
+# commands which can be explained, getMore only continues a cursor of one of them
+EXPLAINABLE_COMMANDS = ['find', 'aggregate', 'count', 'distinct']
+
+# keys of a command which are added by the driver and are not allowed in an explain
+DRIVER_KEYS = ['lsid', 'txnNumber', '$db', '$clusterTime', '$readPreference', 'cursor', 'batchSize']
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_THIS_FILE = os.path.abspath(__file__)
+
+# command which took longer than the threshold, command is None if it can not be explained
+SlowQuery = namedtuple('SlowQuery', ['phase', 'collection', 'call_site', 'command_name', 'database_name', 'command', 'documents', 'seconds'])
+
+
+def _empty_counts():
+    return {'queries': 0, 'documents': 0, 'bytes': 0, 'seconds': 0.0}
+
+
+def _add_counts(counts, documents, size, seconds):
+    counts['queries'] += 1
+    counts['documents'] += documents
+    counts['bytes'] += size
+    counts['seconds'] += seconds
+
+
+class QueryStats(monitoring.CommandListener):
+    """Accounting of the MongoDB commands per phase, collection and call site.
+
+    The phase is kept per thread, the counters are shared.
+
+    :param float slow_query_seconds: queries which take longer are logged and kept for :any:`explain_slow_queries`, None disables the slow query log
+    :param bool count_bytes: count the BSON size of every reply, this encodes every reply a second time, otherwise bytes stay 0
+    """
+
+    def __init__(self, slow_query_seconds=None, count_bytes=False):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.slow_query_seconds = slow_query_seconds
+        self.count_bytes = count_bytes
+
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._pending = {}
+        self._is_mynbou_file = {}
+        self.reset()
+
+    def reset(self):
+        """Drop all recorded statistics and slow queries."""
+        with self._lock:
+            self._phases = {}
+            self._slow_queries = []
+
+    def current_phase(self):
+        """Return the phase of the calling thread, 'other' outside of any phase."""
+        return getattr(self._local, 'phase', 'other')
+
+    @contextmanager
+    def phase(self, name):
+        """Account every command issued by this thread within the context to the phase name."""
+        previous = self.current_phase()
+        self._local.phase = name
+        try:
+            yield
+        finally:
+            self._local.phase = previous
+
+    def _call_site(self):
+        """Return the innermost frame of mynbou (outside this module) as file:function:line."""
+        frame = sys._getframe(1)
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            mynbou_file = self._is_mynbou_file.get(filename)
+            if mynbou_file is None:
+                path = os.path.abspath(filename)
+                mynbou_file = path.startswith(_PACKAGE_DIR) and path != _THIS_FILE
+                self._is_mynbou_file[filename] = mynbou_file
+            if mynbou_file:
+                return '{}:{}:{}'.format(os.path.relpath(os.path.abspath(filename), os.path.dirname(_PACKAGE_DIR)), frame.f_code.co_name, frame.f_lineno)
+            frame = frame.f_back
+        return 'unknown'
+
+    def _collection(self, event):
+        if event.command_name == 'getMore':
+            return event.command.get('collection', 'unknown')
+        value = event.command.get(event.command_name)
+        return value if isinstance(value, str) else 'unknown'
+
+    def started(self, event):
+        # commands issued by the explain of a slow query are not accounted
+        if getattr(self._local, 'explaining', False):
+            return
+
+        command = None
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            command = dict(event.command)
+
+        pending = (self.current_phase(), self._collection(event), self._call_site(), event.database_name, command)
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = pending
+
+    def succeeded(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+
+        reply = event.reply or {}
+        documents = 0
+        cursor = reply.get('cursor')
+        if isinstance(cursor, dict):
+            documents = len(cursor.get('firstBatch', cursor.get('nextBatch', [])))
+        elif 'values' in reply:
+            documents = len(reply['values'])
+
+        size = len(bson.BSON.encode(reply)) if self.count_bytes and reply else 0
+        self._record(pending, event.command_name, documents, size, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        if pending is None:
+            return
+        self._record(pending, event.command_name, 0, 0, event.duration_micros / 1e6)
+
+    def _record(self, pending, command_name, documents, size, seconds):
+        phase, collection, call_site, database_name, command = pending
+        with self._lock:
+            stats = self._phases.setdefault(phase, {'total': _empty_counts(), 'collections': {}, 'call_sites': {}})
+            _add_counts(stats['total'], documents, size, seconds)
+            _add_counts(stats['collections'].setdefault(collection, _empty_counts()), documents, size, seconds)
+            _add_counts(stats['call_sites'].setdefault(call_site, _empty_counts()), documents, size, seconds)
+
+            slow = self.slow_query_seconds is not None and seconds > self.slow_query_seconds
+            if slow:
+                self._slow_queries.append(SlowQuery(phase, collection, call_site, command_name, database_name, command, documents, seconds))
+
+        if slow:
+            self._log.warning('slow query ({:.3f}s, {} documents) {} on {} in phase {} from {}'.format(seconds, documents, command_name, collection, phase, call_site))
+
+    def slow_queries(self):
+        """Return the recorded slow queries.
+
+        :rtype: list
+        :returns: SlowQuery in the order they finished
+        """
+        with self._lock:
+            return list(self._slow_queries)
+
+    def explain_slow_queries(self, client):
+        """Request the explain() plan of every recorded slow query which can be explained and log it.
+
+        This is meant to be called after the mining, the commands of the explain itself are not accounted.
+
+        :param client: pymongo MongoClient the queries were sent with, e.g., mongoengine.connection.get_connection()
+        :rtype: list
+        :returns: (SlowQuery, query planner output or error message) for every explained query
+        """
+        explained = []
+        for query in self.slow_queries():
+            if query.command is None:
+                continue
+            plan = self._explain(client, query.database_name, query.command)
+            self._log.warning('explain of {} on {} from {}: {}'.format(query.command_name, query.collection, query.call_site, plan))
+            explained.append((query, plan))
+        return explained
+
+    def _explain(self, client, database_name, command):
+        """Return the query planner output for the command."""
+        explain_command = {k: v for k, v in command.items() if k not in DRIVER_KEYS}
+        if command.get('cursor') is not None and 'aggregate' in command:
+            explain_command['cursor'] = {}
+        self._local.explaining = True
+        try:
+            plan = client[database_name].command('explain', explain_command, verbosity='queryPlanner')
+            return plan.get('queryPlanner', plan)
+        except Exception as e:
+            return 'explain failed: {}'.format(e)
+        finally:
+            self._local.explaining = False
+
+    def summary(self):
+        """Return the recorded statistics.
+
+        :rtype: dict
+        :returns: {'total': counts, 'slow_queries': int, 'count_bytes': bool, 'phases': {phase: {'total': counts, 'collections': {name: counts}, 'call_sites': {site: counts}}}}
+            where counts are dicts of queries, documents, bytes and seconds, bytes are only counted with count_bytes
+        """
+        with self._lock:
+            total = _empty_counts()
+            phases = {}
+            for phase, stats in self._phases.items():
+                for k in total.keys():
+                    total[k] += stats['total'][k]
+                phases[phase] = {'total': dict(stats['total']),
+                                 'collections': {k: dict(v) for k, v in stats['collections'].items()},
+                                 'call_sites': {k: dict(v) for k, v in stats['call_sites'].items()}}
+            return {'total': total, 'slow_queries': len(self._slow_queries), 'count_bytes': self.count_bytes, 'phases': phases}
+
+
+# the query accounting of this process
+QUERY_STATS = QueryStats()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the process-wide file resolver of mynbou.
+
+FileResolver maps the ids of the files of one VCS to their paths and paths back to ids.
+The mapping is loaded with one projected cursor per VCS and shared by every user in the process via :any:`FileResolver.for_vcs`.
+:any:`FileResolver.reset` drops shared resolvers, e.g., :any:`Mynbou` starts every run with a fresh resolver of its VCS.
+"""
+
+import logging
+
+from pycoshark.mongomodels import File
+
+
+class FileResolver(object):
+    """File id -> path mapping of one VCS with reverse lookup path -> ids.
+
+    Files inserted after the mapping was loaded are fetched on the first lookup of an unknown id.
+    """
+
+    _resolvers = {}
+
+    def __init__(self, vcs_system_id):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.vcs_system_id = vcs_system_id
+
+        self._paths = {}
+        self._ids = None
+        self._newest = None
+        self._load()
+
+    @classmethod
+    def for_vcs(cls, vcs_system_id):
+        """Return the shared resolver of the VCS, it is created on first use."""
+        if vcs_system_id not in cls._resolvers:
+            cls._resolvers[vcs_system_id] = cls(vcs_system_id)
+        return cls._resolvers[vcs_system_id]
+
+    @classmethod
+    def reset(cls, vcs_system_id=None):
+        """Drop the shared resolver of the VCS or every shared resolver, they are reloaded on the next use.
+
+        :param ObjectId vcs_system_id: id of the VCS, None drops the resolvers of all VCS
+        """
+        if vcs_system_id is None:
+            cls._resolvers = {}
+        else:
+            cls._resolvers.pop(vcs_system_id, None)
+
+    def _load(self):
+        """Load every file of the VCS that is newer than the newest already known file."""
+        query = {'vcs_system_id': self.vcs_system_id}
+        if self._newest is not None:
+            query['id__gt'] = self._newest
+
+        count = 0
+        for f in File.objects.filter(**query).only('path').order_by('id').timeout(False).as_pymongo():
+            self._paths[f['_id']] = f['path']
+            if self._ids is not None:
+                self._ids.setdefault(f['path'], []).append(f['_id'])
+            self._newest = f['_id']
+            count += 1
+        self._log.debug('loaded {} files of vcs {}'.format(count, self.vcs_system_id))
+        return count
+
+    def __len__(self):
+        return len(self._paths)
+
+    def __contains__(self, file_id):
+        return file_id in self._paths
+
+    def path(self, file_id):
+        """Return the path of the file.
+
+        :param ObjectId file_id: id of the file
+        :raises File.DoesNotExist: if the VCS has no such file
+        """
+        if file_id not in self._paths:
+            self._load()
+        try:
+            return self._paths[file_id]
+        except KeyError:
+            raise File.DoesNotExist('File {} does not exist in vcs {}'.format(file_id, self.vcs_system_id))
+
+    def ids(self, path):
+        """Return the ids of all files of the VCS with the given path (a path may be contained more than once)."""
+        if self._ids is None:
+            self._ids = {}
+            for file_id, p in self._paths.items():
+                self._ids.setdefault(p, []).append(file_id)
+        return list(self._ids.get(path, []))
+
+    def id(self, path):
+        """Return the id of the only file with the given path.
+
+        :raises File.DoesNotExist: if there is no such file
+        :raises File.MultipleObjectsReturned: if there is more than one file with the path
+        """
+        ids = self.ids(path)
+        if not ids:
+            self._load()
+            ids = self.ids(path)
+        if not ids:
+            raise File.DoesNotExist('File {} does not exist in vcs {}'.format(path, self.vcs_system_id))
+        if len(ids) > 1:
+            raise File.MultipleObjectsReturned('{} files with path {} in vcs {}'.format(len(ids), path, self.vcs_system_id))
+        return ids[0]
@@ -0,0 +1,333 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module contains the offline snapshot of mynbou.
+
+A snapshot contains the documents of one VCS which mynbou reads for a set of releases, restricted to the fields it reads (see SNAPSHOT_SCHEMA).
+Code entity states are only exported for the release commits and the commits of their change windows, the only commits mynbou reads them from.
+Every collection is stored as a directory of columns, ids and dates as fixed width arrays and every other field as
+zlib compressed BSON values with an offset array. Every id column has an index of its sorted values and their rows.
+All columns are .npy files which are memory-mapped on load, only the pages of the rows which are read are loaded.
+
+The snapshot is exported from the MongoDB with :any:`Snapshot.export` and served by :any:`Snapshot.connect` which creates
+an in-process mongomock database (pip install mynbou[snapshot]) under the default mongoengine connection,
+so that Mynbou and Volg run unchanged without a MongoDB. The collections of this database are read directly from the
+columns, see :any:`snapshotdb`, queries on ids are answered from the index of the id column.
+benchmarks/snapshot_cost.py compares mining from a snapshot with mining from the live MongoDB.
+"""
+
+import os
+import json
+import zlib
+import logging
+
+import bson
+import numpy as np
+import mongoengine
+from bson.objectid import ObjectId
+
+from dateutil.relativedelta import relativedelta
+
+from pycoshark.mongomodels import Project, VCSSystem, Commit, File, FileAction, Hunk, CodeEntityState, CodeGroupState, Refactoring, CommitChanges, Issue, Event
+
+from mynbou.prefetch import chunks, IssueCache
+from mynbou.graph import CommitGraph, fetch_commits, empty_arrays, append_commits
+
+# columns of an ObjectId or a date, every other field is stored as compressed BSON
+OBJECT_ID = 'objectid'
+DATETIME = 'datetime'
+BSON = 'bson'
+
+# absent values of the fixed width columns
+NO_OBJECT_ID = b'\x00' * 12
+NO_DATETIME = np.datetime64('NaT', 'ms')
+
+# collection -> (model, fields with their column type), in export order
+# fields of unique indexes (e.g. s_key) are kept so that mongoengine can create its indexes on the served snapshot
+SNAPSHOT_SCHEMA = [
+    ('project', Project, {'_id': OBJECT_ID, 'name': BSON}),
+    ('vcs_system', VCSSystem, {'_id': OBJECT_ID, 'project_id': OBJECT_ID, 'url': BSON, 'repository_type': BSON}),
+    ('commit', Commit, {'_id': OBJECT_ID, 'vcs_system_id': OBJECT_ID, 'revision_hash': BSON, 'parents': BSON, 'committer_date': DATETIME, 'author_date': DATETIME,
+                        'author_id': OBJECT_ID, 'labels': BSON, 'message': BSON, 'code_entity_states': BSON,
+                        'linked_issue_ids': BSON, 'fixed_issue_ids': BSON, 'szz_issue_ids': BSON}),
+    ('file', File, {'_id': OBJECT_ID, 'vcs_system_id': OBJECT_ID, 'path': BSON}),
+    ('file_action', FileAction, {'_id': OBJECT_ID, 'commit_id': OBJECT_ID, 'file_id': OBJECT_ID, 'old_file_id': OBJECT_ID, 'mode': BSON,
+                                 'lines_added': BSON, 'lines_deleted': BSON, 'induces': BSON}),
+    ('hunk', Hunk, {'_id': OBJECT_ID, 'file_action_id': OBJECT_ID}),
+    ('code_entity_state', CodeEntityState, {'_id': OBJECT_ID, 'commit_id': OBJECT_ID, 'file_id': OBJECT_ID, 's_key': BSON, 'ce_type': BSON, 'long_name': BSON,
+                                            'metrics': BSON, 'imports': BSON, 'linter': BSON}),
+    ('code_group_state', CodeGroupState, {'_id': OBJECT_ID, 'commit_id': OBJECT_ID, 's_key': BSON, 'cg_type': BSON, 'long_name': BSON, 'metrics': BSON}),
+    ('refactoring', Refactoring, {'_id': OBJECT_ID, 'commit_id': OBJECT_ID, 'type': BSON, 'ce_state': BSON}),
+    ('commit_changes', CommitChanges, {'_id': OBJECT_ID, 'old_commit_id': OBJECT_ID, 'new_commit_id': OBJECT_ID, 'classification': BSON}),
+    ('issue', Issue, {'_id': OBJECT_ID, 'issue_system_id': OBJECT_ID, **{field: BSON for field in IssueCache.FIELDS}}),
+    # status changes decide if an issue was fixed when its resolution and status do not, see pycoshark.utils.jira_is_resolved_and_fixed
+    ('event', Event, {'_id': OBJECT_ID, 'issue_id': OBJECT_ID, 'external_id': BSON, 'status': BSON, 'new_value': BSON, 'created_at': DATETIME}),
+]
+
+
+class ColumnWriter(object):
+    """Collects the documents of one collection column by column.
+
+    :param dict fields: field -> column type
+    """
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.count = 0
+        self._values = {field: [] for field, kind in fields.items() if kind != BSON}
+        self._blobs = {field: bytearray() for field, kind in fields.items() if kind == BSON}
+        self._offsets = {field: [0] for field, kind in fields.items() if kind == BSON}
+
+    def append(self, document):
+        """Append one document, missing fields are stored as absent."""
+        for field, kind in self.fields.items():
+            value = document.get(field)
+            if kind == OBJECT_ID:
+                self._values[field].append(NO_OBJECT_ID if value is None else value.binary)
+            elif kind == DATETIME:
+                self._values[field].append(NO_DATETIME if value is None else np.datetime64(value, 'ms'))
+            else:
+                # an empty row marks an absent value
+                if field in document:
+                    self._blobs[field] += zlib.compress(bson.BSON.encode({'v': value}))
+                self._offsets[field].append(len(self._blobs[field]))
+        self.count += 1
+
+    def save(self, path):
+        """Write the columns and the metadata of the collection to the directory path."""
+        os.makedirs(path, exist_ok=True)
+        for field, kind in self.fields.items():
+            if kind == OBJECT_ID:
+                column = np.frombuffer(b''.join(self._values[field]), dtype='V12')
+
+                # index of the column: the sorted values and the row of each value
+                order = np.argsort(column.view('S12'), kind='stable').astype(np.int64)
+                np.save(os.path.join(path, '{}.order.npy'.format(field)), order)
+                np.save(os.path.join(path, '{}.sorted.npy'.format(field)), column.view('S12')[order])
+            elif kind == DATETIME:
+                column = np.array(self._values[field], dtype='datetime64[ms]')
+            else:
+                column = np.frombuffer(bytes(self._blobs[field]), dtype=np.uint8)
+                np.save(os.path.join(path, '{}.offsets.npy'.format(field)), np.array(self._offsets[field], dtype=np.int64))
+            np.save(os.path.join(path, '{}.npy'.format(field)), column)
+
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump({'count': self.count, 'fields': self.fields}, f)
+
+
+class ColumnReader(object):
+    """Memory-mapped columns of one collection written by :any:`ColumnWriter`."""
+
+    def __init__(self, path):
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        self.count = meta['count']
+        self.fields = meta['fields']
+
+        self._columns = {}
+        self._offsets = {}
+        self._order = {}
+        self._sorted = {}
+        for field, kind in self.fields.items():
+            self._columns[field] = np.load(os.path.join(path, '{}.npy'.format(field)), mmap_mode='r')
+            if kind == BSON:
+                self._offsets[field] = np.load(os.path.join(path, '{}.offsets.npy'.format(field)), mmap_mode='r')
+            elif kind == OBJECT_ID:
+                self._order[field] = np.load(os.path.join(path, '{}.order.npy'.format(field)), mmap_mode='r')
+                self._sorted[field] = np.load(os.path.join(path, '{}.sorted.npy'.format(field)), mmap_mode='r')
+
+    def __len__(self):
+        return self.count
+
+    def value(self, field, i):
+        """Return the value of the field in row i, None if it is absent."""
+        kind = self.fields[field]
+        column = self._columns[field]
+        if kind == OBJECT_ID:
+            data = column[i].tobytes()
+            return None if data == NO_OBJECT_ID else ObjectId(data)
+        if kind == DATETIME:
+            return None if np.isnat(column[i]) else column[i].astype(object)
+
+        start, end = self._offsets[field][i], self._offsets[field][i + 1]
+        return bson.BSON(zlib.decompress(column[start:end].tobytes())).decode()['v'] if end > start else None
+
+    def document(self, i):
+        """Return the document in row i, absent fields are left out."""
+        document = {}
+        for field in self.fields.keys():
+            value = self.value(field, i)
+            if value is not None:
+                document[field] = value
+        return document
+
+    def is_indexed(self, field):
+        """Return True if rows can be looked up by values of the field, see :any:`rows`."""
+        return field in self._order
+
+    def rows(self, field, values):
+        """Return the rows whose field has one of the ObjectIds, looked up in the index of the column.
+
+        :rtype: numpy.ndarray
+        :returns: the rows in ascending order
+        """
+        keys = np.array([v.binary for v in values], dtype='S12')
+        start = np.searchsorted(self._sorted[field], keys, side='left')
+        end = np.searchsorted(self._sorted[field], keys, side='right')
+        order = self._order[field]
+        return np.unique(np.concatenate([order[s:e] for s, e in zip(start, end)] + [np.empty(0, dtype=np.int64)]))
+
+    def column(self, field):
+        """Return the values of the field, absent values are None.
+
+        :rtype: list
+        """
+        kind = self.fields[field]
+        column = self._columns[field]
+        if kind == OBJECT_ID:
+            data = column.tobytes()
+            return [None if data[i:i + 12] == NO_OBJECT_ID else ObjectId(data[i:i + 12]) for i in range(0, 12 * self.count, 12)]
+        if kind == DATETIME:
+            return [None if np.isnat(value) else value.astype(object) for value in column]
+
+        offsets = self._offsets[field]
+        values = []
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            values.append(bson.BSON(zlib.decompress(column[start:end].tobytes())).decode()['v'] if end > start else None)
+        return values
+
+    def documents(self):
+        """Yield the documents of the collection in row order, absent fields are left out."""
+        for i in range(self.count):
+            yield self.document(i)
+
+
+class Snapshot(object):
+    """Offline snapshot of one VCS.
+
+    :param str path: directory of the snapshot
+    """
+
+    VERSION = 3
+
+    def __init__(self, path):
+        self._log = logging.getLogger(self.__class__.__name__)
+        self.path = path
+
+    def _meta_file(self):
+        return os.path.join(self.path, 'meta.json')
+
+    def meta(self):
+        """Return the metadata of the snapshot (version, vcs_system_id, release_hashes and the number of documents per collection).
+
+        :rtype: dict
+        """
+        with open(self._meta_file(), 'r') as f:
+            meta = json.load(f)
+        if meta.get('version') != self.VERSION:
+            raise Exception('Snapshot {} has version {}, expected {}'.format(self.path, meta.get('version'), self.VERSION))
+        return meta
+
+    def collection(self, name):
+        """Return the columns of the collection.
+
+        :rtype: ColumnReader
+        """
+        return ColumnReader(os.path.join(self.path, name))
+
+    def export(self, vcs, release_hashes):
+        """Export the documents of the VCS which mynbou reads for the releases from the current database connection.
+
+        Commits and files are selected by the VCS, every other collection by the ids referenced from them.
+        The code entity states of a commit are only kept for the releases and the commits of their change windows
+        (see :any:`CommitGraph.history_window`) which are the only ones read by the release and D'Ambros metrics.
+
+        :param VCSSystem vcs: the VCS to export
+        :param list release_hashes: revision hashes of the releases which are mined from the snapshot
+        """
+        schema = {name: (model, fields) for name, model, fields in SNAPSHOT_SCHEMA}
+        writers = {name: ColumnWriter(fields) for name, model, fields in SNAPSHOT_SCHEMA}
+
+        def select(name, prepare=None, **query):
+            model, fields = schema[name]
+            for document in model.objects.filter(**query).only(*[f for f in fields.keys() if f != '_id']).order_by('id').timeout(False).as_pymongo():
+                if prepare is not None:
+                    prepare(document)
+                writers[name].append(document)
+                yield document
+
+        arrays, _ = append_commits(empty_arrays(), list(fetch_commits(vcs.id)))
+        graph = CommitGraph.from_arrays(arrays)
+        windows = set()
+        for release_hash in release_hashes:
+            if release_hash not in graph:
+                raise Exception('Release {} is not a commit of VCS {}'.format(release_hash, vcs.id))
+            windows.update(graph.history_window(release_hash, graph.committer_date(release_hash) - relativedelta(months=6)))
+
+        def drop_code_entity_states(commit):
+            if commit['revision_hash'] not in windows:
+                commit.pop('code_entity_states', None)
+
+        list(select('project', id=vcs.project_id))
+        list(select('vcs_system', id=vcs.id))
+        list(select('file', vcs_system_id=vcs.id))
+
+        commit_ids = []
+        ces_ids = set()
+        issue_ids = set()
+        for c in select('commit', drop_code_entity_states, vcs_system_id=vcs.id):
+            commit_ids.append(c['_id'])
+            ces_ids.update(c.get('code_entity_states', []))
+            for field in ['linked_issue_ids', 'fixed_issue_ids', 'szz_issue_ids']:
+                issue_ids.update(c.get(field) or [])
+
+        file_action_ids = []
+        for chunk in chunks(commit_ids):
+            file_action_ids.extend(fa['_id'] for fa in select('file_action', commit_id__in=chunk))
+            list(select('code_group_state', commit_id__in=chunk))
+            list(select('refactoring', commit_id__in=chunk))
+            list(select('commit_changes', new_commit_id__in=chunk))
+
+        for chunk in chunks(file_action_ids):
+            list(select('hunk', file_action_id__in=chunk))
+        for chunk in chunks(sorted(ces_ids)):
+            list(select('code_entity_state', id__in=chunk))
+        for chunk in chunks(sorted(issue_ids)):
+            list(select('issue', id__in=chunk))
+            list(select('event', issue_id__in=chunk))
+
+        for name, writer in writers.items():
+            self._log.info('writing {} {} documents'.format(writer.count, name))
+            writer.save(os.path.join(self.path, name))
+
+        # the metadata is written last, it marks the snapshot as complete
+        meta = {'version': self.VERSION, 'vcs_system_id': str(vcs.id), 'release_hashes': list(release_hashes), 'collections': {name: writer.count for name, writer in writers.items()}}
+        with open(self._meta_file(), 'w') as f:
+            json.dump(meta, f)
+
+    def connect(self, db_name='mynbou_snapshot', release_hash=None):
+        """Serve the snapshot from an in-process mongomock database registered as default mongoengine connection.
+
+        The collections are read from the memory-mapped columns, queries on ids use their index, see :any:`snapshotdb`.
+
+        :param str db_name: name of the in-memory database
+        :param str release_hash: release which is mined, it has to be one of the releases the snapshot was exported for
+        """
+        try:
+            import mongomock
+        except ImportError:
+            raise Exception('Serving the snapshot {} requires mongomock, install it with pip install mynbou[snapshot]'.format(self.path))
+        from mynbou.snapshotdb import serve
+
+        meta = self.meta()
+        if release_hash is not None and release_hash not in meta['release_hashes']:
+            raise Exception('Snapshot {} was not exported for release {}, only for {}'.format(self.path, release_hash, ', '.join(meta['release_hashes'])))
+
+        mongoengine.connection.disconnect()
+        mongoengine.connect(db_name, host='mongomock://localhost')
+        db = mongoengine.connection.get_db()
+
+        for name, model, fields in SNAPSHOT_SCHEMA:
+            collection = serve(db, model._get_collection_name(), self.collection(name))
+            self._log.info('serving {} {} documents from the snapshot of VCS {}'.format(collection.estimated_document_count(), name, meta['vcs_system_id']))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+This module serves the collections of a snapshot through mongomock.
+
+SnapshotStore replaces the in-memory documents of a mongomock collection with the memory-mapped columns of a :any:`ColumnReader`,
+documents are decoded when they are read and never held. SnapshotCollection answers queries on ObjectId fields
+(e.g. _id, commit_id or file_action_id with a value or $in) from the index of the column, only the matching rows are decoded
+and checked against the rest of the filter by mongomock. Other queries scan the collection.
+Aggregations starting with $match only pass the matching documents to the pipeline.
+The snapshot is read-only, every write fails.
+"""
+
+import mongomock
+from mongomock import aggregate
+from mongomock.filtering import filter_applies
+from mongomock.store import CollectionStore
+from bson.objectid import ObjectId
+
+
+class SnapshotStore(CollectionStore):
+    """Read-only mongomock collection store backed by the columns of one collection of a snapshot.
+
+    :param str name: name of the collection
+    :param ColumnReader reader: columns of the collection
+    """
+
+    def __init__(self, name, reader):
+        super().__init__(name)
+        self.reader = reader
+
+    @property
+    def is_created(self):
+        return True
+
+    @property
+    def is_empty(self):
+        return len(self.reader) == 0
+
+    def __len__(self):
+        return len(self.reader)
+
+    def _row(self, key):
+        rows = self.reader.rows('_id', [key]) if isinstance(key, ObjectId) else []
+        return rows[0] if len(rows) else None
+
+    def __contains__(self, key):
+        return self._row(key) is not None
+
+    def __getitem__(self, key):
+        row = self._row(key)
+        if row is None:
+            raise KeyError(key)
+        return self.reader.document(row)
+
+    def __setitem__(self, key, val):
+        raise Exception('The snapshot collection {} is read-only'.format(self.name))
+
+    def __delitem__(self, key):
+        raise Exception('The snapshot collection {} is read-only'.format(self.name))
+
+    def drop(self):
+        raise Exception('The snapshot collection {} is read-only'.format(self.name))
+
+    @property
+    def documents(self):
+        for i in range(len(self.reader)):
+            yield self.reader.document(i)
+
+    def _remove_expired_documents(self):
+        pass
+
+    def candidate_rows(self, filter):
+        """Return the rows which may match the filter or None if the whole collection has to be scanned.
+
+        Top level conditions on indexed fields with an ObjectId or $in a list of ObjectIds are looked up in the index,
+        the one with the least rows is used.
+
+        :rtype: numpy.ndarray
+        """
+        if not isinstance(filter, dict):
+            return None
+
+        best = None
+        for field, condition in filter.items():
+            if not self.reader.is_indexed(field):
+                continue
+            if isinstance(condition, ObjectId):
+                values = [condition]
+            elif isinstance(condition, dict) and list(condition.keys()) == ['$in'] and all(isinstance(v, ObjectId) for v in condition['$in']):
+                values = condition['$in']
+            else:
+                continue
+
+            rows = self.reader.rows(field, values)
+            if best is None or len(rows) < len(best):
+                best = rows
+        return best
+
+
+class SnapshotCollection(mongomock.Collection):
+    """mongomock collection which uses the indexes of its :any:`SnapshotStore`."""
+
+    def _iter_documents(self, filter):
+        store = self._store
+        rows = store.candidate_rows(filter) if isinstance(store, SnapshotStore) else None
+        if rows is None:
+            return super()._iter_documents(filter)
+        return (document for document in (store.reader.document(i) for i in rows) if filter_applies(filter, document))
+
+    def create_index(self, key_or_list, cache_for=300, session=None, **kwargs):
+        # the snapshot was exported from a database which enforces its unique indexes, checking them would decode every document
+        kwargs.pop('unique', None)
+        return super().create_index(key_or_list, cache_for, session=session, **kwargs)
+
+    def aggregate(self, pipeline, session=None, **kwargs):
+        if not pipeline or list(pipeline[0].keys()) != ['$match']:
+            return super().aggregate(pipeline, session=session, **kwargs)
+        return aggregate.process_pipeline(list(self.find(pipeline[0]['$match'])), self.database, pipeline[1:], session)
+
+    def with_options(self, codec_options=None, read_preference=None, write_concern=None, read_concern=None):
+        collection = super().with_options(codec_options=codec_options, read_preference=read_preference, write_concern=write_concern, read_concern=read_concern)
+        if collection is self:
+            return self
+        return SnapshotCollection(self.database, self.name, _db_store=self._db_store, write_concern=collection.write_concern, read_concern=collection.read_concern,
+                                  read_preference=collection.read_preference, codec_options=collection.codec_options)
+
+
+def serve(db, name, reader):
+    """Serve the columns as the collection name of the mongomock database db, replacing the collection.
+
+    :param mongomock.Database db: database, e.g., of the default mongoengine connection
+    :param str name: name of the collection
+    :param ColumnReader reader: columns of the collection
+    :rtype: SnapshotCollection
+    """
+    db._store._collections[name] = SnapshotStore(name, reader)
+    collection = db._collection_accesses[name] = SnapshotCollection(db, name, _db_store=db._store)
+    return collection
@@ -17,8 +17,13 @@ from pycoshark.utils import create_mongodb_uri_string
 from pycoshark.utils import get_base_argparser
 
 from mongoengine import connect
+from mongoengine.connection import get_connection
+from pymongo import monitoring
 
 from mynbou.core import Mynbou
+from mynbou.querystats import QUERY_STATS
+from mynbou.snapshot import Snapshot
+from mynbou.mongotrace import TraceRecorder, ReplayServer
 from mynbou.constants import *
 from mynbou import aggregation
 
@@ -318,14 +323,26 @@ class SmartsharkPlugin(object):
 
         return harmonized_instances, bug_fixes, keys
 
+    def export_snapshot(self, path):
+        start = timeit.default_timer()
+
+        project_id = Project.objects.get(name=self.args.project_name).id
+        vcs = VCSSystem.objects.get(project_id=project_id)
+        Snapshot(path).export(vcs, [self.args.release_commit])
+
+        end = timeit.default_timer() - start
+        log.info("Exported snapshot to {} in {:.5f}s".format(path, end))
+
     def start_mining(self, release):
         start = timeit.default_timer()
 
         project_id = Project.objects.get(name=self.args.project_name).id
         self.vcs = VCSSystem.objects.get(project_id=project_id)
 
-        m = Mynbou(self.vcs, self.args.project_name, release)
+        m = Mynbou(self.vcs, self.args.project_name, release, cache_dir=self.args.cache_dir, traversal=self.args.traversal)
         instances, release_information = m.release(self.args.type)
+        log.info('path statistics: {}'.format(release_information['path_statistics']))
+        log.info('query statistics: {}'.format(release_information['query_statistics']['total']))
 
         base_file_name = self.release_name
         if self.args.type != 'False':
@@ -349,8 +366,9 @@ class SmartsharkPlugin(object):
         # harmonize instances and get keys from harmonization, they are later used to provide a header for the csv file
         harmonized_instances, bug_fixes, keys = self._harmonize_instances(cleaned_instances)
 
-        # write new aggregated data
+        # write new aggregated data, including the query totals of the run
         data['instances'] = harmonized_instances
+        data['query_statistics'] = release_information['query_statistics']
         if self.args.generate_json.lower() != "false" or self.args.save_to_mongo:
             with open(base_file_name + '_aggregated.json', 'w') as outfile:
                 json.dump(data, outfile, sort_keys=True, indent=4)
@@ -412,11 +430,43 @@ def main(args):
     if args.log_level and hasattr(logging, args.log_level):
         log.setLevel(getattr(logging, args.log_level))
 
-    uri = create_mongodb_uri_string(args.db_user, args.db_password, args.db_hostname, args.db_port, args.db_authentication, args.ssl)
-    connect(args.db_database, host=uri)
+    # the query accounting needs to be registered before the connection is created
+    QUERY_STATS.slow_query_seconds = args.slow_query_seconds
+    QUERY_STATS.count_bytes = args.count_query_bytes
+    monitoring.register(QUERY_STATS)
+
+    recorder = None
+    if args.record_trace:
+        recorder = TraceRecorder(args.record_trace)
+        monitoring.register(recorder)
+
+    # an offline snapshot or a recorded trace replaces the MongoDB
+    server = None
+    if args.snapshot:
+        Snapshot(args.snapshot).connect(release_hash=args.release_commit)
+    elif args.replay_trace:
+        server = ReplayServer(args.replay_trace, latency=args.replay_latency_ms / 1000, fallback=args.replay_fallback)
+        server.start()
+        connect(args.db_database, host='mongodb://{}:{}'.format(*server.server_address))
+    else:
+        uri = create_mongodb_uri_string(args.db_user, args.db_password, args.db_hostname, args.db_port, args.db_authentication, args.ssl)
+        connect(args.db_database, host=uri)
 
     c = SmartsharkPlugin(args)
-    c.start_mining(args.release_commit)
+    try:
+        if args.export_snapshot:
+            c.export_snapshot(args.export_snapshot)
+        else:
+            c.start_mining(args.release_commit)
+
+        # the plans of slow queries are only meaningful on a live database
+        if not args.snapshot and not args.replay_trace:
+            QUERY_STATS.explain_slow_queries(get_connection())
+    finally:
+        if recorder is not None:
+            recorder.close()
+        if server is not None:
+            server.stop()
 
 
 if __name__ == '__main__':
@@ -429,5 +479,15 @@ if __name__ == '__main__':
     parser.add_argument('-ll', '--log-level', help='Log level for stdout (DEBUG, INFO), default INFO', default='INFO')
     parser.add_argument('-gs', '--generate-json', help='Indicate if an additional aggregated JSON file should be generated (True, False).', default='False')
     parser.add_argument('--save-to-mongo', help='Save result to MongoDB', action='store_true')
+    parser.add_argument('--traversal', help='Traversal of the change window, paths (every commit of every change path) or commits (every commit once).', choices=['paths', 'commits'], default='paths')
+    parser.add_argument('--slow-query-seconds', help='Log queries which take longer than this many seconds, their explain() plans are logged after the mining.', type=float, default=1.0)
+    parser.add_argument('--count-query-bytes', help='Count the size of every reply in the query statistics, this encodes every reply again.', action='store_true')
+    parser.add_argument('--export-snapshot', help='Export the data of the project needed by mynbou to mine the release to this directory instead of mining it.', default=None)
+    parser.add_argument('--snapshot', help='Mine the release from a snapshot directory created by --export-snapshot instead of the MongoDB (requires pip install mynbou[snapshot]).', default=None)
+    parser.add_argument('--record-trace', help='Record every MongoDB command and its reply to this file (gzip compressed BSON).', default=None)
+    parser.add_argument('--replay-trace', help='Serve the MongoDB commands from a trace recorded by --record-trace instead of the MongoDB.', default=None)
+    parser.add_argument('--replay-latency-ms', help='Latency in milliseconds injected before every replayed reply.', type=float, default=0.0)
+    parser.add_argument('--replay-fallback', help='Answer replayed commands without exact match with a recorded command of the same name and collection (not deterministic).', action='store_true')
+    parser.add_argument('--cache-dir', help='Directory for the persistent per VCS caches, e.g., the commit graph (default: no caching).', default=None)
 
     main(parser.parse_args())
@@ -1,17 +1,32 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
+import os
+import sys
 import math
 import json
 import importlib
 import unittest
+import unittest.mock
 import datetime
+import tempfile
+
+import numpy.testing
 
 import mongoengine
 from bson.objectid import ObjectId
 
-from pycoshark.mongomodels import VCSSystem, Commit, CodeEntityState, File, FileAction, Issue
+from pycoshark.mongomodels import VCSSystem, Commit, CodeEntityState, CodeGroupState, File, FileAction, Issue, Hunk, Refactoring, CommitChanges, Event
 from mynbou.core import Mynbou
+from mynbou.path import Volg
+from mynbou.cache import GraphCache, RenameCache, ClassMetricCache
+from mynbou.resolver import FileResolver
+from mynbou.inducing import InducingIndex, InducingRow
+from mynbou.prefetch import prefetch_commits, prefetch_file_actions, hunk_counts, prefetch_refactorings, prefetch_commit_changes, class_metric_averages, IssueCache
+from mynbou.lineage import RenameIndex, ReleaseNames
+from mynbou.snapshot import Snapshot
+from mynbou.snapshotdb import SnapshotCollection
+from pycoshark.utils import heuristic_renames
 
 
 class TestDatabase(unittest.TestCase):
@@ -25,6 +40,7 @@ class TestDatabase(unittest.TestCase):
         """Setup the mongomock connection."""
         mongoengine.connection.disconnect()
         mongoengine.connect('testdb', host='mongomock://localhost')
+        FileResolver.reset()
 
     def tearDown(self):
         """Tear down the mongomock connection."""
@@ -40,7 +56,7 @@ class TestDatabase(unittest.TestCase):
         replace_later = {}
 
         # we really have to iterate over collections
-        for col in ['People', 'Project', 'VCSSystem', 'File', 'Commit', 'FileAction', 'CodeEntityState', 'Hunk', 'Issue', 'IssueSystem', 'Identity']:
+        for col in ['People', 'Project', 'VCSSystem', 'File', 'Commit', 'FileAction', 'CodeEntityState', 'Hunk', 'Issue', 'IssueSystem', 'Identity', 'Event']:
             module = importlib.import_module('pycoshark.mongomodels')
             obj = getattr(module, col)
             obj.drop_collection()
@@ -118,6 +134,284 @@ class TestDatabase(unittest.TestCase):
         # File B/B.java has a bugfix even if it was introduced when its name was still D/D.java
         self.assertEqual(instances['B/B.java']['bug_fixes'][0][0], 'IS-1')
 
+        # reverse inducing index, built once by Mynbou and shared with Volg
+        inducing = InducingIndex.from_commits(m.graph.commit_ids())
+        self.assertEqual(len(m.inducing), len(inducing))
+        self.assertIs(Volg(m.graph, vcs, release, lineage=m.lineage, inducing=m.inducing)._inducing_index(), m.inducing)
+        self.assertEqual(inducing.inducing(bugfix_fa.id), [InducingRow(fa1.id, c1.id, f1.id, 'JLMIV+R', 'inducing'), InducingRow(fa2.id, c.id, f2.id, 'JLMIV+R', 'partial_fix')])
+        self.assertEqual(inducing.inducing(bugfix_fa.id, 'JL+R'), [])
+
+    def test_bug_fixes_six_months(self):
+        """Bug fixes of the six months after the release are assigned to the files of the release by the SZZ and JL+R loaders."""
+        self._load_fixture('rename_tracking')
+
+        release = "hash4"
+        c = Commit.objects.get(revision_hash=release)
+        c.code_entity_states = [CodeEntityState.objects.get(s_key="CESFILEARELEASE").id, CodeEntityState.objects.get(s_key="CESFILEBRELEASE").id]
+        c.save()
+
+        # the issue is linked twice to the fix, the fix is only counted once
+        issue = Issue.objects.get(external_id='IS-1')
+        Issue.objects.filter(id=issue.id).update(issue_type='bug')
+        bugfix_commit = Commit.objects.get(revision_hash='hash5')
+        bugfix_commit.labels = {'adjustedszz_bugfix': True, 'issueonly_bugfix': True}
+        bugfix_commit.szz_issue_ids = [issue.id]
+        bugfix_commit.linked_issue_ids = [issue.id, issue.id]
+        bugfix_commit.save()
+
+        bugfix_fa = FileAction.objects.get(commit_id=bugfix_commit.id, file_id=File.objects.get(path='B/B.java').id)
+        fa1 = FileAction.objects.get(commit_id=Commit.objects.get(revision_hash="hash1").id, file_id=File.objects.get(path='D/D.java').id)
+        fa1.induces = [{"change_file_action_id": bugfix_fa.id, "label": "JL+R", "szz_type": "inducing"}]
+        fa1.save()
+
+        vcs = VCSSystem.objects.get(url="http://www.github.com/smartshark/visualSHARK")
+        for limit_type in ['SZZ', 'JL+R']:
+            instances, _ = Mynbou(vcs, 'Testproject', release).release(limit_type)
+            self.assertEqual([fix[:3] for fix in instances['B/B.java']['bug_fixes']], [('IS-1', str(bugfix_commit.committer_date), 'hash5')])
+            self.assertEqual(instances['A/A.java']['bug_fixes'], [])
+
+    def test_snapshot(self):
+        """Mine a release from an exported snapshot and compare it with the release mined from the database."""
+        self._load_fixture('rename_tracking')
+
+        release = "hash4"
+        url = "http://www.github.com/smartshark/visualSHARK"
+        project_name = "Testproject"
+
+        # commits share code entity states, hash5 is not part of the change window of the release
+        ces_ids = [CodeEntityState.objects.get(s_key="CESFILEARELEASE").id, CodeEntityState.objects.get(s_key="CESFILEBRELEASE").id]
+        for revision_hash in ['hash3', release, 'hash5']:
+            Commit.objects.filter(revision_hash=revision_hash).update(code_entity_states=ces_ids)
+
+        # the issue is only fixed according to its events
+        issue = Issue.objects.get(external_id='IS-1')
+        Issue.objects.filter(id=issue.id).update(unset__resolution=True, unset__status=True)
+        Event(issue_id=issue.id, external_id='E-1', status='status', new_value='Closed', created_at=datetime.datetime(2018, 2, 19)).save()
+        Event(issue_id=issue.id, external_id='E-2', status='resolution', new_value='Fixed', created_at=datetime.datetime(2018, 2, 20)).save()
+
+        bugfix_commit = Commit.objects.get(revision_hash='hash5')
+        bugfix_commit.fixed_issue_ids = [issue.id]
+        bugfix_commit.save()
+
+        bugfix_fa = FileAction.objects.get(commit_id=bugfix_commit.id, file_id=File.objects.get(path='B/B.java').id)
+        fa1 = FileAction.objects.get(commit_id=Commit.objects.get(revision_hash="hash1").id, file_id=File.objects.get(path='D/D.java').id)
+        fa1.induces = [{"change_file_action_id": bugfix_fa.id, "label": "JLMIV+R", "szz_type": "inducing"}]
+        fa1.save()
+
+        vcs = VCSSystem.objects.get(url=url)
+        instances, release_information = Mynbou(vcs, project_name, release).release("False")
+        self.assertEqual(instances['B/B.java']['bug_fixes'][0][0], 'IS-1')
+
+        with tempfile.TemporaryDirectory() as snapshot_dir:
+            Snapshot(snapshot_dir).export(vcs, [release])
+            meta = Snapshot(snapshot_dir).meta()
+            self.assertEqual(meta['collections']['commit'], Commit.objects.count())
+            self.assertEqual(meta['release_hashes'], [release])
+            self.assertEqual(meta['collections']['event'], 2)
+
+            # shared code entity states are exported once, only for the commits of the change window
+            self.assertEqual(meta['collections']['code_entity_state'], 2)
+            commits = Snapshot(snapshot_dir).collection('commit')
+            states = dict(zip(commits.column('revision_hash'), commits.column('code_entity_states')))
+            self.assertEqual(states['hash3'], ces_ids)
+            self.assertIsNone(states['hash5'])
+
+            # hunks are reduced to their file action
+            hunk = Snapshot(snapshot_dir).collection('hunk')
+            self.assertEqual(set(hunk.fields.keys()), {'_id', 'file_action_id'})
+            self.assertEqual(hunk.column('file_action_id'), [h.file_action_id for h in Hunk.objects.order_by('id')])
+
+            # mongomock is an optional dependency
+            with unittest.mock.patch.dict(sys.modules, {'mongomock': None}):
+                with self.assertRaisesRegex(Exception, 'mynbou\\[snapshot\\]'):
+                    Snapshot(snapshot_dir).connect()
+
+            with self.assertRaisesRegex(Exception, 'not exported for release hash5'):
+                Snapshot(snapshot_dir).connect(release_hash='hash5')
+
+            Snapshot(snapshot_dir).connect(release_hash=release)
+
+        # the files have to be read from the snapshot, not from the resolver of the first run
+        FileResolver.reset()
+        self.assertEqual(mongoengine.connection.get_db().name, 'mynbou_snapshot')
+        snapshot_instances, snapshot_information = Mynbou(VCSSystem.objects.get(url=url), project_name, release).release("False")
+        self.assertEqual(snapshot_instances['B/B.java']['bug_fixes'][0][0], 'IS-1')
+        self.assertEqual(snapshot_instances, instances)
+
+        # lookups by ids are answered from the index of the column, the snapshot is read-only
+        file_actions = mongoengine.connection.get_db()['file_action']
+        self.assertIsInstance(file_actions, SnapshotCollection)
+        query = {'commit_id': {'$in': [bugfix_commit.id]}, 'mode': 'M'}
+        rows = file_actions._store.candidate_rows(query)
+        self.assertEqual(list(rows), [i for i, fa in enumerate(file_actions._store.documents) if fa['commit_id'] == bugfix_commit.id])
+        self.assertEqual(list(file_actions.find(query)), [fa for fa in file_actions._store.documents if fa['commit_id'] == bugfix_commit.id and fa['mode'] == 'M'])
+        self.assertIsNone(file_actions._store.candidate_rows({'mode': 'M'}))
+        self.assertEqual(FileAction.objects(id=bugfix_fa.id).get().file_id, bugfix_fa.file_id)
+        with self.assertRaisesRegex(Exception, 'read-only'):
+            Commit(vcs_system_id=vcs.id, revision_hash='hash6').save()
+
+        for information in [release_information, snapshot_information]:
+            information.pop('path_statistics')
+            information.pop('query_statistics')
+        self.assertEqual(snapshot_information, release_information)
+
+    def test_issue_cache(self):
+        """Test that the issue cache loads the projected issues once and skips unknown ids."""
+        self._load_fixture('rename_tracking')
+
+        issue = Issue.objects.get(external_id='IS-1')
+        issues = IssueCache()
+        self.assertEqual(issues.issues([issue.id, ObjectId()]), [issues.get(issue.id)])
+        self.assertEqual(len(issues), 1)
+
+        i = issues.get(issue.id)
+        self.assertEqual((i.id, i.external_id, i.issue_type, i.status, i.resolution), (issue.id, issue.external_id, issue.issue_type, issue.status, issue.resolution))
+        with self.assertRaises(Issue.DoesNotExist):
+            issues.get(ObjectId())
+
+    def test_load_graph(self):
+        """Test that the commit graph is loaded with its edges and missing parents are reported."""
+        self._load_fixture('rename_tracking')
+
+        c = Commit.objects.get(revision_hash='hash5')
+        c.parents = ['hash4', 'missinghash']
+        c.save()
+
+        vcs = VCSSystem.objects.get(url="http://www.github.com/smartshark/visualSHARK")
+        with self.assertLogs('Mynbou', level='WARNING') as cm:
+            m = Mynbou(vcs, 'Testproject', 'hash4')
+
+        self.assertEqual(m.graph.nodes(), ['hash1', 'hash2', 'hash3', 'hash4', 'hash5'])
+        self.assertEqual(sorted(m.graph.edges()), [('hash1', 'hash2'), ('hash2', 'hash3'), ('hash3', 'hash4'), ('hash4', 'hash5')])
+        self.assertIn('missinghash', cm.output[0])
+
+        # commit attributes, the missing parent still counts as parent
+        self.assertEqual(m.graph.parent_count('hash5'), 2)
+        self.assertTrue(m.graph.attributes.has_label(m.graph.id_of('hash5'), 'validated_bugfix'))
+        self.assertFalse(m.graph.attributes.has_label(m.graph.id_of('hash4'), 'validated_bugfix'))
+        self.assertEqual(m.graph.object_id_of(m.graph.id_of('hash5')), c.id)
+
+        # a NetworkX subgraph is kept, only the attributes of its nodes are loaded
+        sub = m.graph.to_networkx().subgraph(['hash3', 'hash4', 'hash5'])
+        v = Volg(sub, vcs, 'hash4', lineage=m.lineage)
+        self.assertEqual(v._graph.nodes(), ['hash3', 'hash4', 'hash5'])
+        self.assertEqual(v._graph.parent_count('hash5'), 2)
+        self.assertEqual(v._graph.object_id_of(v._graph.id_of('hash5')), c.id)
+        self.assertTrue(v._graph.attributes.has_label(v._graph.id_of('hash5'), 'validated_bugfix'))
+
+        with self.assertRaises(TypeError):
+            Volg(list(m.graph.nodes()), vcs, 'hash4')
+
+    def test_graph_cache(self):
+        """Test that the cached commit graph equals the loaded one and new commits are appended."""
+        self._load_fixture('rename_tracking')
+
+        vcs = VCSSystem.objects.get(url="http://www.github.com/smartshark/visualSHARK")
+        with tempfile.TemporaryDirectory() as cache_dir:
+            m1 = Mynbou(vcs, 'Testproject', 'hash4')
+            m2 = Mynbou(vcs, 'Testproject', 'hash4', cache_dir=cache_dir)
+            self.assertEqual(sorted(m1.graph.edges()), sorted(m2.graph.edges()))
+            self.assertEqual(m1.graph.committer_date('hash3'), m2.graph.committer_date('hash3'))
+
+            c = Commit(vcs_system_id=vcs.id, revision_hash='hash6', parents=['hash5'], committer_date=datetime.datetime(2018, 3, 1))
+            c.save()
+
+            meta, arrays = GraphCache(cache_dir, vcs.id).refresh()
+            self.assertEqual(meta['count'], 6)
+            self.assertEqual(meta['newest_commit_id'], str(c.id))
+
+            m3 = Mynbou(vcs, 'Testproject', 'hash4', cache_dir=cache_dir)
+            self.assertIn(('hash5', 'hash6'), m3.graph.edges())
+            self.assertEqual(m3.graph.committer_date('hash6'), datetime.datetime(2018, 3, 1))
+
+            # labels set on cached commits after the cache was built are picked up
+            bugfix_commit = Commit.objects.get(revision_hash='hash5')
+            self.assertTrue(m3.graph.attributes.has_label(m3.graph.id_of('hash5'), 'validated_bugfix'))
+            for labels in [{}, {'validated_bugfix': True}]:
+                bugfix_commit.labels = labels
+                bugfix_commit.save()
+                m4 = Mynbou(vcs, 'Testproject', 'hash4', cache_dir=cache_dir)
+                self.assertEqual(m4.graph.attributes.has_label(m4.graph.id_of('hash5'), 'validated_bugfix'), bool(labels))
+            self.assertFalse(os.path.exists(GraphCache(cache_dir, vcs.id)._array_file('label_flags')))
+
+    def test_rename_index(self):
+        """Test that the rename index matches the per commit rename heuristic and is extended by the cache."""
+        self._load_fixture('rename_tracking')
+
+        vcs = VCSSystem.objects.get(url="http://www.github.com/smartshark/visualSHARK")
+        m = Mynbou(vcs, 'Testproject', 'hash4')
+        for c in Commit.objects.filter(vcs_system_id=vcs.id):
+            self.assertEqual(m.lineage.renames(c.id), heuristic_renames(vcs.id, c.revision_hash))
+        self.assertEqual(m.lineage.renames(Commit.objects.get(revision_hash='hash3').id), ([('C/C.java', 'B/B.java')], []))
+        self.assertEqual(m.lineage.additions(Commit.objects.get(revision_hash='hash1').id), ['A/A.java', 'D/D.java'])
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cached = RenameCache(cache_dir, vcs.id).refresh(m.graph.commit_ids())
+            self.assertEqual(cached.to_dict(), m.lineage.to_dict())
+
+            # duplicate renames of the same file, the most similar name is the true rename
+            c = Commit(vcs_system_id=vcs.id, revision_hash='hash6', parents=['hash5'], committer_date=datetime.datetime(2018, 3, 1))
+            c.save()
+            old = File.objects.get(path='B/B.java')
+            for path in ['X/Other.java', 'B/B2.java']:
+                f = File(vcs_system_id=vcs.id, path=path)
+                f.save()
+                FileAction(commit_id=c.id, file_id=f.id, old_file_id=old.id, mode='R').save()
+
+            m2 = Mynbou(vcs, 'Testproject', 'hash4', cache_dir=cache_dir)
+            self.assertEqual(m2.lineage.renames(c.id), ([('B/B.java', 'B/B2.java')], ['X/Other.java']))
+            self.assertEqual(RenameCache(cache_dir, vcs.id).load()['count'], 6)
+            self.assertEqual(len(RenameIndex.from_commits(vcs.id, m2.graph.commit_ids())), len(m2.lineage))
+
+    def test_release_names(self):
+        """Test that the forward sweep translates names of descendants like the path based calculation."""
+        self._load_fixture('rename_tracking')
+
+        vcs = VCSSystem.objects.get(url="http://www.github.com/smartshark/visualSHARK")
+        m = Mynbou(vcs, 'Testproject', 'hash1')
+        v = Volg(m.graph, vcs, 'hash1', lineage=m.lineage)
+        names = ReleaseNames(m.graph, m.lineage, 'hash1')
+
+        self.assertEqual(len(names), 5)
+        files = {'A/A.java', 'B/B.java', 'C/C.java'}
+        for c in Commit.objects.filter(vcs_system_id=vcs.id):
+            want, path_valid = v.calc_current_files(c, v._release_commit, files)
+            self.assertTrue(path_valid)
+            self.assertEqual(names.at_release(c.revision_hash, files), want)
+            self.assertEqual(v.files_at_release(c, files), (want, True))
+
+        self.assertEqual(names.at_release('hash4', files), {'A/A.java', 'D/D.java'})
+
+        # commits which are not descendants of the release are not part of the sweep
+        self.assertNotIn('hash1', ReleaseNames(m.graph, m.lineage, 'hash2'))
+
+    def test_file_resolver(self):
+        """Test the file id -> path mapping, its reverse lookup and files added after loading."""
+        self._load_fixture('rename_tracking')
+
+        vcs = VCSSystem.objects.get(url="http://www.github.com/smartshark/visualSHARK")
+        files = FileResolver.for_vcs(vcs.id)
+        self.assertIs(FileResolver.for_vcs(vcs.id), files)
+        self.assertEqual(len(files), 4)
+
+        f = File.objects.get(path='B/B.java')
+        self.assertEqual(files.path(f.id), 'B/B.java')
+        self.assertEqual(files.id('B/B.java'), f.id)
+        self.assertEqual(files.ids('X/X.java'), [])
+
+        # files added after the resolver was loaded
+        f2 = File(vcs_system_id=vcs.id, path='E/E.java')
+        f2.save()
+        self.assertEqual(files.path(f2.id), 'E/E.java')
+        self.assertEqual(files.ids('E/E.java'), [f2.id])
+        with self.assertRaises(File.DoesNotExist):
+            files.path(ObjectId())
+
+        # a reset resolver is loaded again from the database
+        FileResolver.reset(vcs.id)
+        self.assertIsNot(FileResolver.for_vcs(vcs.id), files)
+        self.assertEqual(len(FileResolver.for_vcs(vcs.id)), 5)
+
     def test_rename_tracking(self):
         """Simple test for tracking subsequent renames of a file."""
         self._load_fixture('rename_tracking')
@@ -285,6 +579,158 @@ class TestDatabase(unittest.TestCase):
         self.maxDiff = None
         self.assertEqual(dambros, want)
 
+        # the averaged class metrics are materialised per commit and reused by later runs
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cached_instances, _ = Mynbou(vcs, project_name, release, cache_dir=cache_dir).release("False")
+            self.assertEqual(cached_instances, instances)
+
+            stored = ClassMetricCache(cache_dir, vcs.id)._load(c.id)
+            self.assertEqual(sorted(stored.keys()), sorted(CodeEntityState.objects.get(id=ces_id).file_id for ces_id in [ces7.id, ces8.id]))
+            for file_id, values in class_metric_averages(c.code_entity_states).items():
+                numpy.testing.assert_array_equal(stored[file_id], values)
+
+            reloaded_instances, _ = Mynbou(vcs, project_name, release, cache_dir=cache_dir).release("False")
+            self.assertEqual(reloaded_instances, instances)
+
+    def test_change_traversal_commits(self):
+        """Test that the commit traversal of the change window yields the same metrics as the change paths."""
+        self._load_fixture('change_metrics')
+
+        release = "hash6"
+        c = Commit.objects.get(revision_hash=release)
+        c.code_entity_states = [ObjectId(CodeEntityState.objects.get(s_key=k).id) for k in ["CESFORCOMMIT5FILE1", "CESFORCOMMIT5FILE2", "CESFORCOMMIT5FILE3"]]
+        c.save()
+
+        vcs = VCSSystem.objects.get(url="http://www.github.com/smartshark/visualSHARK")
+        paths_instances, paths_information = Mynbou(vcs, "Testproject", release).release("False")
+        commits_instances, commits_information = Mynbou(vcs, "Testproject", release, traversal='commits').release("False")
+
+        self.maxDiff = None
+        self.assertEqual(commits_instances, paths_instances)
+
+        paths_statistics = paths_information.pop('path_statistics')
+        commits_statistics = commits_information.pop('path_statistics')
+        self.assertEqual(commits_information, paths_information)
+
+        # origin paths are never needed, change paths only in the path traversal
+        self.assertIsNone(paths_statistics['origin_paths'])
+        self.assertIsNone(commits_statistics['origin_paths'])
+        self.assertIsNone(commits_statistics['change_paths'])
+        self.assertEqual(commits_statistics['change_window_commits'], len(commits_information['change_path_commits']))
+        self.assertGreater(paths_statistics['change_paths'], 0)
+
+        v = Volg(Mynbou(vcs, "Testproject", release).graph, vcs, release)
+        self.assertIsNone(v.path_statistics['origin_paths'])
+        self.assertEqual(len(v.origin_paths), v.path_statistics['origin_paths'])
+        self.assertEqual(v.origin_paths[0][0], release)
+
+        with self.assertRaises(Exception):
+            Mynbou(vcs, "Testproject", release, traversal='nodes').release("False")
+
+    def test_prefetch_file_actions(self):
+        """Test that the prefetched FileActions are grouped by commit like the per commit queries."""
+        self._load_fixture('change_metrics')
+
+        commits = list(Commit.objects.all())
+        file_actions = prefetch_file_actions([c.id for c in commits])
+        for c in commits:
+            want = [(fa.id, fa.file_id, fa.mode, fa.lines_added, fa.lines_deleted) for fa in FileAction.objects.filter(commit_id=c.id)]
+            self.assertEqual([(fa.id, fa.file_id, fa.mode, fa.lines_added, fa.lines_deleted) for fa in file_actions.get(c.id, [])], want)
+
+        hunks = hunk_counts(file_actions)
+        self.assertEqual(set(hunks.keys()), set(file_actions.keys()))
+        for commit_id, count in hunks.items():
+            self.assertEqual(count, Hunk.objects.filter(file_action_id__in=[fa.id for fa in FileAction.objects.filter(commit_id=commit_id)]).count())
+        self.assertGreater(sum(hunks.values()), 0)
+
+        # the commits of the change window are prefetched with the fields used by the change metrics
+        rows = prefetch_commits([c.id for c in commits])
+        self.assertEqual(len(rows), len(commits))
+        for c in commits:
+            self.assertEqual((rows[c.id].revision_hash, rows[c.id].parents, rows[c.id].committer_date, rows[c.id].author_id, rows[c.id].message, rows[c.id].linked_issue_ids),
+                             (c.revision_hash, c.parents, c.committer_date, c.author_id, c.message, c.linked_issue_ids))
+
+    def test_refactorings(self):
+        """Test that refactorings are joined to their file and counted once per commit."""
+        self._load_fixture('change_metrics')
+        Refactoring.drop_collection()
+
+        release = "hash6"
+        c = Commit.objects.get(revision_hash=release)
+        ces1 = CodeEntityState.objects.get(s_key="CESFORCOMMIT5FILE1")
+        ces2 = CodeEntityState.objects.get(s_key="CESFORCOMMIT5FILE2")
+        c.code_entity_states = [ObjectId(ces1.id), ObjectId(ces2.id), ObjectId(CodeEntityState.objects.get(s_key="CESFORCOMMIT5FILE3").id)]
+        c.save()
+
+        # the same refactoring twice, one in another file and one without state after the refactoring
+        for ces in [ces1, ces1, ces2]:
+            Refactoring(commit_id=c.id, type='rename_method', ce_state={'ce_after': ces.id}).save()
+        Refactoring(commit_id=c.id, type='extract_method', ce_state={'ce_before': ces1.id}).save()
+
+        refactorings = prefetch_refactorings([c.id])
+        self.assertEqual(sorted(refactorings[c.id]), sorted([('test.java', 'rename_method', ces1.long_name)] * 2 + [('test2.java', 'rename_method', ces2.long_name)]))
+
+        vcs = VCSSystem.objects.get(url="http://www.github.com/smartshark/visualSHARK")
+        v = Volg(Mynbou(vcs, "Testproject", release).graph, vcs, release, traversal='commits')
+        metrics = v.change_metrics()
+        self.assertEqual(metrics['test.java']['refactorings'], ['rename_method'])
+        self.assertEqual(metrics['test2.java']['refactorings'], ['rename_method'])
+        self.assertEqual(metrics['test3.java']['refactorings'], [])
+
+    def test_change_types(self):
+        """Test that the change type classification of the window is loaded in bulk and assigned to the release files."""
+        self._load_fixture('change_metrics')
+        CommitChanges.drop_collection()
+
+        release = "hash6"
+        c = Commit.objects.get(revision_hash=release)
+        c.code_entity_states = [ObjectId(CodeEntityState.objects.get(s_key=k).id) for k in ["CESFORCOMMIT5FILE1", "CESFORCOMMIT5FILE2", "CESFORCOMMIT5FILE3"]]
+        c.save()
+        prev = Commit.objects.get(revision_hash='hash5')
+        file1 = File.objects.get(path='test.java')
+        file3 = File.objects.get(path='test3.java')
+        CommitChanges(old_commit_id=prev.id, new_commit_id=c.id, classification={str(file1.id): {'Computation': 2, 'data': 1}, str(file3.id): {'other': 1}}).save()
+
+        # not the first parent of the commit
+        CommitChanges(old_commit_id=c.id, new_commit_id=prev.id, classification={str(file1.id): {'data': 5}}).save()
+
+        commit_changes = prefetch_commit_changes([c.id, prev.id])
+        self.assertEqual(commit_changes[(prev.id, c.id)][file1.id].tolist(), [2, 1, 0, 0, 0])
+
+        vcs = VCSSystem.objects.get(url="http://www.github.com/smartshark/visualSHARK")
+        v = Volg(Mynbou(vcs, "Testproject", release).graph, vcs, release, traversal='commits')
+        metrics = v.change_metrics()
+        self.assertEqual(metrics['test.java']['change_types'], [{'computation': 2, 'data': 1, 'interface': 0, 'logic/control': 0, 'other': 0}])
+        self.assertEqual(metrics['test2.java']['change_types'], [])
+        self.assertEqual(metrics['test3.java']['change_types'], [{'computation': 0, 'data': 0, 'interface': 0, 'logic/control': 0, 'other': 1}])
+
+        # the change type vectors are kept internally, a second call returns the same metrics
+        self.assertEqual(v.change_metrics(), metrics)
+
+    def test_package_metrics(self):
+        """Test that package metrics are assigned via the classes of a file."""
+        self._load_fixture('change_metrics')
+        CodeGroupState.drop_collection()
+
+        vcs = VCSSystem.objects.get(url="http://www.github.com/smartshark/visualSHARK")
+        c = Commit.objects.get(revision_hash='hash6')
+        f = File(vcs_system_id=vcs.id, path='src/org/foo/A.java')
+        f.save()
+
+        states = [CodeEntityState(s_key='PKGFILE', commit_id=c.id, file_id=f.id, ce_type='file', long_name='src/org/foo/A.java', metrics={'LOC': 10}),
+                  CodeEntityState(s_key='PKGCLASS', commit_id=c.id, file_id=f.id, ce_type='class', long_name='org.foo.A', metrics={'WMC': 1}),
+                  CodeEntityState(s_key='PKGOTHER', commit_id=c.id, file_id=File.objects.get(path='test.java').id, ce_type='class', long_name='org.bar.A', metrics={'WMC': 2})]
+        for ces in states:
+            ces.save()
+        c.code_entity_states = [ces.id for ces in states]
+        c.save()
+
+        CodeGroupState(s_key='PKGFOO', commit_id=c.id, cg_type='package', long_name='org.foo', metrics={'LOC': 5, 'Android Rules': 1, 'Basic Rules': 2}).save()
+        CodeGroupState(s_key='PKGBAR', commit_id=c.id, cg_type='package', long_name='org.bar', metrics={'LOC': 7}).save()
+
+        metrics = Mynbou(vcs, 'Testproject', 'hash6')._release_metrics('hash6', ['src/org/foo/A.java'])
+        self.assertEqual(metrics, {'src/org/foo/A.java': {'SM_file_loc': 10, 'imports': [], 'SM_class_wmc': [1], 'SM_package_loc': 5}})
+
     def test_change(self):
         """Test Moser and Hassan change metrics."""
         self._load_fixture('change_metrics')
@@ -338,6 +784,12 @@ class TestDatabase(unittest.TestCase):
         self.maxDiff = None
         self.assertEqual(churn, churn_wanted)
 
+        # static source code metrics of the release
+        static = {file: {k: v for k, v in values.items() if k.startswith('SM_') or k == 'imports'} for file, values in instances.items()}
+        self.assertEqual(static, {'test.java': {'SM_file_metrica': 40, 'SM_file_metricb': -5, 'imports': []},
+                                  'test2.java': {'SM_file_metrica': 10, 'SM_file_metricb': 0.99, 'imports': []},
+                                  'test3.java': {'SM_file_metrica': 10, 'SM_file_metricb': 0.99, 'imports': []}})
+
         # moser calculation
         moser_wanted = {'test.java': {'MOSER_weighted_age': (0 * 3 + 2 * 3 + 4 * 0 + 4 * 2 + 23 * 3) / 11,
                                       'MOSER_authors': 1},
@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+import datetime
+
+import networkx as nx
+
+from mynbou.graph import CommitGraph
+
+
+class TestCommitGraph(unittest.TestCase):
+    """Compare the compact commit graph against NetworkX on a small DAG with branches and merges."""
+
+    def setUp(self):
+        g = nx.DiGraph()
+        for i, n in enumerate(['a', 'b', 'c', 'd', 'e', 'f', 'g']):
+            g.add_node(n, committer_date=datetime.datetime(2018, 1, i + 1))
+
+        # a - b - c - e - g
+        #      \     /
+        #       d - -   f (branch from b)
+        g.add_edges_from([('a', 'b'), ('b', 'c'), ('b', 'd'), ('c', 'e'), ('d', 'e'), ('e', 'g'), ('b', 'f')])
+        self.nx_graph = g
+        self.graph = CommitGraph.from_networkx(g)
+
+    def test_neighbors(self):
+        for n in self.nx_graph.nodes():
+            self.assertEqual(list(self.graph.predecessors(n)), list(self.nx_graph.predecessors(n)))
+            self.assertEqual(sorted(self.graph.successors(n)), sorted(self.nx_graph.successors(n)))
+        self.assertTrue(self.graph.has_edge('b', 'f'))
+        self.assertFalse(self.graph.has_edge('f', 'b'))
+
+    def test_reachability(self):
+        for n in self.nx_graph.nodes():
+            self.assertEqual(self.graph.ancestors(n), nx.ancestors(self.nx_graph, n))
+            for m in self.nx_graph.nodes():
+                self.assertEqual(self.graph.has_path(n, m), nx.has_path(self.nx_graph, n, m))
+
+    def test_all_shortest_paths(self):
+        undirected = self.nx_graph.to_undirected(as_view=True)
+        for n in self.nx_graph.nodes():
+            for m in self.nx_graph.nodes():
+                want = sorted(nx.all_shortest_paths(undirected, n, m))
+                self.assertEqual(sorted(self.graph.all_shortest_paths(n, m)), want)
+
+    def test_networkx_adapter(self):
+        g = self.graph.to_networkx()
+        self.assertEqual(sorted(g.edges()), sorted(self.nx_graph.edges()))
+        self.assertEqual(g.nodes['e']['committer_date'], datetime.datetime(2018, 1, 5))
+        self.assertEqual(self.graph.committer_date('e'), datetime.datetime(2018, 1, 5))
+
+    def test_history_window(self):
+        # every commit once, children before parents, newer branches first
+        self.assertEqual(self.graph.history_window('g', datetime.datetime(2018, 1, 1)), ['g', 'e', 'd', 'c', 'b', 'a'])
+
+        # commits older than the cutoff are not part of the window
+        self.assertEqual(self.graph.history_window('g', datetime.datetime(2018, 1, 2)), ['g', 'e', 'd', 'c', 'b'])
+        self.assertEqual(self.graph.history_window('g', datetime.datetime(2018, 1, 5)), ['g', 'e'])
+        self.assertEqual(self.graph.history_window('f', datetime.datetime(2018, 1, 1)), ['f', 'b', 'a'])
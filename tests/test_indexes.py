@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import mongoengine
+from mongoengine.connection import get_db
+
+from pycoshark.mongomodels import FileAction, Hunk
+from mynbou.indexes import QUERY_SHAPES, QueryShape, advise, covering_index, plan_stages, create_index_statement
+
+
+class TestIndexAdvisor(unittest.TestCase):
+    """Check the index advisor on a mongomock database without explain()."""
+
+    def setUp(self):
+        mongoengine.connection.disconnect()
+        mongoengine.connect('testdb', host='mongomock://localhost')
+        for name in ['hunk', 'file_action']:
+            get_db().drop_collection(name)
+
+    def tearDown(self):
+        mongoengine.connection.disconnect()
+
+    def test_covering_index(self):
+        shape = QueryShape(FileAction, [('commit_id', None), ('mode', None)], '')
+        indexes = {'_id_': {'key': [('_id', 1)]}}
+        self.assertIsNone(covering_index(indexes, shape))
+
+        # the fields of the shape have to be a prefix of the index, in any order
+        indexes['mode_1_file_id_1'] = {'key': [('mode', 1), ('file_id', 1)]}
+        self.assertIsNone(covering_index(indexes, shape))
+        indexes['mode_1_commit_id_1_file_id_1'] = {'key': [('mode', 1), ('commit_id', 1), ('file_id', 1)]}
+        self.assertEqual(covering_index(indexes, shape), 'mode_1_commit_id_1_file_id_1')
+
+        self.assertEqual(covering_index(indexes, QueryShape(FileAction, [('_id', None), ('mode', None)], '')), '_id_')
+
+    def test_plan_stages(self):
+        plan = {'stage': 'FETCH', 'inputStage': {'stage': 'OR', 'inputStages': [{'stage': 'IXSCAN'}, {'stage': 'COLLSCAN'}]}}
+        self.assertEqual(plan_stages(plan), ['FETCH', 'OR', 'IXSCAN', 'COLLSCAN'])
+        self.assertEqual(plan_stages({'stage': 'COLLSCAN'}), ['COLLSCAN'])
+
+    def test_call_sites(self):
+        shapes = {shape.call_site: shape for shape in QUERY_SHAPES}
+        self.assertEqual(dict(shapes['lineage.scan_lineage'].fields)['mode'], {'$in': ['R', 'A', 'C']})
+        self.assertEqual([name for name, _ in shapes['path.Volg.issues'].fields], ['vcs_system_id', 'fixed_issue_ids', 'committer_date'])
+        self.assertEqual([name for name, _ in shapes['path.Volg six month loaders'].fields], ['_id'])
+        self.assertEqual(create_index_statement(shapes['pycoshark.utils.jira_is_resolved_and_fixed via path.Volg issue loaders']), 'db.event.createIndex({"issue_id": 1})')
+
+    def test_advise(self):
+        position = [s.model for s in QUERY_SHAPES].index(Hunk)
+        hunk_shape = QUERY_SHAPES[position]
+        self.assertEqual(create_index_statement(hunk_shape), 'db.hunk.createIndex({"file_action_id": 1})')
+
+        db = get_db()
+        db['hunk'].insert_one({'file_action_id': None})
+        advice = advise()
+        self.assertEqual([a.shape for a in advice], QUERY_SHAPES)
+
+        # without explain() the index information decides
+        self.assertIsNone(advice[position].stages)
+        self.assertTrue(advice[position].collscan)
+
+        db['hunk'].create_index([('file_action_id', 1)])
+        advice = advise()
+        self.assertEqual(advice[position].index, 'file_action_id_1')
+        self.assertFalse(advice[position].collscan)
+
+        # the advisor does not create indexes through mongoengine
+        self.assertEqual(list(db['file_action'].index_information().keys()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,111 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import os
+import timeit
+import tempfile
+import unittest
+from collections import namedtuple
+
+import bson
+import pymongo
+from pymongo import MongoClient
+
+from mynbou.mongotrace import TraceRecorder, ReplayServer, read_trace
+
+StartedEvent = namedtuple('StartedEvent', ['command_name', 'command', 'connection_id', 'request_id', 'database_name'])
+SucceededEvent = namedtuple('SucceededEvent', ['command_name', 'reply', 'connection_id', 'request_id', 'duration_micros'])
+
+
+class TestTrace(unittest.TestCase):
+    """Record a trace and replay it to a pymongo client through the wire protocol."""
+
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def _record(self, name, commands):
+        """Record (command, reply) pairs as the listener would see them."""
+        recorder = TraceRecorder(os.path.join(self._dir.name, name))
+        for request_id, (command, reply) in enumerate(commands):
+            command_name = next(iter(command.keys()))
+            recorder.started(StartedEvent(command_name, command, 1, request_id, 'testdb'))
+            recorder.succeeded(SucceededEvent(command_name, reply, 1, request_id, 100))
+        recorder.close()
+        return recorder.path
+
+    def _find(self, revision_hash, document_id):
+        command = bson.SON([('find', 'commit'), ('filter', {'revision_hash': revision_hash}), ('lsid', {'id': 1}), ('$db', 'testdb')])
+        reply = {'cursor': {'firstBatch': [{'_id': document_id, 'revision_hash': revision_hash}], 'id': 0, 'ns': 'testdb.commit'}, 'ok': 1.0}
+        return command, reply
+
+    def test_record_replay(self):
+        trace = self._record('trace', [self._find('a', 1), self._find('b', 2)])
+
+        entries = list(read_trace(trace))
+        self.assertEqual([e['command_name'] for e in entries], ['find', 'find'])
+
+        # driver keys are not part of the trace
+        self.assertEqual(list(entries[0]['command'].keys()), ['find', 'filter'])
+
+        server = ReplayServer(trace)
+        server.start()
+        replayed = os.path.join(self._dir.name, 'replayed')
+        recorder = TraceRecorder(replayed)
+        try:
+            client = MongoClient(*server.server_address, event_listeners=[recorder], serverSelectionTimeoutMS=5000)
+
+            # replies are matched by the command, not by the recorded order
+            self.assertEqual(list(client.testdb.commit.find({'revision_hash': 'b'})), [{'_id': 2, 'revision_hash': 'b'}])
+            self.assertEqual(list(client.testdb.commit.find({'revision_hash': 'a'})), [{'_id': 1, 'revision_hash': 'a'}])
+
+            # every recorded reply is only served once
+            with self.assertRaises(pymongo.errors.OperationFailure):
+                list(client.testdb.commit.find({'revision_hash': 'a'}))
+            client.close()
+        finally:
+            recorder.close()
+            server.stop()
+
+        self.assertEqual(server.replayed, 2)
+        self.assertEqual(server.missing, 1)
+
+        # replaying records the same commands again
+        self.assertEqual([e['command'] for e in read_trace(replayed)][:2], [entries[1]['command'], entries[0]['command']])
+
+    def test_fallback_and_latency(self):
+        # the recorded filter differs from the replayed one, e.g., because it contained the current time
+        trace = self._record('trace', [self._find('a', 1)])
+
+        server = ReplayServer(trace, latency=0.2, fallback=True)
+        server.start()
+        try:
+            client = MongoClient(*server.server_address, serverSelectionTimeoutMS=5000)
+            client.admin.command('ping')
+
+            start = timeit.default_timer()
+            self.assertEqual(list(client.testdb.commit.find({'revision_hash': 'c'})), [{'_id': 1, 'revision_hash': 'a'}])
+            self.assertGreaterEqual(timeit.default_timer() - start, 0.2)
+            client.close()
+        finally:
+            server.stop()
+        self.assertEqual(server.replayed, 0)
+        self.assertEqual(server.fallbacks, 1)
+
+        # without fallback the command fails
+        server = ReplayServer(trace)
+        server.start()
+        try:
+            client = MongoClient(*server.server_address, serverSelectionTimeoutMS=5000)
+            with self.assertRaises(pymongo.errors.OperationFailure):
+                list(client.testdb.commit.find({'revision_hash': 'c'}))
+            client.close()
+        finally:
+            server.stop()
+        self.assertEqual((server.replayed, server.fallbacks, server.missing), (0, 0, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import random
+import unittest
+
+import networkx as nx
+
+from mynbou.graph import CommitGraph
+from mynbou.path import OntdekBaan
+
+
+def legacy_bfs_paths(graph, source, predecessors, break_condition):
+    """Path discovery as it was implemented before the tail map, used as reference."""
+    paths = {0: [source]}
+    visited = set()
+    queue = [(source, predecessors(source))]
+    while queue:
+        parent, children = queue[0]
+        try:
+            child = next(children)
+            if (parent, child) not in visited:
+                break_child = break_condition is not None and break_condition(child)
+                if not break_child:
+                    for path_num, nodes in paths.items():
+                        if parent == nodes[-1]:
+                            paths[path_num].append(child)
+                            break
+                    else:
+                        paths[len(paths)] = [parent, child]
+                visited.add((parent, child))
+                if not break_child:
+                    queue.append((child, predecessors(child)))
+        except StopIteration:
+            queue.pop(0)
+    return list(paths.values())
+
+
+def random_dag(nodes, merge_probability, seed):
+    """Create a random commit graph where every commit has one or two parents among the previous commits."""
+    rnd = random.Random(seed)
+    g = nx.DiGraph()
+    g.add_node(0)
+    for n in range(1, nodes):
+        g.add_edge(rnd.randrange(max(0, n - 5), n), n)
+        if n > 2 and rnd.random() < merge_probability:
+            g.add_edge(rnd.randrange(0, n - 1), n)
+    return g
+
+
+class TestOntdekBaan(unittest.TestCase):
+    """Compare the path discovery against the reference implementation."""
+
+    def test_all_paths(self):
+        for seed in range(10):
+            g = CommitGraph.from_networkx(random_dag(80, 0.2, seed))
+            for direction, start, predecessors in [('backward', 79, g.predecessors), ('forward', 0, g.successors)]:
+                o = OntdekBaan(g)
+                o.set_path(start, direction)
+                self.assertEqual(list(o.all_paths()), legacy_bfs_paths(g, start, predecessors, None))
+
+    def test_all_paths_break_condition(self):
+        def break_condition(commit):
+            return commit < 30
+
+        for seed in range(10):
+            g = CommitGraph.from_networkx(random_dag(80, 0.3, seed))
+            o = OntdekBaan(g)
+            o.set_path(79, 'backward', break_condition)
+            self.assertEqual(list(o.all_paths()), legacy_bfs_paths(g, 79, g.predecessors, break_condition))
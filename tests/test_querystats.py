@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+import unittest
+from collections import namedtuple
+
+from mynbou.querystats import QueryStats
+
+StartedEvent = namedtuple('StartedEvent', ['command_name', 'command', 'connection_id', 'request_id', 'database_name'])
+FinishedEvent = namedtuple('FinishedEvent', ['command_name', 'reply', 'connection_id', 'request_id', 'duration_micros'])
+
+
+class TestQueryStats(unittest.TestCase):
+    """Drive the listener with events as pymongo emits them, mongomock does not publish command events."""
+
+    def _query(self, stats, request_id, command_name, command, reply, duration_micros):
+        stats.started(StartedEvent(command_name, command, 'conn', request_id, 'test'))
+        stats.succeeded(FinishedEvent(command_name, reply, 'conn', request_id, duration_micros))
+
+    def test_phases(self):
+        stats = QueryStats(count_bytes=True)
+
+        with stats.phase('graph'):
+            self._query(stats, 1, 'find', {'find': 'commit', 'filter': {}}, {'cursor': {'firstBatch': [{'a': 1}, {'a': 2}], 'id': 1}, 'ok': 1}, 1000)
+            self._query(stats, 2, 'getMore', {'getMore': 1, 'collection': 'commit'}, {'cursor': {'nextBatch': [{'a': 3}], 'id': 0}, 'ok': 1}, 500)
+        with stats.phase('issues'):
+            self._query(stats, 3, 'distinct', {'distinct': 'issue', 'key': 'status'}, {'values': ['open', 'closed'], 'ok': 1}, 2000)
+        self._query(stats, 4, 'aggregate', {'aggregate': 'file_action', 'pipeline': []}, {'cursor': {'firstBatch': [], 'id': 0}, 'ok': 1}, 100)
+
+        summary = stats.summary()
+        self.assertEqual(summary['slow_queries'], 0)
+        self.assertEqual(summary['total']['queries'], 4)
+        self.assertEqual(summary['total']['documents'], 5)
+        self.assertAlmostEqual(summary['total']['seconds'], 0.0036)
+        self.assertGreater(summary['total']['bytes'], 0)
+
+        self.assertEqual(set(summary['phases'].keys()), {'graph', 'issues', 'other'})
+        graph = summary['phases']['graph']
+        self.assertEqual(graph['total']['queries'], 2)
+        self.assertEqual(graph['total']['documents'], 3)
+        self.assertEqual(list(graph['collections'].keys()), ['commit'])
+        self.assertEqual(summary['phases']['issues']['collections']['issue']['documents'], 2)
+        self.assertEqual(summary['phases']['other']['collections']['file_action']['queries'], 1)
+
+        # the queries are issued from the tests, not from mynbou
+        self.assertEqual(list(graph['call_sites'].keys()), ['unknown'])
+
+        stats.reset()
+        self.assertEqual(stats.summary()['total']['queries'], 0)
+
+        # replies are only encoded again to count their size if asked to
+        stats = QueryStats()
+        self._query(stats, 1, 'find', {'find': 'commit', 'filter': {}}, {'cursor': {'firstBatch': [{'a': 1}], 'id': 0}, 'ok': 1}, 1000)
+        summary = stats.summary()
+        self.assertFalse(summary['count_bytes'])
+        self.assertEqual((summary['total']['documents'], summary['total']['bytes']), (1, 0))
+
+    def test_failed_and_slow(self):
+        stats = QueryStats(slow_query_seconds=0.5)
+
+        # only getMore is slow, it can not be explained
+        self._query(stats, 1, 'find', {'find': 'commit', 'filter': {}}, {'cursor': {'firstBatch': [], 'id': 1}, 'ok': 1}, 1000)
+        self._query(stats, 2, 'getMore', {'getMore': 1, 'collection': 'commit'}, {'cursor': {'nextBatch': [], 'id': 0}, 'ok': 1}, 600000)
+
+        stats.started(StartedEvent('find', {'find': 'file'}, 'conn', 3, 'test'))
+        stats.failed(FinishedEvent('find', None, 'conn', 3, 1000))
+
+        # events of unknown requests are ignored
+        stats.succeeded(FinishedEvent('find', {'ok': 1}, 'conn', 99, 1000))
+
+        summary = stats.summary()
+        self.assertEqual(summary['slow_queries'], 1)
+        self.assertEqual(summary['total']['queries'], 3)
+        self.assertEqual(summary['phases']['other']['collections']['file']['documents'], 0)
+
+        # the slow query is kept but not explained by the callbacks
+        slow = stats.slow_queries()
+        self.assertEqual([(q.command_name, q.collection, q.command) for q in slow], [('getMore', 'commit', None)])
+        self.assertEqual(stats.explain_slow_queries(None), [])
+
+    def test_explain_slow_queries(self):
+        stats = QueryStats(slow_query_seconds=0.5)
+        commands = []
+
+        class Database(object):
+            def command(self, name, command, verbosity):
+                # the explain is sent through the listener as well, it is not accounted
+                stats.started(StartedEvent('explain', {'explain': command}, 'conn', 10, 'test'))
+                stats.succeeded(FinishedEvent('explain', {'ok': 1}, 'conn', 10, 1000))
+                commands.append((name, command, verbosity))
+                return {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN'}}}
+
+        command = {'find': 'commit', 'filter': {'revision_hash': 'a'}, 'lsid': {'id': 1}, '$db': 'test'}
+        with stats.phase('graph'):
+            self._query(stats, 1, 'find', command, {'cursor': {'firstBatch': [], 'id': 0}, 'ok': 1}, 600000)
+        self.assertEqual(commands, [])
+
+        explained = stats.explain_slow_queries({'test': Database()})
+        self.assertEqual(commands, [('explain', {'find': 'commit', 'filter': {'revision_hash': 'a'}}, 'queryPlanner')])
+        self.assertEqual(len(explained), 1)
+        self.assertEqual(explained[0][0].phase, 'graph')
+        self.assertEqual(explained[0][1], {'winningPlan': {'stage': 'COLLSCAN'}})
+        self.assertEqual(stats.summary()['total']['queries'], 1)
+
+    def test_thread_phases(self):
+        stats = QueryStats()
+
+        def query():
+            self._query(stats, 2, 'find', {'find': 'file', 'filter': {}}, {'cursor': {'firstBatch': [], 'id': 0}, 'ok': 1}, 100)
+
+        # the phase of one thread does not leak into another one
+        with stats.phase('graph'):
+            self.assertEqual(stats.current_phase(), 'graph')
+            t = threading.Thread(target=query)
+            t.start()
+            t.join()
+        self.assertEqual(stats.current_phase(), 'other')
+        self.assertEqual(list(stats.summary()['phases'].keys()), ['other'])
+
+
+if __name__ == '__main__':
+    unittest.main()